@@ -100,6 +100,40 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/2.2/topics/cache/
+#
+# The local-memory cache is not shared between processes, in production it should be
+# replaced (in local_settings.py) by a cache all workers can access, for example:
+#
+# CACHES = {
+#     'default': {
+#         'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+#         'LOCATION': '/var/tmp/stura_voting_cache',
+#         'TIMEOUT': 60 * 60,
+#     }
+# }
+#
+# or a memcached / Redis-compatible server running on the same machine
+# (the latter requires the django-redis package):
+#
+# CACHES = {
+#     'default': {
+#         'BACKEND': 'django_redis.cache.RedisCache',
+#         'LOCATION': 'redis://127.0.0.1:6379/1',
+#         'TIMEOUT': 60 * 60,
+#     }
+# }
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'stura-voting',
+        'TIMEOUT': 60 * 60,
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/2.0/ref/settings/#auth-password-validators
 
@@ -14,4 +14,29 @@
 
 from django.contrib import admin
 
-# Register your models here.
+from .models import QuorumRule, BallotEvent
+
+
+@admin.register(QuorumRule)
+class QuorumRuleAdmin(admin.ModelAdmin):
+    list_display = ('name', 'numerator', 'denominator', 'strict', 'absolute', 'abstentions')
+
+
+@admin.register(BallotEvent)
+class BallotEventAdmin(admin.ModelAdmin):
+    # the log is append-only, it can only be viewed
+    list_display = ('created', 'collection_ref', 'collection', 'voter_name', 'user_name',
+                    'source')
+    list_filter = ('source',)
+    list_select_related = ('collection',)
+    readonly_fields = ('collection', 'collection_ref', 'voter', 'voter_name', 'user',
+                       'user_name', 'created', 'source', 'changes')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
@@ -17,3 +17,7 @@ from django.apps import AppConfig
 
 class VotingsConfig(AppConfig):
     name = 'votings'
+
+    def ready(self):
+        # connect the signal handlers for cache invalidation
+        from . import signals
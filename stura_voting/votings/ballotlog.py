@@ -0,0 +1,207 @@
+# Copyright 2018 - 2019 Fabian Wenzelmann
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""The append-only ballot log.
+
+Whenever the votes of a voter in a session are entered the changes are collected in a
+BallotChanges object and written as a single models.BallotEvent in the same transaction
+as the votes. So the log contains who changed which vote when, and the current votes
+can be verified or rebuilt from it.
+
+The changes of an event are stored as a JSON list of the form
+
+    [[type, voting_id, old, new], ...]
+
+where type is 'median' or 'schulze'. For median votings old and new are the values
+(in cent), for schulze votings the lists of sorting positions (sorted by option_num).
+None means that no vote existed (old) or that the vote was deleted (new).
+
+Votes that existed before the log was introduced or that are restored from a snapshot
+without events are added with source models.BALLOT_SOURCE_IMPORT, see record_ballots.
+Events are kept when their session or voter is deleted, so the log can contain votes
+of voters and votings that don't exist anymore.
+
+"""
+
+import json
+
+from collections import OrderedDict
+
+from .models import *
+
+
+MEDIAN = 'median'
+SCHULZE = 'schulze'
+
+
+class BallotChanges(object):
+    """The changes of a single ballot save.
+
+    Attributes:
+        changes (list): The changes as stored in the event, see module description.
+
+    """
+    def __init__(self):
+        self.changes = []
+
+    def median(self, voting_id, old, new):
+        """Adds a change of a median vote, nothing is added if old == new.
+
+        Args:
+            voting_id (int): The id of the median voting.
+            old (int or None): The previous value, None if there was no vote.
+            new (int or None): The new value, None if the vote was deleted.
+        """
+        if old != new:
+            self.changes.append([MEDIAN, voting_id, old, new])
+
+    def schulze(self, voting_id, old, new):
+        """Adds a change of a schulze vote, nothing is added if old == new.
+
+        Args:
+            voting_id (int): The id of the schulze voting.
+            old (list of int or None): The previous sorting positions, None if there was
+                no vote.
+            new (list of int or None): The new sorting positions, None if the vote was
+                deleted.
+        """
+        if old is not None:
+            old = list(old)
+        if new is not None:
+            new = list(new)
+        if old != new:
+            self.changes.append([SCHULZE, voting_id, old, new])
+
+    def __len__(self):
+        return len(self.changes)
+
+
+def log_ballot(collection, voter, user, changes, source=BALLOT_SOURCE_ENTRY):
+    """Writes the changes of a ballot to the log.
+
+    Must be called in the transaction that changes the votes.
+
+    Args:
+        collection (models.VotingCollection or int): The session (or its id).
+        voter (models.Voter or int): The voter (or its id).
+        user (User or None): The user that entered the ballot.
+        changes (BallotChanges): The changes.
+        source (str): The source of the event, see models.BALLOT_SOURCE_CHOICES.
+
+    Returns:
+        models.BallotEvent or None: The new event, None if nothing has changed.
+    """
+    if not changes:
+        return None
+    if user is not None and not user.is_authenticated:
+        user = None
+    collection_id = getattr(collection, 'id', collection)
+    if not isinstance(voter, Voter):
+        voter = Voter.objects.get(id=voter)
+    return BallotEvent.objects.create(
+        collection_id=collection_id,
+        collection_ref=collection_id,
+        voter=voter,
+        voter_name=voter.name,
+        user=user,
+        user_name=user.get_username() if user is not None else '',
+        source=source,
+        changes=json.dumps(changes.changes, separators=(',', ':')))
+
+
+def event_changes(event):
+    """Returns the changes stored in an event.
+
+    Args:
+        event (models.BallotEvent): The event.
+
+    Returns:
+        list: The changes, see module description.
+    """
+    return json.loads(event.changes)
+
+
+def voter_names(voter_ids):
+    """Returns the names of some voters, used to create events in bulk.
+
+    Args:
+        voter_ids (iterable of int): The ids of the voters.
+
+    Returns:
+        dict: Maps the ids to the names.
+    """
+    return dict(Voter.objects.filter(id__in=set(voter_ids)).values_list('id', 'name'))
+
+
+def current_ballots(collection_ids):
+    """Returns the current votes of all voters in some sessions as ballot changes.
+
+    Args:
+        collection_ids (iterable of int): The ids of the sessions.
+
+    Returns:
+        OrderedDict: Maps (collection_id, voter_id) to BallotChanges, each containing
+            a change from None to the current vote for each vote of the voter.
+    """
+    collection_ids = list(collection_ids)
+    res = OrderedDict()
+
+    def changes_for(collection_id, voter_id):
+        key = (collection_id, voter_id)
+        if key not in res:
+            res[key] = BallotChanges()
+        return res[key]
+
+    median_votes = (MedianVote.objects
+                    .filter(voting__group__collection__in=collection_ids)
+                    .order_by('voting__group__collection', 'voter', 'voting')
+                    .values_list('voting__group__collection', 'voter', 'voting', 'value'))
+    for collection_id, voter_id, voting_id, value in median_votes:
+        changes_for(collection_id, voter_id).median(voting_id, None, value)
+    schulze_votes = (SchulzeVote.objects
+                     .filter(option__voting__group__collection__in=collection_ids)
+                     .order_by('option__voting__group__collection', 'voter',
+                               'option__voting', 'option__option_num')
+                     .values_list('option__voting__group__collection', 'voter',
+                                  'option__voting', 'sorting_position'))
+    positions = OrderedDict()
+    for collection_id, voter_id, voting_id, position in schulze_votes:
+        positions.setdefault((collection_id, voter_id, voting_id), []).append(position)
+    for (collection_id, voter_id, voting_id), voter_positions in positions.items():
+        changes_for(collection_id, voter_id).schulze(voting_id, None, voter_positions)
+    return res
+
+
+def record_ballots(collection_ids):
+    """Adds the current votes in some sessions to the log.
+
+    For each voter with votes one event with source models.BALLOT_SOURCE_IMPORT is
+    created, used for votes that were not entered through the ballot entry (for example
+    restored from cold storage).
+
+    Args:
+        collection_ids (iterable of int): The ids of the sessions.
+
+    Returns:
+        int: The number of events created.
+    """
+    ballots = current_ballots(collection_ids)
+    names = voter_names(voter_id for _, voter_id in ballots)
+    events = [BallotEvent(collection_id=collection_id, collection_ref=collection_id,
+                          voter_id=voter_id, voter_name=names[voter_id],
+                          source=BALLOT_SOURCE_IMPORT,
+                          changes=json.dumps(changes.changes, separators=(',', ':')))
+              for (collection_id, voter_id), changes in ballots.items()]
+    BallotEvent.objects.bulk_create(events)
+    return len(events)
@@ -0,0 +1,502 @@
+# Copyright 2018 - 2019 Fabian Wenzelmann
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""This module contains caches for data that is read very often but changes rarely.
+
+The caches are two-level: Each process keeps a small in-process cache and in addition
+the Django cache (as configured in the settings) is used as a shared cache between
+processes.
+
+Entries are not deleted on invalidation, instead a version token for the entry is
+changed. Entries computed from an old state of the database are thus stored under an
+old version and are never read again.
+
+"""
+
+import threading
+import uuid
+
+from collections import OrderedDict, namedtuple
+
+from django.core.cache import cache
+from django.utils.translation import gettext
+
+from . import models as voting_models
+
+
+# maximum number of entries in the in-process caches
+LOCAL_CACHE_SIZE = 64
+
+_VOTERS_VERSION_KEY = 'votings.voters.version.%d'
+_VOTERS_KEY = 'votings.voters.%d.%s'
+
+# changed whenever a period, revision or collection is changed
+ARCHIVE_VERSION_KEY = 'votings.archive.version'
+# changed whenever a collection or its groups, votings or options are changed
+_COLLECTION_VERSION_KEY = 'votings.collection.version.%d'
+_OVERVIEW_KEY = 'votings.overview.%d.%s'
+# changed whenever a vote for a voting is changed
+_MEDIAN_VOTES_VERSION_KEY = 'votings.median.votes.version.%d'
+_SCHULZE_VOTES_VERSION_KEY = 'votings.schulze.votes.version.%d'
+# changed whenever a quorum rule is changed
+QUORUM_VERSION_KEY = 'votings.quorum.version'
+
+
+def _get_pk(obj):
+    # obj is either a model instance or the primary key
+    if isinstance(obj, int):
+        return obj
+    return obj.pk
+
+
+def _new_version():
+    return uuid.uuid4().hex
+
+
+class LocalCache(object):
+    """A small thread safe in-process LRU cache.
+
+    Each entry is stored together with the version it was computed for, get only returns
+    the entry if the versions match.
+
+    Attributes:
+        max_size (int): Maximal number of entries in the cache, if more entries are added
+            the least recently used entry is removed.
+
+    """
+    def __init__(self, max_size=LOCAL_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is None or entry[0] != version:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, version, value):
+        with self._lock:
+            self._entries[key] = (version, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+def get_version(version_key):
+    """Returns the current version token for a key in the shared cache.
+
+    If no version exists yet a new one is created.
+
+    Args:
+        version_key (str): The cache key under which the version is stored.
+
+    Returns:
+        str: The current version.
+    """
+    version = cache.get(version_key)
+    if version is None:
+        # add does not override a version set by another process in the meantime
+        cache.add(version_key, _new_version(), None)
+        version = cache.get(version_key)
+    return version
+
+
+def get_versions(version_keys):
+    """Returns the current version tokens for a list of keys in the shared cache.
+
+    Works as get_version, but fetches all versions with a single cache lookup.
+
+    Args:
+        version_keys (list of str): The cache keys under which the versions are stored.
+
+    Returns:
+        dict: Maps each key to its version.
+    """
+    versions = cache.get_many(version_keys)
+    for version_key in version_keys:
+        if version_key not in versions:
+            versions[version_key] = get_version(version_key)
+    return versions
+
+
+def bump_version(version_key):
+    """Invalidates all entries stored for the version key.
+
+    Args:
+        version_key (str): The cache key under which the version is stored.
+    """
+    cache.set(version_key, _new_version(), None)
+
+
+def get_cached(key, version_key, compute):
+    """Returns a value from the shared cache, computing it if required.
+
+    The value is stored for the current version of version_key, so bump_version
+    invalidates it. compute must return a picklable value that is not None.
+
+    Args:
+        key (str): The cache key for the value (without version).
+        version_key (str): The cache key of the version the value depends on.
+        compute (callable): Function without arguments computing the value.
+
+    Returns:
+        The cached or computed value.
+    """
+    version = get_version(version_key)
+    versioned_key = '%s.%s' % (key, version)
+    value = cache.get(versioned_key)
+    if value is None:
+        value = compute()
+        cache.set(versioned_key, value)
+    return value
+
+
+def get_cached_list(key, version_key, queryset):
+    """Returns the result of a queryset as a list from the shared cache.
+
+    See get_cached for details.
+
+    Args:
+        key (str): The cache key for the list (without version).
+        version_key (str): The cache key of the version the queryset depends on.
+        queryset (queryset): The queryset to evaluate if the list is not cached.
+
+    Returns:
+        list: The objects in the queryset.
+    """
+    return get_cached(key, version_key, lambda: list(queryset))
+
+
+def collection_version_key(collection):
+    """Returns the version key for the contents of a collection.
+
+    Args:
+        collection (models.VotingCollection or int): The collection or its primary key.
+
+    Returns:
+        str: The version key.
+    """
+    return _COLLECTION_VERSION_KEY % _get_pk(collection)
+
+
+def get_results_versions(collection, voters, median_ids, schulze_ids):
+    """Returns a version for the results of each voting in a collection.
+
+    The result of a voting depends on the votes for that voting, the collection (the
+    voting itself, for example its majority), the quorum rules and the voters of the
+    revision.
+    The returned versions combine these versions and can be used as cache keys
+    for the (rendered) results of a voting.
+
+    Args:
+        collection (models.VotingCollection or int): The collection or its primary key.
+        voters (WeightedVoters): The voters of the collection's revision.
+        median_ids (iterable of int): The ids of all median votings.
+        schulze_ids (iterable of int): The ids of all schulze votings.
+
+    Returns:
+        dict, dict: Maps the median (first dict) and schulze (second dict) voting ids
+            to the version of their results.
+    """
+    median_keys = {v_id: _MEDIAN_VOTES_VERSION_KEY % v_id for v_id in median_ids}
+    schulze_keys = {v_id: _SCHULZE_VOTES_VERSION_KEY % v_id for v_id in schulze_ids}
+    collection_key = collection_version_key(collection)
+    all_keys = [collection_key, QUORUM_VERSION_KEY]
+    all_keys.extend(median_keys.values())
+    all_keys.extend(schulze_keys.values())
+    versions = get_versions(all_keys)
+    common = '%s.%s.%s' % (versions[collection_key], versions[QUORUM_VERSION_KEY],
+                           voters.version)
+    median_versions = {v_id: '%s.%s' % (versions[key], common)
+                       for v_id, key in median_keys.items()}
+    schulze_versions = {v_id: '%s.%s' % (versions[key], common)
+                        for v_id, key in schulze_keys.items()}
+    return median_versions, schulze_versions
+
+
+def invalidate_median_votes(voting):
+    """Invalidates the cached results of a median voting.
+
+    Args:
+        voting (models.MedianVoting or int): The voting or its primary key.
+    """
+    bump_version(_MEDIAN_VOTES_VERSION_KEY % _get_pk(voting))
+
+
+def invalidate_schulze_votes(voting):
+    """Invalidates the cached results of a schulze voting.
+
+    Args:
+        voting (models.SchulzeVoting or int): The voting or its primary key.
+    """
+    bump_version(_SCHULZE_VOTES_VERSION_KEY % _get_pk(voting))
+
+
+def invalidate_archive():
+    """Invalidates all cached lists of periods, revisions and collections."""
+    bump_version(ARCHIVE_VERSION_KEY)
+
+
+def invalidate_quorum_rules():
+    """Invalidates the compiled quorum rules and all results depending on them."""
+    bump_version(QUORUM_VERSION_KEY)
+
+
+def invalidate_collection(collection):
+    """Invalidates all cached data of a collection (groups, votings and options).
+
+    This includes the SessionOverview of the collection.
+
+    Args:
+        collection (models.VotingCollection or int): The collection or its primary key.
+    """
+    bump_version(collection_version_key(collection))
+
+
+CachedGroup = namedtuple('CachedGroup', ['id', 'name', 'group_num'])
+
+# value and currency are None for schulze votings
+CachedVoting = namedtuple('CachedVoting', ['id', 'name', 'voting_num', 'value', 'currency'])
+
+
+class SessionOverview(object):
+    """The groups, votings and options of a collection as shown on the session pages.
+
+    The groups and votings are CachedGroup and CachedVoting objects with the attributes
+    of the models used by the templates. The object is shared and must not be changed.
+
+    Attributes:
+        collection_id (int): The id of the collection.
+        version (str): The cache version this object was computed for.
+        groups (tuple): A tuple (group, entries) for each group (including groups without
+            votings) sorted by group_num. entries is a tuple of (type, voting) sorted by
+            voting_num where type is either 'median' or 'schulze'.
+        option_map (dict): Maps the id of each schulze voting to a tuple of its options
+            as strings.
+        warnings (tuple of str): Warnings about invalid votings.
+
+    """
+    def __init__(self, collection_id, groups, option_map, warnings, version=None):
+        self.collection_id = collection_id
+        self.version = version
+        self.groups = tuple(groups)
+        self.option_map = option_map
+        self.warnings = tuple(warnings)
+
+    @staticmethod
+    def from_db(collection_id, version=None):
+        groups_qs = (voting_models.VotingGroup.objects
+                     .filter(collection=collection_id)
+                     .order_by('group_num')
+                     .values_list('id', 'name', 'group_num'))
+        median_qs = (voting_models.MedianVoting.objects
+                     .filter(group__collection=collection_id)
+                     .values_list('group', 'id', 'name', 'voting_num', 'value', 'currency'))
+        schulze_qs = (voting_models.SchulzeVoting.objects
+                      .filter(group__collection=collection_id)
+                      .values_list('group', 'id', 'name', 'voting_num'))
+        options_qs = (voting_models.SchulzeOption.objects
+                      .filter(voting__group__collection=collection_id)
+                      .order_by('voting', 'option_num')
+                      .values_list('voting', 'option'))
+        entries = dict()
+        for group_id, *voting in median_qs:
+            entries.setdefault(group_id, []).append(('median', CachedVoting(*voting)))
+        for group_id, *voting in schulze_qs:
+            entries.setdefault(group_id, []).append(
+                ('schulze', CachedVoting(*voting, value=None, currency=None)))
+        options = dict()
+        for voting_id, option in options_qs:
+            options.setdefault(voting_id, []).append(option)
+        groups = []
+        option_map = dict()
+        warnings = []
+        for group in groups_qs:
+            group = CachedGroup(*group)
+            # same order as in results.CombinedVotingResult: median before schulze
+            # votings with the same voting_num
+            group_entries = sorted(entries.get(group.id, []),
+                                   key=lambda entry: (entry[1].voting_num, entry[0] == 'schulze'))
+            for v_type, voting in group_entries:
+                if v_type != 'schulze':
+                    continue
+                if voting.id not in options:
+                    warnings.append(gettext(
+                        'No options for schulze voting %(voting)d' % {
+                            'voting': voting.id}))
+                option_map[voting.id] = tuple(options.get(voting.id, ()))
+            groups.append((group, tuple(group_entries)))
+        return SessionOverview(collection_id, groups, option_map, warnings, version)
+
+    def for_template(self, empty_groups=False):
+        """Returns the overview as results.CombinedVotingResult.for_overview_template does.
+
+        Args:
+            empty_groups (bool): If true groups without votings are included.
+
+        Returns:
+            list, dict, list of str: The groups, option_map and warnings.
+        """
+        if empty_groups:
+            groups = list(self.groups)
+        else:
+            groups = [(group, entries) for group, entries in self.groups if entries]
+        return groups, self.option_map, list(self.warnings)
+
+
+_local_overviews = LocalCache()
+
+
+def get_session_overview(collection):
+    """Returns the SessionOverview for a collection.
+
+    Works as get_revision_voters, the overview is invalidated by invalidate_collection.
+
+    Args:
+        collection (models.VotingCollection or int): The collection or its primary key.
+
+    Returns:
+        SessionOverview: The groups, votings and options of the collection.
+    """
+    collection_id = _get_pk(collection)
+    version = get_version(collection_version_key(collection_id))
+    overview = _local_overviews.get(collection_id, version)
+    if overview is not None:
+        return overview
+    key = _OVERVIEW_KEY % (collection_id, version)
+    overview = cache.get(key)
+    if overview is None:
+        overview = SessionOverview.from_db(collection_id, version)
+        cache.set(key, overview)
+    _local_overviews.set(collection_id, version, overview)
+    return overview
+
+
+CachedVoter = namedtuple('CachedVoter', ['id', 'name', 'weight'])
+
+
+class WeightedVoters(object):
+    """All voters of a revision with their weights.
+
+    The voters are sorted by name, they can also be looked up by their id with [].
+    Iterating over an instance yields CachedVoter objects which have the same id, name
+    and weight attributes as models.Voter.
+
+    Attributes:
+        revision_id (int): The id of the revision.
+        version (str): The cache version this object was computed for.
+        voters (tuple of CachedVoter): All voters of the revision, sorted by name.
+        by_id (dict): Maps the voter id to the CachedVoter.
+        positions (dict): Maps the voter id to the position of the voter in voters.
+        weight_sum (int): The sum of all weights of the voters in the revision.
+
+    """
+    def __init__(self, revision_id, voters, version=None):
+        self.revision_id = revision_id
+        self.version = version
+        self.voters = tuple(voters)
+        self.by_id = {voter.id: voter for voter in self.voters}
+        self.positions = {voter.id: i for i, voter in enumerate(self.voters)}
+        self.weight_sum = sum(voter.weight for voter in self.voters)
+
+    @staticmethod
+    def from_db(revision_id, version=None):
+        voters_qs = (voting_models.Voter.objects
+                     .filter(revision__id=revision_id)
+                     .order_by('name')
+                     .values_list('id', 'name', 'weight'))
+        voters = [CachedVoter(*entry) for entry in voters_qs]
+        return WeightedVoters(revision_id, voters, version)
+
+    def block(self, after=None, limit=None):
+        """Returns the voters following a given voter (keyset pagination).
+
+        Args:
+            after (int or None): The id of the last voter of the previous block, None
+                for the first block. If the voter does not exist an empty list is returned.
+            limit (int or None): The maximal number of voters to return, None for all.
+
+        Returns:
+            tuple of CachedVoter: The voters in the block.
+        """
+        start = 0
+        if after is not None:
+            if after not in self.positions:
+                return ()
+            start = self.positions[after] + 1
+        if limit is None:
+            return self.voters[start:]
+        return self.voters[start:start + limit]
+
+    def __getitem__(self, voter_id):
+        return self.by_id[voter_id]
+
+    def __contains__(self, voter_id):
+        return voter_id in self.by_id
+
+    def __iter__(self):
+        return iter(self.voters)
+
+    def __len__(self):
+        return len(self.voters)
+
+
+_local_voters = LocalCache()
+
+
+def get_revision_voters(revision):
+    """Returns the WeightedVoters for a revision.
+
+    The result is looked up in the in-process cache first, then in the shared cache and
+    only if both fail the voters are fetched from the database.
+
+    Args:
+        revision (models.VotersRevision or int): The revision or its primary key.
+
+    Returns:
+        WeightedVoters: All voters of the revision.
+    """
+    revision_id = _get_pk(revision)
+    version = get_version(_VOTERS_VERSION_KEY % revision_id)
+    voters = _local_voters.get(revision_id, version)
+    if voters is not None:
+        return voters
+    key = _VOTERS_KEY % (revision_id, version)
+    voters = cache.get(key)
+    if voters is None:
+        voters = WeightedVoters.from_db(revision_id, version)
+        cache.set(key, voters)
+    _local_voters.set(revision_id, version, voters)
+    return voters
+
+
+def invalidate_revision_voters(revision):
+    """Invalidates the cached voters of a revision.
+
+    Should be called after the transaction changing the voters has been committed,
+    for example with transaction.on_commit.
+
+    Args:
+        revision (models.VotersRevision or int): The revision or its primary key.
+    """
+    revision_id = _get_pk(revision)
+    bump_version(_VOTERS_VERSION_KEY % revision_id)
+    _local_voters.delete(revision_id)
@@ -0,0 +1,126 @@
+# Copyright 2018 - 2019 Fabian Wenzelmann
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Maintains the change timestamp of sessions (models.VotingCollection.modified).
+
+The timestamp is updated whenever the session, its votings, options, votes, frozen
+results or the voters of its revision change. It is used for HTTP conditional requests
+(ETag and Last-Modified), so a client can revalidate a session page with a single query.
+
+As with the history module the signal handlers only call schedule_touch, all scheduled
+sessions are updated with one query after the transaction has been committed.
+
+"""
+
+import threading
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import *
+
+
+COLLECTION = 'collection'
+REVISION = 'revision'
+GROUP = 'group'
+MEDIAN = 'median'
+SCHULZE = 'schulze'
+SCHULZE_OPTION = 'schulze_option'
+MEDIAN_QUORUM = 'median_quorum'
+SCHULZE_QUORUM = 'schulze_quorum'
+
+# maps the kinds to the lookup selecting the affected collections
+_LOOKUPS = {
+    COLLECTION: 'id__in',
+    REVISION: 'revision__in',
+    GROUP: 'votinggroup__in',
+    MEDIAN: 'votinggroup__medianvoting__in',
+    SCHULZE: 'votinggroup__schulzevoting__in',
+    SCHULZE_OPTION: 'votinggroup__schulzevoting__schulzeoption__in',
+    MEDIAN_QUORUM: 'votinggroup__medianvoting__quorum__in',
+    SCHULZE_QUORUM: 'votinggroup__schulzevoting__quorum__in',
+}
+
+_pending = threading.local()
+
+
+def _pending_items():
+    items = getattr(_pending, 'items', None)
+    if items is None:
+        items = set()
+        _pending.items = items
+    return items
+
+
+def schedule_touch(kind, pk):
+    """Updates the change timestamp of some sessions after the current transaction is
+    committed.
+
+    Args:
+        kind (str): COLLECTION for a single session, REVISION for all sessions of a
+            revision, GROUP, MEDIAN, SCHULZE or SCHULZE_OPTION for the session of a group,
+            voting or option, MEDIAN_QUORUM and SCHULZE_QUORUM for all sessions with a
+            median or schulze voting using a quorum rule.
+        pk (int): The primary key of the collection, revision, group, voting, option or
+            quorum rule.
+    """
+    if kind not in _LOOKUPS:
+        raise ValueError('Invalid change kind %s' % kind)
+    _pending_items().add((kind, pk))
+    transaction.on_commit(flush_pending)
+
+
+def flush_pending():
+    """Executes all updates scheduled with schedule_touch."""
+    items = _pending_items()
+    if not items:
+        return
+    todo = set(items)
+    items.clear()
+    touch(todo)
+
+
+def touch(items):
+    """Sets the change timestamp of some sessions to now.
+
+    Args:
+        items (iterable of (str, int)): The kind and primary keys, see schedule_touch.
+    """
+    by_kind = dict()
+    for kind, pk in items:
+        by_kind.setdefault(kind, set()).add(pk)
+    if not by_kind:
+        return
+    q = Q()
+    for kind, pks in by_kind.items():
+        q |= Q(**{_LOOKUPS[kind]: pks})
+    # update doesn't send post_save, so the caches of the collections stay valid
+    VotingCollection.objects.filter(q).update(modified=timezone.now())
+
+
+def collection_modified(collection_id):
+    """Returns the change timestamp of a session.
+
+    Args:
+        collection_id (int): The primary key of the collection.
+
+    Returns:
+        datetime.datetime or None: The time of the last change, None if the collection
+            does not exist.
+    """
+    return (VotingCollection.objects
+            .filter(id=collection_id)
+            .values_list('modified', flat=True)
+            .first())
@@ -0,0 +1,471 @@
+# Copyright 2018 - 2019 Fabian Wenzelmann
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Cold storage for finished periods.
+
+A period is archived by storing everything that belongs to it (revisions, voters,
+sessions, groups, votings, options and all votes) together with the computed results in
+a compressed snapshot (models.PeriodSnapshot). Then the revisions of the period are
+deleted (and with them all other rows). The period itself is kept.
+
+Archived sessions are displayed directly from the snapshot, the snapshot can also be
+restored into the live tables. Restored objects get new primary keys.
+
+The snapshot is a JSON document of the following form (all ids are the ids at the time
+the snapshot was created):
+
+    {
+        'format': 3,
+        'period': {'id', 'name', 'start', 'end'},
+        'revisions': [{'id', 'created', 'note', 'voters': [[id, name, weight], ...]}],
+        'collections': [{'id', 'name', 'time', 'revision', 'warnings', 'frozen',
+                         'events', 'groups': [{'id', 'name', 'group_num',
+                                               'votings': [...]}]}],
+    }
+
+'frozen' is None for open sessions, for closed sessions it is {'closed', 'data'} with
+the time and the document of the models.FrozenResults record (see the frozen module).
+'events' is the ballot log of the session, a list of [voter_id, voter_name, user_name,
+created, source, changes] (see the ballotlog module). The events are moved into the
+snapshot and restored with the session.
+Snapshots of format 1 don't contain 'frozen', snapshots of format 1 and 2 don't
+contain 'events'.
+
+A voting is a dict with 'type' ('median' or 'schulze'), its fields (the quorum rule by
+name), 'rule' (majority.CompiledRule.as_tuple), 'votes' and 'result'. Median votes are [voter_id, value], schulze votes are
+[voter_id, option_id, sorting_position] and schulze votings contain the options as
+[id, option, option_num].
+
+"""
+
+import json
+import zlib
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils.dateparse import parse_date, parse_datetime
+
+from stura_voting_utils.utils import output_currency
+
+from .models import *
+from .cache import LocalCache
+from .evaluation import session_results_context
+from .majority import CompiledRule
+from .ballotlog import record_ballots
+from .history import refresh_outdated
+from . import frozen
+
+
+FORMAT_VERSION = 3
+
+MEDIAN = 'median'
+SCHULZE = 'schulze'
+
+
+class ColdStorageError(Exception):
+    """Raised if a period can't be archived or restored."""
+    pass
+
+
+def _iso(value):
+    return None if value is None else value.isoformat()
+
+
+def _median_voting(voting, entry, votes, quorum_names):
+    return {
+        'type': MEDIAN,
+        'id': voting.id,
+        'name': voting.name,
+        'value': voting.value,
+        'majority': voting.majority,
+        'absolute_majority': voting.absolute_majority,
+        'quorum': quorum_names.get(voting.quorum_id, None),
+        'rule': entry.instance.rule.as_tuple(),
+        'currency': voting.currency,
+        'voting_num': voting.voting_num,
+        'votes': votes,
+        'result': {
+            'weight_sum': entry.instance.weight_sum,
+            'majority': entry.instance.majority,
+            'value': entry.result,
+        },
+    }
+
+
+def _schulze_voting(voting, entry, votes, quorum_names):
+    return {
+        'type': SCHULZE,
+        'id': voting.id,
+        'name': voting.name,
+        'majority': voting.majority,
+        'absolute_majority': voting.absolute_majority,
+        'quorum': quorum_names.get(voting.quorum_id, None),
+        'rule': entry.instance.rule.as_tuple(),
+        'voting_num': voting.voting_num,
+        'options': [[option.id, option.option, option.option_num] for option in entry.options],
+        'votes': votes,
+        'result': {
+            'weight_sum': entry.instance.weight_sum,
+            'majority': entry.instance.majority,
+            'ranking': entry.ranking,
+        },
+    }
+
+
+def _collection(collection, quorum_names):
+    # the results are computed as for the results page
+    context = session_results_context(collection, False)
+    median_votes, schulze_votes = dict(), dict()
+    for voting_id, voter_id, value in (MedianVote.objects
+                                       .filter(voting__group__collection=collection)
+                                       .order_by('voting', 'voter')
+                                       .values_list('voting', 'voter', 'value')):
+        median_votes.setdefault(voting_id, []).append([voter_id, value])
+    for voting_id, voter_id, option_id, position in (
+            SchulzeVote.objects
+            .filter(option__voting__group__collection=collection)
+            .order_by('option__voting', 'voter', 'option__option_num')
+            .values_list('option__voting', 'voter', 'option', 'sorting_position')):
+        schulze_votes.setdefault(voting_id, []).append([voter_id, option_id, position])
+    groups = []
+    for group, entries in context['groups']:
+        votings = []
+        for entry in entries:
+            if entry.v_type == MEDIAN:
+                votings.append(_median_voting(
+                    entry.voting, entry, median_votes.get(entry.voting.id, []),
+                    quorum_names))
+            else:
+                votings.append(_schulze_voting(
+                    entry.voting, entry, schulze_votes.get(entry.voting.id, []),
+                    quorum_names))
+        groups.append({
+            'id': group.id,
+            'name': group.name,
+            'group_num': group.group_num,
+            'votings': votings,
+        })
+    record = context['closed']
+    return {
+        'id': collection.id,
+        'name': collection.name,
+        'time': _iso(collection.time),
+        'revision': collection.revision_id,
+        'warnings': context['warnings'],
+        'frozen': None if record is None else {'closed': _iso(record.closed),
+                                               'data': record.data},
+        'events': [[voter_id, voter_name, user_name, _iso(created), source, json.loads(changes)]
+                   for voter_id, voter_name, user_name, created, source, changes in (
+                       BallotEvent.objects
+                       .filter(collection=collection)
+                       .order_by('id')
+                       .values_list('voter', 'voter_name', 'user_name', 'created',
+                                    'source', 'changes'))],
+        'groups': groups,
+    }
+
+
+def period_snapshot_data(period):
+    """Returns the snapshot of a period as a dict (see the module documentation).
+
+    Args:
+        period (models.Period): The period.
+
+    Returns:
+        dict: The snapshot.
+    """
+    revisions = []
+    for revision in VotersRevision.objects.filter(period=period).order_by('created', 'id'):
+        voters = (Voter.objects
+                  .filter(revision=revision)
+                  .order_by('name')
+                  .values_list('id', 'name', 'weight'))
+        revisions.append({
+            'id': revision.id,
+            'created': _iso(revision.created),
+            'note': revision.note,
+            'voters': [list(voter) for voter in voters],
+        })
+    collections = (VotingCollection.objects
+                   .filter(revision__period=period)
+                   .order_by('time', 'id'))
+    quorum_names = dict(QuorumRule.objects.values_list('id', 'name'))
+    return {
+        'format': FORMAT_VERSION,
+        'period': {
+            'id': period.id,
+            'name': period.name,
+            'start': _iso(period.start),
+            'end': _iso(period.end),
+        },
+        'revisions': revisions,
+        'collections': [_collection(collection, quorum_names) for collection in collections],
+    }
+
+
+def archive_period(period):
+    """Archives a period: Creates its snapshot and deletes all its revisions.
+
+    The vote history and the statistics of the period are kept.
+
+    Args:
+        period (models.Period): The period to archive.
+
+    Returns:
+        models.PeriodSnapshot: The new snapshot.
+
+    Raises:
+        ColdStorageError: If the period has already been archived.
+    """
+    with transaction.atomic():
+        if PeriodSnapshot.objects.filter(period=period).exists():
+            raise ColdStorageError('Period "%s" has already been archived' % period)
+        # the kept statistics can't be computed anymore once the votes are deleted
+        refresh_outdated(period=period)
+        raw = json.dumps(period_snapshot_data(period), separators=(',', ':')).encode('utf-8')
+        snapshot = PeriodSnapshot.objects.create(
+            period=period, data=zlib.compress(raw, 9), size=len(raw))
+        # the history and statistics are kept: detach them from the deleted objects,
+        # the participation is not recomputed for archived periods
+        VoteHistoryEntry.objects.filter(period=period).update(
+            voter=None, collection=None, median_voting=None, schulze_voting=None)
+        VotingStatistics.objects.filter(period=period).update(
+            collection=None, median_voting=None, schulze_voting=None)
+        # the events are in the snapshot now (the queryset delete does not call
+        # BallotEvent.delete)
+        BallotEvent.objects.filter(collection__revision__period=period).delete()
+        # deletes the voters, collections and votes as well
+        VotersRevision.objects.filter(period=period).delete()
+    return snapshot
+
+
+def decode_snapshot(snapshot):
+    """Returns the data of a snapshot.
+
+    Args:
+        snapshot (models.PeriodSnapshot): The snapshot.
+
+    Returns:
+        dict: The snapshot data.
+    """
+    return json.loads(zlib.decompress(bytes(snapshot.data)).decode('utf-8'))
+
+
+# decoded snapshots, the snapshots are immutable so the id is a sufficient key
+_local_snapshots = LocalCache(max_size=8)
+
+
+def load_snapshot(snapshot):
+    """Returns the data of a snapshot, decoded snapshots are kept in memory.
+
+    Args:
+        snapshot (models.PeriodSnapshot): The snapshot.
+
+    Returns:
+        dict: The snapshot data, must not be changed.
+    """
+    version = _iso(snapshot.created)
+    data = _local_snapshots.get(snapshot.id, version)
+    if data is None:
+        data = decode_snapshot(snapshot)
+        _local_snapshots.set(snapshot.id, version, data)
+    return data
+
+
+def restore_period(period):
+    """Restores an archived period into the live tables and deletes the snapshot.
+
+    All restored objects get new primary keys.
+
+    Args:
+        period (models.Period): The archived period.
+
+    Raises:
+        ColdStorageError: If the period has not been archived.
+    """
+    with transaction.atomic():
+        snapshot = PeriodSnapshot.objects.select_for_update().filter(period=period).first()
+        if snapshot is None:
+            raise ColdStorageError('Period "%s" has not been archived' % period)
+        data = decode_snapshot(snapshot)
+        if data['format'] not in (1, 2, FORMAT_VERSION):
+            raise ColdStorageError('Unknown snapshot format %s' % data['format'])
+        # the kept history and statistics are computed again for the restored votes
+        VoteHistoryEntry.objects.filter(period=period, collection__isnull=True).delete()
+        VotingStatistics.objects.filter(period=period, collection__isnull=True).delete()
+        revisions, voters = dict(), dict()
+        # rules are restored by name, deleted rules are replaced by the majority fields
+        quorums = {rule.name: rule for rule in QuorumRule.objects.all()}
+        for rev_data in data['revisions']:
+            revision = VotersRevision.objects.create(
+                period=period, created=parse_datetime(rev_data['created']),
+                note=rev_data['note'])
+            revisions[rev_data['id']] = revision
+            for voter_id, name, weight in rev_data['voters']:
+                voters[voter_id] = Voter.objects.create(
+                    revision=revision, name=name, weight=weight)
+        median_votes, schulze_votes = [], []
+        collection_ids = []
+        # maps the old ids to the new ones, used to restore the frozen results
+        group_ids, median_ids, schulze_ids, option_ids = dict(), dict(), dict(), dict()
+        frozen_results, events = [], []
+        for coll_data in data['collections']:
+            collection = VotingCollection.objects.create(
+                name=coll_data['name'], time=parse_datetime(coll_data['time']),
+                revision=revisions[coll_data['revision']])
+            collection_ids.append(collection.id)
+            if coll_data.get('frozen', None) is not None:
+                frozen_results.append((collection, coll_data['frozen']))
+            events.extend((collection, event) for event in coll_data.get('events', []))
+            for group_data in coll_data['groups']:
+                group = VotingGroup.objects.create(
+                    name=group_data['name'], collection=collection,
+                    group_num=group_data['group_num'])
+                group_ids[group_data['id']] = group.id
+                for v_data in group_data['votings']:
+                    if v_data['type'] == MEDIAN:
+                        voting = MedianVoting.objects.create(
+                            name=v_data['name'], value=v_data['value'],
+                            majority=v_data['majority'],
+                            absolute_majority=v_data['absolute_majority'],
+                            currency=v_data['currency'], group=group,
+                            voting_num=v_data['voting_num'],
+                            quorum=quorums.get(v_data.get('quorum', None), None))
+                        median_ids[v_data['id']] = voting.id
+                        for voter_id, value in v_data['votes']:
+                            median_votes.append(MedianVote(
+                                value=value, voter=voters[voter_id], voting=voting))
+                    else:
+                        voting = SchulzeVoting.objects.create(
+                            name=v_data['name'], majority=v_data['majority'],
+                            absolute_majority=v_data['absolute_majority'],
+                            group=group, voting_num=v_data['voting_num'],
+                            quorum=quorums.get(v_data.get('quorum', None), None))
+                        schulze_ids[v_data['id']] = voting.id
+                        options = dict()
+                        for option_id, option, option_num in v_data['options']:
+                            options[option_id] = SchulzeOption.objects.create(
+                                option=option, voting=voting, option_num=option_num)
+                            option_ids[option_id] = options[option_id].id
+                        for voter_id, option_id, position in v_data['votes']:
+                            schulze_votes.append(SchulzeVote(
+                                sorting_position=position, voter=voters[voter_id],
+                                option=options[option_id]))
+        MedianVote.objects.bulk_create(median_votes)
+        SchulzeVote.objects.bulk_create(schulze_votes)
+        # closed sessions stay closed
+        voter_ids = {voter_id: voter.id for voter_id, voter in voters.items()}
+        for collection, frozen_data in frozen_results:
+            FrozenResults.objects.create(
+                collection=collection, closed=parse_datetime(frozen_data['closed']),
+                data=frozen.remap_ids(frozen_data['data'], group_ids, median_ids,
+                                      schulze_ids, option_ids, voter_ids))
+        if data['format'] >= 3:
+            _restore_events(events, voters, median_ids, schulze_ids)
+        else:
+            # the log of the archived sessions is lost, start it with the restored votes
+            record_ballots(collection_ids)
+        snapshot.delete()
+
+
+def _restore_events(events, voters, median_ids, schulze_ids):
+    # restores the events of the sessions with the new ids, changes of votings that
+    # have been deleted before the period was archived get the voting id None
+    names = set(event[2] for _, event in events if event[2])
+    User = get_user_model()
+    users = {user.get_username(): user
+             for user in User.objects.filter(**{'%s__in' % User.USERNAME_FIELD: names})}
+    restored = []
+    for collection, event in events:
+        voter_id, voter_name, user_name, created, source, changes_list = event
+        for change in changes_list:
+            ids = median_ids if change[0] == MEDIAN else schulze_ids
+            change[1] = ids.get(change[1], None)
+        voter = voters.get(voter_id, None)
+        restored.append(BallotEvent(
+            collection=collection, collection_ref=collection.id, voter=voter,
+            voter_name=voter_name, user=users.get(user_name, None), user_name=user_name,
+            created=parse_datetime(created), source=source,
+            changes=json.dumps(changes_list, separators=(',', ':'))))
+    BallotEvent.objects.bulk_create(restored)
+
+
+def _median_vote_str(value, voting):
+    return output_currency(value, voting['currency'])
+
+
+def _majority_str(v_data):
+    if 'rule' in v_data:
+        return str(CompiledRule.from_tuple(v_data['rule']))
+    majority = v_data['majority']
+    if majority == FIFTY_MAJORITY:
+        return '50%'
+    elif majority == TWO_THIRDS_MAJORITY:
+        return '2/3'
+    return majority
+
+
+class ArchivedSession(object):
+    """An archived session prepared for the template.
+
+    Attributes:
+        collection (dict): The collection from the snapshot.
+        groups (list of (dict, list of dict)): The groups and their votings from the
+            snapshot, each voting has an additional entry 'majority_str'.
+        votings (list of dict): All votings in the order they're displayed.
+        rows (list of (str, list of str)): For each voter the name and the formatted
+            vote for each voting ('/' if the voter didn't vote).
+
+    """
+    def __init__(self, snapshot_data, collection_id):
+        self.collection = None
+        for coll_data in snapshot_data['collections']:
+            if coll_data['id'] == collection_id:
+                self.collection = coll_data
+                break
+        if self.collection is None:
+            raise KeyError(collection_id)
+        self.groups = []
+        self.votings = []
+        for group_data in self.collection['groups']:
+            votings = []
+            for v_data in group_data['votings']:
+                v_data = dict(v_data, majority_str=_majority_str(v_data))
+                votings.append(v_data)
+                self.votings.append(v_data)
+            self.groups.append((group_data, votings))
+        revision = None
+        for rev_data in snapshot_data['revisions']:
+            if rev_data['id'] == self.collection['revision']:
+                revision = rev_data
+        self.rows = self._rows(revision['voters'] if revision is not None else [])
+
+    def _rows(self, voters):
+        # maps (voting index, voter id) to the formatted vote
+        votes = dict()
+        for i, v_data in enumerate(self.votings):
+            if v_data['type'] == MEDIAN:
+                for voter_id, value in v_data['votes']:
+                    votes[(i, voter_id)] = _median_vote_str(value, v_data)
+            else:
+                positions = dict()
+                for voter_id, option_id, position in v_data['votes']:
+                    positions.setdefault(voter_id, []).append(str(position))
+                for voter_id, voter_positions in positions.items():
+                    votes[(i, voter_id)] = ' '.join(voter_positions)
+        rows = []
+        for voter_id, name, weight in voters:
+            rows.append((name, [votes.get((i, voter_id), '/')
+                                for i in range(len(self.votings))]))
+        return rows
@@ -0,0 +1,294 @@
+# Copyright 2018 - 2019 Fabian Wenzelmann
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Evaluation of whole sessions as used by the results pages.
+
+The results of a closed session (see close_collection) are not evaluated again but read
+from its models.FrozenResults record.
+
+"""
+
+import hashlib
+
+from django.core.cache import cache
+from django.db import transaction
+
+from schulze_voting import evaluate_schulze
+
+from .models import *
+from .results import *
+from .cache import (get_revision_voters, get_results_versions, get_cached, get_version,
+                     collection_version_key)
+from .median import median_for_evaluation, single_median_statistics
+from .schulze import schulze_for_evaluation, single_schulze_instance
+from . import frozen
+
+
+class SessionClosedError(Exception):
+    """Raised if a closed session should be changed."""
+    pass
+
+
+def evaluate_collection(collection):
+    """Evaluates all votings of a collection.
+
+    Args:
+        collection (models.VotingCollection): The collection to evaluate.
+
+    Returns:
+        list of (models.VotingGroup, list), list of str: The groups with the result
+            entries (MedianResultEntry or SchulzeResultEntry) of their votings and the
+            warnings of the evaluation.
+    """
+    # required for results methods, maps voter ids to voters
+    all_voters = get_revision_voters(collection.revision_id)
+
+    # get all votings + results
+    median = median_for_evaluation(collection)
+    # fill missing votes with None
+    median.fill_missing_voters(all_voters)
+    schulze = schulze_for_evaluation(collection)
+    schulze.fill_missing_voters(all_voters)
+
+    merged = CombinedVotingResult(median, schulze)
+
+    # versions of the results, used to cache the rendered result of each voting
+    median_versions, schulze_versions = get_results_versions(
+        collection, all_voters, median.votings.keys(), schulze.votings.keys())
+
+    # evaluate all votings and store everything the template needs in an entry
+    # for each voting
+    entries = dict()
+    for median_v_id, median_v in median.votings.items():
+        votes = median.votes[median_v_id]
+        instance = single_median_statistics(median_v, votes, all_voters)
+        m_result = instance.instance.median(votes_required=instance.majority)
+        entries[CombinedVotingResult.median_key(median_v_id)] = MedianResultEntry(
+            median_v, votes, instance, m_result, all_voters,
+            median_versions[median_v_id])
+    # same for schulze
+    for schulze_v_id, schulze_v in schulze.votings.items():
+        votes = schulze.votes[schulze_v_id]
+        options = schulze.voting_description[schulze_v_id]
+        instance = single_schulze_instance(schulze_v, votes, options, all_voters)
+        s_res = evaluate_schulze(instance.instance, len(options))
+        # also compute how many voters (weights) ranked an option before no
+        num, percent = votes_before_no(s_res, instance.weight_sum)
+        entries[CombinedVotingResult.schulze_key(schulze_v_id)] = SchulzeResultEntry(
+            schulze_v, votes, instance, s_res, options, num, percent, all_voters,
+            schulze_versions[schulze_v_id])
+
+    groups = []
+    for group, votings in merged.by_group():
+        group_list = []
+        for v in votings:
+            if isinstance(v, MedianVoting):
+                group_list.append(entries[CombinedVotingResult.median_key(v.id)])
+            elif isinstance(v, SchulzeVoting):
+                group_list.append(entries[CombinedVotingResult.schulze_key(v.id)])
+            else:
+                assert False
+        groups.append((group, group_list))
+
+    warnings = list(map(str, merged.warnings))
+    return groups, warnings
+
+
+def votes_before_no(schulze_res, weight_sum):
+    # for each option the weight of the votes that ranked it before the last option
+    # (no) and the percentage of weight_sum
+    num = []
+    percent = []
+    for i in range(len(schulze_res.d)):
+        entry = schulze_res.d[i][-1]
+        num.append(entry)
+        if weight_sum:
+            percent.append((entry / weight_sum) * 100.0)
+        else:
+            percent.append(0.0)
+
+    return num, percent
+
+
+def get_frozen_results(collection):
+    """Returns the FrozenResults record of a collection.
+
+    Args:
+        collection (models.VotingCollection or int): The collection or its primary key.
+
+    Returns:
+        models.FrozenResults or None: The record, None if the collection is not closed.
+    """
+    return FrozenResults.objects.filter(collection=collection).first()
+
+
+def session_results_context(collection, show_votes):
+    """Returns the context for the results template.
+
+    The votings are evaluated, for closed collections the stored results are used.
+
+    Args:
+        collection (models.VotingCollection): The collection to evaluate.
+        show_votes (bool): If true the votes of all voters are shown as well.
+
+    Returns:
+        dict: The context for votings/results/session_results.html.
+    """
+    record = get_frozen_results(collection)
+    if record is None:
+        groups, warnings = evaluate_collection(collection)
+    else:
+        groups, warnings = frozen.entries_from_record(record)
+    return {
+        'show_votes': show_votes,
+        'collection': collection,
+        'warnings': warnings,
+        'groups': groups,
+        'closed': record}
+
+
+def close_collection(collection):
+    """Closes a collection: Evaluates it and stores the results.
+
+    Args:
+        collection (models.VotingCollection): The collection to close.
+
+    Returns:
+        models.FrozenResults: The stored results.
+
+    Raises:
+        SessionClosedError: If the collection is already closed.
+    """
+    with transaction.atomic():
+        # lock the collection s.t. it can't be closed twice
+        VotingCollection.objects.select_for_update().filter(id=collection.id).first()
+        if get_frozen_results(collection) is not None:
+            raise SessionClosedError('Session "%s" is already closed' % collection.name)
+        groups, warnings = evaluate_collection(collection)
+        return FrozenResults.objects.create(
+            collection=collection, data=frozen.record_data(groups, warnings))
+
+
+def reopen_collection(collection):
+    """Reopens a closed collection: The stored results are deleted.
+
+    Args:
+        collection (models.VotingCollection): The collection to reopen.
+    """
+    with transaction.atomic():
+        # same lock as in close_collection
+        VotingCollection.objects.select_for_update().filter(id=collection.id).first()
+        FrozenResults.objects.filter(collection=collection).delete()
+
+
+def results_version(collection):
+    """Returns a version of the results of a collection.
+
+    The version changes whenever a vote, a voting, the voters or the frozen results of
+    the collection change. It is computed from the cache versions only (see
+    cache.get_results_versions), the database is only queried if the ids of the votings
+    are not cached.
+
+    Args:
+        collection (models.VotingCollection): The collection.
+
+    Returns:
+        str: The version.
+    """
+    median_ids, schulze_ids = get_cached(
+        'votings.collection.%d.voting_ids' % collection.id,
+        collection_version_key(collection),
+        lambda: (list(MedianVoting.objects
+                      .filter(group__collection=collection)
+                      .values_list('id', flat=True)),
+                 list(SchulzeVoting.objects
+                      .filter(group__collection=collection)
+                      .values_list('id', flat=True))))
+    voters = get_revision_voters(collection.revision_id)
+    median_versions, schulze_versions = get_results_versions(
+        collection, voters, median_ids, schulze_ids)
+    versions = ['m%d:%s' % entry for entry in sorted(median_versions.items())]
+    versions.extend('s%d:%s' % entry for entry in sorted(schulze_versions.items()))
+    # also required if there are no votings
+    versions.append('%s.%s' % (get_version(collection_version_key(collection)),
+                               voters.version))
+    return hashlib.sha1(' '.join(versions).encode('utf-8')).hexdigest()
+
+
+def _entry_json(entry, show_votes):
+    voting = entry.voting
+    res = {
+        'type': entry.v_type,
+        'id': voting.id,
+        'name': voting.name,
+        'majority': voting.majority,
+        'absolute_majority': voting.absolute_majority,
+        'quorum': str(entry.instance.rule),
+        'quorum_strict': entry.instance.rule.strict,
+        'quorum_absolute': entry.instance.rule.absolute,
+        'abstentions_as_no': entry.instance.rule.abstentions_as_no,
+        'weight_sum': entry.instance.weight_sum,
+        'required_votes': entry.instance.majority,
+    }
+    if entry.v_type == 'median':
+        res['value'] = voting.value
+        res['currency'] = voting.currency
+        res['result'] = entry.result
+    else:
+        res['options'] = [option.option for option in entry.options]
+        res['ranking'] = [[entry.options[i].option for i in group]
+                          for group in entry.result.candidate_wins]
+        res['num_no'] = entry.num_no
+        res['percent_no'] = entry.percent_no
+    if show_votes:
+        res['votes'] = [{'voter': voter.name, 'weight': voter.weight, 'vote': vote,
+                         'corrected_vote': actual}
+                        for voter, vote, actual in entry.detail_rows]
+    return res
+
+
+def results_data(collection, show_votes=False, version=None):
+    """Returns the results of a collection as JSON serializable dict.
+
+    The dict contains the same data as the results page. It is cached for the current
+    results_version.
+
+    Args:
+        collection (models.VotingCollection): The collection.
+        show_votes (bool): If true the votes of all voters are included.
+        version (str or None): The results_version of the collection, computed if None.
+
+    Returns:
+        dict: The results.
+    """
+    if version is None:
+        version = results_version(collection)
+    key = 'votings.results.json.%d.%d.%s' % (collection.id, show_votes, version)
+    data = cache.get(key)
+    if data is None:
+        context = session_results_context(collection, show_votes)
+        data = {
+            'session': collection.id,
+            'name': collection.name,
+            'time': collection.time.isoformat(),
+            'closed': context['closed'] is not None,
+            'version': version,
+            'warnings': context['warnings'],
+            'groups': [{'id': group.id,
+                        'name': group.name,
+                        'votings': [_entry_json(entry, show_votes) for entry in entries]}
+                       for group, entries in context['groups']],
+        }
+        cache.set(key, data)
+    return data
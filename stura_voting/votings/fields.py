@@ -13,8 +13,9 @@
 # limitations under the License.
 
 from django import forms
-from stura_voting_utils.parser import parse_voters, parse_voting_collection, ParseException, parse_currency, _schulze_option_rx
-from stura_voting_utils import SchulzeVotingSkeleton
+from stura_voting_utils.parser import ParseException, parse_currency
+
+from .parser import parse_voters, parse_schulze_options, parse_voting_collection, ParseErrors
 
 import re
 
@@ -28,6 +29,7 @@ class VotersRevisionField(forms.CharField):
     Beginning with *, followed by the name, a colon and the voters weight: "* <NAME>: <WEIGHT>".
 
     The clean method returns the list of all voters in the form of stura_voting_utils.WeightedVoter.
+    All invalid lines are reported at once (see the parser module).
 
     """
 
@@ -36,12 +38,10 @@ class VotersRevisionField(forms.CharField):
     def clean(self, value):
         cleaned = super().clean(value)
         try:
-            voters = list(parse_voters(cleaned.split('\n')))
-            return voters
-        except ParseException as e:
+            return parse_voters(cleaned)
+        except ParseErrors as e:
             raise forms.ValidationError(
-                "Can't parse voters from field: %s" %
-                str(e))
+                ["Can't parse voters from field: %s" % msg for msg in e.messages()])
 
 
 class SchulzeOptionsField(forms.CharField):
@@ -59,22 +59,10 @@ class SchulzeOptionsField(forms.CharField):
 
     def clean(self, value):
         cleaned = super().clean(value)
-        # kind of hacky, but ok
-        options = []
-        for line in cleaned.split('\n'):
-            line = line.strip()
-            if not line:
-                continue
-            match = _schulze_option_rx.match(line)
-            if not match:
-                raise forms.ValidationError(
-                    "Can't parse option line '%s'" % line)
-            o = match.group('option')
-            o = o.strip()
-            options.append(o)
-        if len(options) < 2:
-            raise forms.ValidationError('Not enough options for voting')
-        return options
+        try:
+            return parse_schulze_options(cleaned)
+        except ParseErrors as e:
+            raise forms.ValidationError(e.messages())
 
 
 class VotingCollectionField(forms.CharField):
@@ -83,7 +71,7 @@ class VotingCollectionField(forms.CharField):
     The content must be a (multilined) description of the voting collection as defined in
     stura_voting_utils.parse_voting_collection. The clean method returns this parsed instance.
     The clean method may raise a ValidationError if the collection can't be parsed (invalid syntax)
-    or if a schulze voting has less than two options.
+    or if a schulze voting has less than two options, all errors are reported at once.
 
     """
 
@@ -92,19 +80,10 @@ class VotingCollectionField(forms.CharField):
     def clean(self, value):
         cleaned = super().clean(value)
         try:
-            collection = parse_voting_collection(cleaned.split('\n'))
-            # check if each schulze voting has at least two options
-            for group in collection.groups:
-                for skel in group.get_votings():
-                    if isinstance(skel, SchulzeVotingSkeleton):
-                        if len(skel.options) < 2:
-                            raise forms.ValidationError(
-                                'Not enough options for schulze voting')
-            return collection
-        except ParseException as e:
+            return parse_voting_collection(cleaned)
+        except ParseErrors as e:
             raise forms.ValidationError(
-                "Can't parse voting collection from field: %s" %
-                str(e))
+                ["Can't parse voting collection from field: %s" % msg for msg in e.messages()])
 
 
 # TODO test both fields
@@ -17,6 +17,7 @@ from django import forms
 from .models import *
 from .fields import *
 from .results import *
+from .cache import LocalCache, get_version, collection_version_key
 
 from stura_voting_utils.utils import output_currency
 
@@ -131,79 +132,179 @@ class DynamicVotingsListForm(forms.Form):
         super().__init__(*args, **kwargs)
 
 
+_local_voter_forms = LocalCache()
+
+
+def _voter_result(template):
+    # a new result for a voter sharing the votings of the cached template
+    res = GenericVotingResult()
+    res.votings = template.votings
+    res.voting_description = template.voting_description
+    res.warnings = list(template.warnings)
+    return res
+
+
 # TODO check form: Are warnings displayed if POSTed?
 class ResultsSingleVoterForm(DynamicVotingsListForm):
     """A form for adding the votes of a single voter into a session / VotingCollection.
 
-    The init method expects the keyword arguments "collection" and "voter".
-    "collection" must be a models.VotingCollection and voter a models.Voter instance.
-    It dynamically creates new fields for all votings.
-    The votings are created with the functions median_votes_for_voter and schulze_votes_for_voter.
+    The fields depend on the votings of the collection, so this class is not used
+    directly: for_collection returns a subclass with a field for each voting of the
+    collection. These classes are cached until the collection (or one of its groups,
+    votings or options) is changed, so creating a form only loads the votes of the voter.
 
-    It adds fields with the prefixes as defined in DynamicVotingsListForm and sets the
-    initial value if a vote already exists.
-    The added fields are of type CurrencyField for median and SchulzeVoteField for schulze votings.
+    The init method expects the keyword argument "voter", a models.Voter instance, and
+    sets the initial value of a field if a vote already exists. The optional keyword
+    argument "verified" skips the checks of existing votes (see
+    models.VotingCollection.votes_are_verified).
+    The fields have the prefixes as defined in DynamicVotingsListForm and are of type
+    CurrencyField for median and SchulzeVoteField for schulze votings.
 
     Attributes:
+        collection_id (int): The id of the collection (set in the subclass).
+        version (str): The version of the collection the subclass was created for.
+        median_votings (GenericVotingResult): The median votings of the collection
+            without votes (set in the subclass), must not be changed.
+        schulze_votings (GenericVotingResult): The schulze votings of the collection
+            without votes (set in the subclass), must not be changed.
         results (CombinedVotingResult): The combined median and schulze votings.
         median_result (GenericVotingResult): The median votings and results.
         schulze_result (GenericVotingResult): The schulze votings and results.
     """
 
-    def __init__(self, *args, **kwargs):
-        collection = kwargs.pop('collection')
-        voter = kwargs.pop('voter')
-        super().__init__(*args, **kwargs)
-        # TODO add check according to same revision and so on?
-        median_result = median_votes_for_voter(collection, voter)
-        schulze_result = schulze_votes_for_voter(collection, voter)
+    collection_id = None
+    version = None
+    median_votings = None
+    schulze_votings = None
+
+    @classmethod
+    def for_collection(cls, collection):
+        """Returns the form class for a collection.
+
+        Args:
+            collection (models.VotingCollection): The collection.
+
+        Returns:
+            class: A subclass of ResultsSingleVoterForm, must not be changed.
+        """
+        version_key = collection_version_key(collection)
+        version = get_version(version_key)
+        form_class = _local_voter_forms.get(version_key, version)
+        if form_class is None:
+            form_class = cls._create_form_class(collection, version)
+            _local_voter_forms.set(version_key, version, form_class)
+        return form_class
+
+    @classmethod
+    def _create_form_class(cls, collection, version):
+        median_result = median_votings(collection=collection)
+        schulze_result = schulze_votings(collection=collection)
         all_results = CombinedVotingResult(median_result, schulze_result)
-        self.results = all_results
-        self.median_result = median_result
-        self.schulze_result = schulze_result
+        attrs = {
+            'collection_id': collection.id,
+            'version': version,
+            'median_votings': median_result,
+            'schulze_votings': schulze_result,
+        }
         for group, voting_list in all_results.by_group():
-            group_field_name = self.label_field_prefix + str(group.id)
-            self.fields[group_field_name] = forms.CharField(
+            group_field_name = cls.label_field_prefix + str(group.id)
+            attrs[group_field_name] = forms.CharField(
                 label='', initial=str(group.name), required=False, disabled=True)
             for voting in voting_list:
                 voting_id = voting.id
                 if isinstance(voting, MedianVoting):
-                    field_name = self.median_field_prefix + str(voting_id)
+                    field_name = cls.median_field_prefix + str(voting_id)
                     currency = voting.currency
                     if not currency:
                         currency = None
                     as_currency = output_currency(voting.value, currency)
-                    self.fields[field_name] = CurrencyField(
+                    attrs[field_name] = CurrencyField(
                         max_value=voting.value,
                         label='Finanzantrag: %s (%s)' %
                         (str(
                             voting.name),
                             as_currency),
                         required=False)
-                    # add initial value (if exists)
-                    if voting_id in median_result.votes:
-                        result = median_result.votes[voting_id]
-                        as_currency = output_currency(result.value, currency)
-                        self.fields[field_name].initial = as_currency
                 elif isinstance(voting, SchulzeVoting):
-                    field_name = self.schulze_field_prefix + str(voting_id)
+                    field_name = cls.schulze_field_prefix + str(voting_id)
                     num_options = len(
-                        schulze_result.voting_description[voting_id])
-                    self.fields[field_name] = SchulzeVoteField(
+                        schulze_result.voting_description.get(voting_id, []))
+                    attrs[field_name] = SchulzeVoteField(
                         num_options=num_options,
                         label='Abstimmung: %s (%d)' %
                         (str(
                             voting.name),
                             num_options),
                         required=False)
-                    if voting_id in schulze_result.votes:
-                        result = schulze_result.votes[voting_id]
-                        assert result
-                        ranking_str = ' '.join(
-                            str(vote.sorting_position) for vote in result)
-                        self.fields[field_name].initial = ranking_str
                 else:
                     assert False
+        return type('%s_%d' % (cls.__name__, collection.id), (cls,), attrs)
+
+    def __init__(self, *args, **kwargs):
+        voter = kwargs.pop('voter')
+        verified = kwargs.pop('verified', False)
+        super().__init__(*args, **kwargs)
+        if self.median_votings is None:
+            raise TypeError('Use ResultsSingleVoterForm.for_collection to get the form class')
+        # TODO add check according to same revision and so on?
+        median_result = _voter_result(self.median_votings)
+        add_median_votes_for_voter(median_result, self.collection_id, voter)
+        schulze_result = _voter_result(self.schulze_votings)
+        add_schulze_votes_for_voter(schulze_result, self.collection_id, voter, verified)
+        self.results = CombinedVotingResult(median_result, schulze_result)
+        self.median_result = median_result
+        self.schulze_result = schulze_result
+        # add initial values (if exist)
+        for voting_id, result in median_result.votes.items():
+            voting = median_result.votings[voting_id]
+            field_name = self.median_field_prefix + str(voting_id)
+            currency = voting.currency
+            if not currency:
+                currency = None
+            self.fields[field_name].initial = output_currency(result.value, currency)
+        for voting_id, result in schulze_result.votes.items():
+            assert result
+            field_name = self.schulze_field_prefix + str(voting_id)
+            ranking_str = ' '.join(
+                str(vote.sorting_position) for vote in result)
+            self.fields[field_name].initial = ranking_str
+
+    @classmethod
+    def layout(cls):
+        """Returns the fields of the form grouped by voting groups, used for the rapid entry.
+
+        Returns:
+            list of dict: For each group a dict with the 'name' of the group and its
+                'fields'. Each field is a dict with the 'name' of the field, its 'label',
+                the 'type' ('median' or 'schulze') and the 'options' (the names of the
+                options, only for schulze votings).
+        """
+        res = []
+        for name, field in cls.base_fields.items():
+            if name.startswith(cls.label_field_prefix):
+                res.append({'name': field.initial, 'fields': []})
+                continue
+            entry = {'name': name, 'label': str(field.label)}
+            if name.startswith(cls.median_field_prefix):
+                entry['type'] = 'median'
+            else:
+                entry['type'] = 'schulze'
+                voting_id = int(name[len(cls.schulze_field_prefix):])
+                options = cls.schulze_votings.voting_description.get(voting_id, [])
+                entry['options'] = [option.option for option in options]
+            res[-1]['fields'].append(entry)
+        return res
+
+    def initial_values(self):
+        """Returns the initial values of the vote fields.
+
+        Returns:
+            dict: Maps the name of each median and schulze field to its initial value
+                (the empty string if the voter did not vote).
+        """
+        return {name: field.initial or ''
+                for name, field in self.fields.items()
+                if not name.startswith(self.label_field_prefix)}
 
     def votings(self):
         for name, value in self.cleaned_data.items():
@@ -254,11 +355,67 @@ class UpdateGroupForm(forms.Form):
             self.fields['order'].initial = ' '.join(map(str, current_order))
 
 
+class VoterSearchForm(forms.Form):
+    """A form to search for voters and their votes.
+
+    Attributes:
+        query (forms.CharField): The (part of the) name to search for.
+        split (forms.BooleanField): If true each word of the query is searched for.
+        period (forms.ModelChoiceField): Only search in sessions of this period, optional.
+        start (forms.DateField): Only search in sessions on or after this day, optional.
+        end (forms.DateField): Only search in sessions on or before this day, optional.
+
+    """
+    query = forms.CharField(required=True, max_length=150, label='Name')
+    split = forms.BooleanField(required=False, label='Nach jedem Wort einzeln suchen')
+    period = forms.ModelChoiceField(queryset=Period.objects.order_by('-start', '-created'),
+                                    required=False, label='Abstimmungsperiode')
+    start = forms.DateField(required=False, label='Von',
+                            widget=forms.DateInput(attrs={'type': 'date'}))
+    end = forms.DateField(required=False, label='Bis',
+                          widget=forms.DateInput(attrs={'type': 'date'}))
+
+
+class VoterHistoryForm(forms.Form):
+    """A form to select the voter whose vote history is shown.
+
+    Attributes:
+        name (forms.CharField): The exact name of the voter.
+        period (forms.ModelChoiceField): Only show votes of this period, optional.
+
+    """
+    name = forms.CharField(required=True, max_length=150, label='Name')
+    period = forms.ModelChoiceField(queryset=Period.objects.order_by('-start', '-created'),
+                                    required=False, label='Abstimmungsperiode')
+
+
+class PeriodsFilterForm(forms.Form):
+    """A form to filter the list of periods.
+
+    Attributes:
+        year (forms.IntegerField): Only show periods starting in this year, optional.
+
+    """
+    year = forms.IntegerField(required=False, min_value=1, max_value=9999, label='Jahr')
+
+
+class SessionsFilterForm(PeriodsFilterForm):
+    """A form to filter the list of sessions.
+
+    Attributes:
+        year (forms.IntegerField): Only show sessions in this year, optional.
+        period (forms.ModelChoiceField): Only show sessions of this period, optional.
+
+    """
+    period = forms.ModelChoiceField(queryset=Period.objects.order_by('-start', '-created'),
+                                    required=False, label='Abstimmungsperiode')
+
+
 class SchulzeVotingCreateForm(forms.ModelForm):
     """Form to add a schulze voting.
 
-    Name, majority and absolute_majority can be configured, the options are parsed
-    from a SchulzeOptionsField field.
+    Name, majority, absolute_majority and the quorum rule can be configured, the options
+    are parsed from a SchulzeOptionsField field.
 
     Attributes:
         options (SchulzeOptionsField): The options for the voting, required.
@@ -269,6 +426,6 @@ class SchulzeVotingCreateForm(forms.ModelForm):
 
     class Meta:
         model = SchulzeVoting
-        fields = ('name', 'majority', 'absolute_majority')
+        fields = ('name', 'majority', 'absolute_majority', 'quorum')
 
 # https://jacobian.org/writing/dynamic-form-generation/
\ No newline at end of file
@@ -0,0 +1,215 @@
+# Copyright 2018 - 2019 Fabian Wenzelmann
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Frozen results of closed sessions.
+
+When a session is closed its results are evaluated once and stored as JSON in a
+models.FrozenResults record. This module converts the result entries (MedianResultEntry
+and SchulzeResultEntry) into the record and back. The entries created from a record
+have the same attributes as the original entries, so the results template can't tell
+the difference.
+
+The record is a JSON document of the form:
+
+    {
+        'warnings': [str, ...],
+        'groups': [[group_id, [voting, ...]], ...],
+    }
+
+Each voting is a dict with 'type' ('median' or 'schulze'), 'id', 'weight_sum',
+'majority', 'rule' (majority.CompiledRule.as_tuple) and 'detail' (a list
+[voter_id, name, weight, vote, corrected vote] for each voter). Median votings contain the 'result', schulze votings the 'options'
+([id, option, option_num]), the 'd' matrix, 'candidate_wins', 'num_no' and 'percent_no'.
+
+"""
+
+import json
+
+from collections import namedtuple
+
+from schulze_voting import SchulzeRes
+
+from .models import *
+from .cache import CachedVoter
+from .results import GenericVotingInstance, MedianResultEntry, SchulzeResultEntry
+from .majority import CompiledRule
+from .quorum import voting_rule
+
+
+FrozenOption = namedtuple('FrozenOption', ['id', 'option', 'option_num'])
+
+
+def _detail(entry):
+    return [[voter.id, voter.name, voter.weight, vote, actual]
+            for voter, vote, actual in entry.detail_rows]
+
+
+def _entry_data(entry):
+    res = {
+        'type': entry.v_type,
+        'id': entry.voting.id,
+        'weight_sum': entry.instance.weight_sum,
+        'majority': entry.instance.majority,
+        'rule': entry.instance.rule.as_tuple(),
+        'detail': _detail(entry),
+    }
+    if entry.v_type == 'median':
+        res['result'] = entry.result
+    else:
+        res['options'] = [[option.id, option.option, option.option_num]
+                          for option in entry.options]
+        res['d'] = entry.result.d
+        res['candidate_wins'] = entry.result.candidate_wins
+        res['num_no'] = entry.num_no
+        res['percent_no'] = entry.percent_no
+    return res
+
+
+def record_data(groups, warnings):
+    """Returns the JSON document stored for evaluated results.
+
+    Args:
+        groups (list of (models.VotingGroup, list)): The groups and the result entries of
+            their votings.
+        warnings (list of str): The warnings of the evaluation.
+
+    Returns:
+        str: The JSON document.
+    """
+    data = {
+        'warnings': warnings,
+        'groups': [[group.id, [_entry_data(entry) for entry in entries]]
+                   for group, entries in groups],
+    }
+    return json.dumps(data, separators=(',', ':'))
+
+
+def _instance(voting, data):
+    instance = GenericVotingInstance()
+    instance.weight_sum = data['weight_sum']
+    instance.majority = data['majority']
+    if 'rule' in data:
+        instance.rule = CompiledRule.from_tuple(data['rule'])
+    else:
+        # closed before the rules were stored
+        instance.rule = voting_rule(voting)
+    return instance
+
+
+class _FrozenEntryMixin(object):
+    # detail_rows is not computed from the votes but read from the record
+
+    def __init__(self, detail):
+        self._detail = detail
+
+    @property
+    def detail_rows(self):
+        return [(CachedVoter(voter_id, name, weight), vote, actual)
+                for voter_id, name, weight, vote, actual in self._detail]
+
+
+class FrozenMedianEntry(_FrozenEntryMixin, MedianResultEntry):
+    """A MedianResultEntry read from a record."""
+    def __init__(self, voting, data, version):
+        instance = _instance(voting, data)
+        MedianResultEntry.__init__(self, voting, None, instance, data['result'], None,
+                                   version)
+        _FrozenEntryMixin.__init__(self, data['detail'])
+
+
+class FrozenSchulzeEntry(_FrozenEntryMixin, SchulzeResultEntry):
+    """A SchulzeResultEntry read from a record."""
+    def __init__(self, voting, data, version):
+        instance = _instance(voting, data)
+        result = SchulzeRes()
+        result.d = data['d']
+        result.candidate_wins = data['candidate_wins']
+        options = [FrozenOption(*option) for option in data['options']]
+        SchulzeResultEntry.__init__(self, voting, None, instance, result, options,
+                                    data['num_no'], data['percent_no'], None, version)
+        _FrozenEntryMixin.__init__(self, data['detail'])
+
+
+def entries_from_record(record):
+    """Returns the result entries stored in a record.
+
+    Groups and votings that have been deleted after the session was closed are skipped.
+
+    Args:
+        record (models.FrozenResults): The record.
+
+    Returns:
+        list of (models.VotingGroup, list), list of str: The groups with the entries
+            of their votings (as in the results template) and the warnings.
+    """
+    data = json.loads(record.data)
+    version = 'frozen.%s' % record.closed.timestamp()
+    collection_id = record.collection_id
+    groups = {group.id: group
+              for group in VotingGroup.objects.filter(collection=collection_id)}
+    median = {v.id: v for v in MedianVoting.objects.filter(group__collection=collection_id)}
+    schulze = {v.id: v for v in SchulzeVoting.objects.filter(group__collection=collection_id)}
+    res = []
+    for group_id, entries_data in data['groups']:
+        group = groups.get(group_id, None)
+        if group is None:
+            continue
+        entries = []
+        for entry_data in entries_data:
+            if entry_data['type'] == 'median':
+                voting = median.get(entry_data['id'], None)
+                if voting is not None:
+                    entries.append(FrozenMedianEntry(voting, entry_data, version))
+            else:
+                voting = schulze.get(entry_data['id'], None)
+                if voting is not None:
+                    entries.append(FrozenSchulzeEntry(voting, entry_data, version))
+        res.append((group, entries))
+    return res, data['warnings']
+
+
+def remap_ids(data, groups, median, schulze, options, voters):
+    """Returns the JSON document of a record with new ids, used to restore a record.
+
+    Args:
+        data (str): The JSON document of the record.
+        groups (dict int to int): Maps the old ids of the groups to the new ones.
+        median (dict int to int): Maps the old ids of the median votings to the new ones.
+        schulze (dict int to int): Maps the old ids of the schulze votings to the new ones.
+        options (dict int to int): Maps the old ids of the options to the new ones.
+        voters (dict int to int): Maps the old ids of the voters to the new ones.
+
+    Returns:
+        str: The JSON document with the new ids, objects without a new id are removed.
+    """
+    data = json.loads(data)
+    res_groups = []
+    for group_id, entries_data in data['groups']:
+        if group_id not in groups:
+            continue
+        entries = []
+        for entry_data in entries_data:
+            ids = median if entry_data['type'] == 'median' else schulze
+            if entry_data['id'] not in ids:
+                continue
+            entry_data['id'] = ids[entry_data['id']]
+            entry_data['detail'] = [[voters.get(voter_id, None)] + row
+                                    for voter_id, *row in entry_data['detail']]
+            if 'options' in entry_data:
+                entry_data['options'] = [[options.get(option_id, None)] + row
+                                         for option_id, *row in entry_data['options']]
+            entries.append(entry_data)
+        res_groups.append([groups[group_id], entries])
+    data['groups'] = res_groups
+    return json.dumps(data, separators=(',', ':'))
@@ -0,0 +1,497 @@
+# Copyright 2018 - 2019 Fabian Wenzelmann
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Maintains the materialized vote history (models.VoteHistoryEntry) and the rollup
+tables from the stats module.
+
+If a voting, its collection or the voters change the history is refreshed for the
+whole voting: All entries of the voting are deleted, the voting is evaluated and an
+entry for each counted vote is inserted. The statistics of the voting are stored as
+well and the participation of the affected periods is recomputed.
+If only the votes of some voters change only the entries of these voters are replaced
+and the participation of these voters is adjusted by the number of added and removed
+entries. The voting is not evaluated then, instead its statistics are marked as
+outdated. The outcome and the statistics of outdated votings are computed when they're
+read, see refresh_outdated.
+
+Changes are not refreshed immediately, instead the signal handlers call
+schedule_refresh and all scheduled refreshes are executed once after the transaction
+has been committed. So entering the votes of a voter refreshes each voting only once.
+The changes are already committed then, so a failing refresh is only logged; the
+history can be rebuilt with the rebuild_history command.
+
+"""
+
+import logging
+import threading
+
+from collections import Counter, OrderedDict, defaultdict
+from itertools import groupby
+
+from django.db import transaction
+from django.db.models import F
+
+from schulze_voting import evaluate_schulze
+from stura_voting_utils.utils import output_currency
+
+from .models import *
+from .cache import WeightedVoters
+from .median import single_median_statistics
+from .schulze import single_schulze_instance
+from .results import median_vote_str, schulze_vote_str
+from . import stats
+
+
+MEDIAN = 'median'
+SCHULZE = 'schulze'
+MEDIAN_VOTE = 'median_vote'
+SCHULZE_VOTE = 'schulze_vote'
+COLLECTION = 'collection'
+REVISION = 'revision'
+PERIOD = 'period'
+
+logger = logging.getLogger(__name__)
+
+_pending = threading.local()
+
+
+def _pending_items():
+    items = getattr(_pending, 'items', None)
+    if items is None:
+        items = set()
+        _pending.items = items
+    return items
+
+
+def schedule_refresh(kind, pk):
+    """Refreshes the history of some votings after the current transaction is committed.
+
+    Args:
+        kind (str): MEDIAN or SCHULZE to refresh a single voting, MEDIAN_VOTE or
+            SCHULZE_VOTE to refresh only the entries of a voter in a voting, COLLECTION
+            to refresh all votings of a collection, REVISION to refresh all votings of
+            all collections of a revision and PERIOD to refresh only the participation
+            in a period (for example after a voting has been deleted).
+        pk (int or (int, int)): The primary key of the voting, collection, revision or
+            period; for MEDIAN_VOTE and SCHULZE_VOTE a tuple (voting id, voter id).
+    """
+    _pending_items().add((kind, pk))
+    # each call registers the callback, the first one refreshes everything scheduled
+    # until then, the others have nothing left to do
+    transaction.on_commit(flush_pending)
+
+
+def flush_pending():
+    """Executes all refreshes scheduled with schedule_refresh."""
+    items = _pending_items()
+    if not items:
+        return
+    todo = set(items)
+    items.clear()
+    # the changes are committed already, an exception here would only turn a saved
+    # change into an error page
+    try:
+        refresh(todo)
+    except Exception:
+        logger.exception('Refreshing the vote history failed for %s, run rebuild_history',
+                         sorted(todo, key=str))
+
+
+def refresh(items):
+    """Refreshes the history for some votings.
+
+    Args:
+        items (iterable of (str, int)): The kind and primary keys, see schedule_refresh.
+    """
+    median_ids, schulze_ids = set(), set()
+    collection_ids, revision_ids, period_ids = set(), set(), set()
+    median_votes, schulze_votes = defaultdict(set), defaultdict(set)
+    for kind, pk in items:
+        if kind == MEDIAN:
+            median_ids.add(pk)
+        elif kind == SCHULZE:
+            schulze_ids.add(pk)
+        elif kind == MEDIAN_VOTE:
+            median_votes[pk[0]].add(pk[1])
+        elif kind == SCHULZE_VOTE:
+            schulze_votes[pk[0]].add(pk[1])
+        elif kind == COLLECTION:
+            collection_ids.add(pk)
+        elif kind == REVISION:
+            revision_ids.add(pk)
+        elif kind == PERIOD:
+            period_ids.add(pk)
+        else:
+            raise ValueError('Invalid history refresh kind %s' % kind)
+    if revision_ids:
+        collection_ids.update(VotingCollection.objects
+                              .filter(revision__in=revision_ids)
+                              .values_list('id', flat=True))
+    if collection_ids:
+        median_ids.update(MedianVoting.objects
+                          .filter(group__collection__in=collection_ids)
+                          .values_list('id', flat=True))
+        schulze_ids.update(SchulzeVoting.objects
+                           .filter(group__collection__in=collection_ids)
+                           .values_list('id', flat=True))
+    with transaction.atomic():
+        for voting_id in median_ids:
+            period_ids.add(refresh_median_voting(voting_id))
+        for voting_id in schulze_ids:
+            period_ids.add(refresh_schulze_voting(voting_id))
+        # votings refreshed completely contain the changed votes already
+        participation = defaultdict(Counter)
+        for voting_id, voter_ids in median_votes.items():
+            if voting_id not in median_ids:
+                period_id, deltas = refresh_median_votes(voting_id, voter_ids)
+                participation[period_id].update(deltas)
+        for voting_id, voter_ids in schulze_votes.items():
+            if voting_id not in schulze_ids:
+                period_id, deltas = refresh_schulze_votes(voting_id, voter_ids)
+                participation[period_id].update(deltas)
+        period_ids.discard(None)
+        stats.refresh_participation(period_ids)
+        # only the votes changed in the other periods
+        for period_id, deltas in participation.items():
+            if period_id is not None and period_id not in period_ids:
+                stats.adjust_participation(period_id, deltas)
+
+
+def rebuild():
+    """Rebuilds the whole history and all statistics, used to fill them for existing votes.
+
+    The entries of archived periods are kept, their votes don't exist anymore.
+    """
+    with transaction.atomic():
+        VoteHistoryEntry.objects.filter(collection__isnull=False).delete()
+        VotingStatistics.objects.filter(collection__isnull=False).delete()
+        for voting_id in MedianVoting.objects.values_list('id', flat=True):
+            refresh_median_voting(voting_id)
+        for voting_id in SchulzeVoting.objects.values_list('id', flat=True):
+            refresh_schulze_voting(voting_id)
+        stats.refresh_participation(Period.objects.values_list('id', flat=True))
+
+
+def _entry(voting, collection, voter, vote, outcome, v_type):
+    entry = VoteHistoryEntry(
+        voter_id=voter.id,
+        voter_name=voter.name,
+        period_id=collection.revision.period_id,
+        collection=collection,
+        collection_name=collection.name,
+        collection_time=collection.time,
+        group_num=voting.group.group_num,
+        voting_num=voting.voting_num,
+        voting_type=v_type,
+        voting_name=voting.name,
+        vote=vote,
+        outcome=outcome)
+    if v_type == MEDIAN:
+        entry.median_voting = voting
+    else:
+        entry.schulze_voting = voting
+    return entry
+
+
+def _replace_entries(voting, v_type, voter_ids, entries):
+    # replaces the entries of the given voters, adjusts the number of votes in the
+    # statistics and marks the rest of the statistics (and the outcome) of the voting as
+    # outdated, returns the change of the number of votes of each voter (by name)
+    lookup = 'median_voting' if v_type == MEDIAN else 'schulze_voting'
+    old_entries = VoteHistoryEntry.objects.filter(**{lookup: voting, 'voter__in': voter_ids})
+    deltas = Counter()
+    deltas.subtract(old_entries.values_list('voter_name', flat=True))
+    deltas.update(entry.voter_name for entry in entries)
+    old_entries.delete()
+    VoteHistoryEntry.objects.bulk_create(entries)
+    VotingStatistics.objects.filter(**{lookup: voting}).update(
+        num_votes=F('num_votes') + sum(deltas.values()), outdated=True)
+    return deltas
+
+
+def _evaluate_median(voting, collection):
+    # returns the counted votes, the evaluation instance, the result and the outcome
+    # as displayed, instance, result and outcome are None if there are no votes
+    # not taken from the cache: the cache is invalidated after the commit as well,
+    # so it might not be up to date yet
+    voters = WeightedVoters.from_db(collection.revision_id)
+    votes_qs = (MedianVote.objects
+                .filter(voting=voting, voter__revision=collection.revision_id)
+                .select_related('voter')
+                .order_by('-value'))
+    # same rules as in median_for_evaluation: invalid votes are not counted, the values
+    # are only trusted if the votes of the collection have been verified
+    if collection.votes_are_verified():
+        votes = OrderedDict((vote.voter_id, vote) for vote in votes_qs)
+    else:
+        votes = OrderedDict((vote.voter_id, vote) for vote in votes_qs
+                            if vote.value <= voting.value)
+    if not votes:
+        return [], None, None, None
+    counted = list(votes.values())
+    for voter in voters:
+        if voter.id not in votes:
+            votes[voter.id] = None
+    instance = single_median_statistics(voting, votes, voters)
+    result = instance.instance.median(votes_required=instance.majority)
+    if result is None:
+        outcome = 'Kein Wert abgestimmt'
+    else:
+        outcome = '%s von %s' % (output_currency(result, voting.currency),
+                                 output_currency(voting.value, voting.currency))
+    return counted, instance, result, outcome
+
+
+def _get_median_voting(voting_id):
+    return (MedianVoting.objects
+            .filter(id=voting_id)
+            .select_related('group__collection__revision')
+            .first())
+
+
+def refresh_median_voting(voting_id):
+    """Recomputes all history entries and the statistics of a median voting.
+
+    Args:
+        voting_id (int): The id of the voting, if it does not exist all its entries are
+            removed.
+
+    Returns:
+        int or None: The id of the period of the voting, None if it does not exist.
+    """
+    VoteHistoryEntry.objects.filter(median_voting=voting_id).delete()
+    VotingStatistics.objects.filter(median_voting=voting_id).delete()
+    voting = _get_median_voting(voting_id)
+    if voting is None:
+        return None
+    collection = voting.group.collection
+    counted, instance, result, outcome = _evaluate_median(voting, collection)
+    VoteHistoryEntry.objects.bulk_create(
+        _entry(voting, collection, vote.voter, median_vote_str(vote, voting), outcome, MEDIAN)
+        for vote in counted)
+    stats.median_voting_statistics(voting, collection, counted, instance, result).save()
+    return collection.revision.period_id
+
+
+def refresh_median_votes(voting_id, voter_ids):
+    """Refreshes the history entries of some voters in a median voting.
+
+    Only the entries of the given voters are replaced, the voting is not evaluated: The
+    statistics are marked as outdated, the outcome of the entries and the statistics are
+    computed when they're read (see refresh_outdated).
+
+    Args:
+        voting_id (int): The id of the voting, if it does not exist nothing is done (the
+            entries are deleted together with the voting).
+        voter_ids (set of int): The ids of the voters whose votes changed.
+
+    Returns:
+        (int or None, collections.Counter): The id of the period of the voting (None if
+            it does not exist) and the change of the number of votes of each voter (by
+            name), see stats.adjust_participation.
+    """
+    voting = _get_median_voting(voting_id)
+    if voting is None:
+        return None, Counter()
+    collection = voting.group.collection
+    votes = (MedianVote.objects
+             .filter(voting=voting, voter__in=voter_ids, voter__revision=collection.revision_id)
+             .select_related('voter'))
+    # same rules as in _evaluate_median
+    verified = collection.votes_are_verified()
+    entries = [_entry(voting, collection, vote.voter, median_vote_str(vote, voting), '',
+                      MEDIAN)
+               for vote in votes if verified or vote.value <= voting.value]
+    deltas = _replace_entries(voting, MEDIAN, voter_ids, entries)
+    return collection.revision.period_id, deltas
+
+
+def _evaluate_schulze(voting, collection, options):
+    # returns the voters, the counted votes (list of (voter id, votes)), the evaluation
+    # instance, the result and the outcome as displayed, instance, result and outcome
+    # are None if there are no votes
+    voters = WeightedVoters.from_db(collection.revision_id)
+    votes_qs = (SchulzeVote.objects
+                .filter(option__voting=voting, voter__revision=collection.revision_id)
+                .select_related('option')
+                .order_by('voter__id', 'option__option_num'))
+    # same rules as in schulze_for_evaluation: incomplete rankings are not counted
+    votes = OrderedDict()
+    for voter_id, votes_for_voter in groupby(votes_qs, lambda vote: vote.voter_id):
+        votes_list = list(votes_for_voter)
+        if len(votes_list) == len(options):
+            votes[voter_id] = votes_list
+    if not votes:
+        return voters, [], None, None, None
+    counted = list(votes.items())
+    for voter in voters:
+        if voter.id not in votes:
+            votes[voter.id] = None
+    instance = single_schulze_instance(voting, votes, options, voters)
+    s_res = evaluate_schulze(instance.instance, len(options))
+    outcome = ', '.join(options[i].option for i in s_res.candidate_wins[0])
+    return voters, counted, instance, s_res, outcome
+
+
+def _get_schulze_voting(voting_id):
+    return (SchulzeVoting.objects
+            .filter(id=voting_id)
+            .select_related('group__collection__revision')
+            .first())
+
+
+def refresh_schulze_voting(voting_id):
+    """Recomputes all history entries and the statistics of a schulze voting.
+
+    Args:
+        voting_id (int): The id of the voting, if it does not exist all its entries are
+            removed.
+
+    Returns:
+        int or None: The id of the period of the voting, None if it does not exist.
+    """
+    VoteHistoryEntry.objects.filter(schulze_voting=voting_id).delete()
+    VotingStatistics.objects.filter(schulze_voting=voting_id).delete()
+    voting = _get_schulze_voting(voting_id)
+    if voting is None:
+        return None
+    collection = voting.group.collection
+    options = list(voting.schulzeoption_set.order_by('option_num'))
+    if not options:
+        stats.schulze_voting_statistics(voting, collection, [], None, None, 0).save()
+        return collection.revision.period_id
+    voters, counted, instance, s_res, outcome = _evaluate_schulze(voting, collection, options)
+    VoteHistoryEntry.objects.bulk_create(
+        _entry(voting, collection, voters[voter_id], schulze_vote_str(votes_list), outcome,
+               SCHULZE)
+        for voter_id, votes_list in counted)
+    stats.schulze_voting_statistics(
+        voting, collection, counted, instance, s_res, len(options)).save()
+    return collection.revision.period_id
+
+
+def refresh_schulze_votes(voting_id, voter_ids):
+    """Refreshes the history entries of some voters in a schulze voting.
+
+    As refresh_median_votes only the entries of the given voters are replaced.
+
+    Args:
+        voting_id (int): The id of the voting, if it does not exist nothing is done (the
+            entries are deleted together with the voting).
+        voter_ids (set of int): The ids of the voters whose votes changed.
+
+    Returns:
+        (int or None, collections.Counter): The id of the period of the voting (None if
+            it does not exist) and the change of the number of votes of each voter (by
+            name), see stats.adjust_participation.
+    """
+    voting = _get_schulze_voting(voting_id)
+    if voting is None:
+        return None, Counter()
+    collection = voting.group.collection
+    num_options = voting.schulzeoption_set.count()
+    votes = (SchulzeVote.objects
+             .filter(option__voting=voting, voter__in=voter_ids,
+                     voter__revision=collection.revision_id)
+             .select_related('voter')
+             .order_by('voter__id', 'option__option_num'))
+    entries = []
+    for _, votes_for_voter in groupby(votes, lambda vote: vote.voter_id):
+        votes_list = list(votes_for_voter)
+        # same rules as in _evaluate_schulze: incomplete rankings are not counted
+        if len(votes_list) == num_options:
+            entries.append(_entry(voting, collection, votes_list[0].voter,
+                                  schulze_vote_str(votes_list), '', SCHULZE))
+    deltas = _replace_entries(voting, SCHULZE, voter_ids, entries)
+    return collection.revision.period_id, deltas
+
+
+def refresh_outdated(**filters):
+    """Evaluates the votings whose statistics are outdated.
+
+    The votings are refreshed completely (see refresh_median_voting), this updates the
+    outcome of the history entries and the statistics. Must be called before the
+    outcome or the statistics are read.
+
+    Args:
+        **filters: Lookups for models.VotingStatistics to restrict the votings, for
+            example period=period.
+    """
+    if not VotingStatistics.objects.filter(outdated=True, **filters).exists():
+        return
+    with transaction.atomic():
+        # locked: concurrent requests wait and skip the refreshed votings
+        outdated = (VotingStatistics.objects
+                    .select_for_update()
+                    .filter(outdated=True, **filters)
+                    .values_list('median_voting', 'schulze_voting'))
+        for median_id, schulze_id in list(outdated):
+            if median_id is not None:
+                refresh_median_voting(median_id)
+            elif schulze_id is not None:
+                refresh_schulze_voting(schulze_id)
+
+
+def voter_history(name, period=None):
+    """Returns all history entries of a voter.
+
+    Voters are identified by name, so the entries of all voters with this name (in all
+    revisions) are returned.
+
+    Args:
+        name (str): The name of the voter.
+        period (models.Period or None): If given only entries of this period are returned.
+
+    Returns:
+        queryset: The models.VoteHistoryEntry objects, sorted by the time of the session
+            and the position of the voting.
+    """
+    entries = VoteHistoryEntry.objects.filter(voter_name=name)
+    if period is not None:
+        refresh_outdated(period=period)
+        entries = entries.filter(period=period)
+    else:
+        refresh_outdated()
+    return (entries
+            .select_related('period')
+            .order_by('collection_time', 'collection_id', 'group_num', 'voting_num'))
+
+
+def history_entry_dict(entry):
+    """Returns a dict representation of a history entry, used for the JSON API.
+
+    Args:
+        entry (models.VoteHistoryEntry): The entry.
+
+    Returns:
+        dict: The entry as a dict containing only JSON serializable values.
+    """
+    if entry.voting_type == MEDIAN:
+        voting_id = entry.median_voting_id
+    else:
+        voting_id = entry.schulze_voting_id
+    return {
+        'voter': entry.voter_id,
+        'voter_name': entry.voter_name,
+        'period': entry.period_id,
+        'period_name': entry.period.name,
+        'session': entry.collection_id,
+        'session_name': entry.collection_name,
+        'time': entry.collection_time.isoformat(),
+        'type': entry.voting_type,
+        'voting': voting_id,
+        'voting_name': entry.voting_name,
+        'vote': entry.vote,
+        'outcome': entry.outcome,
+    }
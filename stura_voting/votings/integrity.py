@@ -0,0 +1,217 @@
+# Copyright 2018 - 2019 Fabian Wenzelmann
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Batch integrity checks of the votes.
+
+New votes are checked by the database (see migration 0025_vote_constraints), but votes
+written before the constraints existed might be invalid. So the evaluation still checks
+the values of median votes and the length of schulze rankings (complete rankings are
+not enforced on SQLite) and ignores invalid votes with a warning. This module checks any
+number of sessions at once with a fixed number of queries, can delete the invalid votes
+and marks the sessions without problems as verified
+(models.VotingCollection.votes_verified). The evaluation skips the remaining checks for
+verified sessions. Every change of a session, its votings
+or votes updates its change timestamp and so removes the verification.
+
+Invalid votes are:
+
+    * median votes with a value greater than the value of the voting
+    * votes of voters that don't belong to the revision of the session
+    * incomplete schulze rankings (not one vote for each option of the voting)
+
+Schulze votings without options are reported as well, but can't be fixed.
+
+"""
+
+import json
+
+from collections import namedtuple, OrderedDict
+
+from django.db import transaction
+from django.db.models import Count, F
+
+from .models import *
+from .ballotlog import MEDIAN, SCHULZE, voter_names
+
+
+VALUE_TOO_HIGH = 'value_too_high'
+WRONG_REVISION = 'wrong_revision'
+INCOMPLETE_RANKING = 'incomplete_ranking'
+NO_OPTIONS = 'no_options'
+
+# an invalid vote (or voting for NO_OPTIONS), vote is the value or list of sorting
+# positions (sorted by option_num), vote_ids the ids of the MedianVote or SchulzeVote
+# objects
+Problem = namedtuple('Problem', ['kind', 'collection_id', 'voter_id', 'v_type',
+                                 'voting_id', 'vote', 'vote_ids'])
+
+
+def _median_problems(kind, votes_qs):
+    values = votes_qs.values_list('voting__group__collection', 'voter', 'voting', 'value', 'id')
+    return [Problem(kind, collection_id, voter_id, MEDIAN, voting_id, value, [vote_id])
+            for collection_id, voter_id, voting_id, value, vote_id in values]
+
+
+def _schulze_problems(kind, votes_qs):
+    values = (votes_qs
+              .order_by('option__voting__group__collection', 'voter', 'option__voting',
+                        'option__option_num')
+              .values_list('option__voting__group__collection', 'voter', 'option__voting',
+                           'sorting_position', 'id'))
+    ballots = OrderedDict()
+    for collection_id, voter_id, voting_id, position, vote_id in values:
+        positions, vote_ids = ballots.setdefault((collection_id, voter_id, voting_id), ([], []))
+        positions.append(position)
+        vote_ids.append(vote_id)
+    return [Problem(kind, collection_id, voter_id, SCHULZE, voting_id, positions, vote_ids)
+            for (collection_id, voter_id, voting_id), (positions, vote_ids) in ballots.items()]
+
+
+def find_problems(collection_ids):
+    """Returns all invalid votes in some sessions.
+
+    Args:
+        collection_ids (iterable of int): The ids of the sessions.
+
+    Returns:
+        list of Problem: The problems, a vote of a voter from another revision is only
+            reported as WRONG_REVISION.
+    """
+    collection_ids = list(collection_ids)
+    median_qs = MedianVote.objects.filter(voting__group__collection__in=collection_ids)
+    schulze_qs = SchulzeVote.objects.filter(option__voting__group__collection__in=collection_ids)
+    median_wrong = median_qs.exclude(voter__revision=F('voting__group__collection__revision'))
+    schulze_wrong = schulze_qs.exclude(
+        voter__revision=F('option__voting__group__collection__revision'))
+    res = _median_problems(WRONG_REVISION, median_wrong)
+    res.extend(_median_problems(
+        VALUE_TOO_HIGH,
+        median_qs
+        .filter(value__gt=F('voting__value'))
+        .filter(voter__revision=F('voting__group__collection__revision'))))
+    res.extend(_schulze_problems(WRONG_REVISION, schulze_wrong))
+    # incomplete rankings: compare the number of votes of each ballot with the number of
+    # options, both counted by the database
+    num_options = dict(SchulzeOption.objects
+                       .filter(voting__group__collection__in=collection_ids)
+                       .order_by()
+                       .values('voting')
+                       .annotate(num=Count('id'))
+                       .values_list('voting', 'num'))
+    ballots = (schulze_qs
+               .filter(voter__revision=F('option__voting__group__collection__revision'))
+               .order_by()
+               .values('voter', 'option__voting')
+               .annotate(num=Count('id'))
+               .values_list('voter', 'option__voting', 'num'))
+    incomplete = set((voter_id, voting_id) for voter_id, voting_id, num in ballots
+                     if num != num_options.get(voting_id, 0))
+    if incomplete:
+        votes_qs = schulze_qs.filter(option__voting__in=set(v for _, v in incomplete),
+                                     voter__in=set(v for v, _ in incomplete))
+        res.extend(problem for problem in _schulze_problems(INCOMPLETE_RANKING, votes_qs)
+                   if (problem.voter_id, problem.voting_id) in incomplete)
+    no_options = (SchulzeVoting.objects
+                  .filter(group__collection__in=collection_ids)
+                  .annotate(num=Count('schulzeoption'))
+                  .filter(num=0)
+                  .values_list('group__collection', 'id'))
+    res.extend(Problem(NO_OPTIONS, collection_id, None, SCHULZE, voting_id, None, [])
+               for collection_id, voting_id in no_options)
+    return res
+
+
+def fix_problems(problems):
+    """Deletes the invalid votes.
+
+    For each voter an event is added to the ballot log (with source
+    models.BALLOT_SOURCE_CHECK), so the log matches the votes.
+    The votes of closed sessions (with models.FrozenResults) must not change, their
+    problems are not fixed (as in replay.rebuild).
+
+    Args:
+        problems (list of Problem): The problems as returned by find_problems.
+
+    Returns:
+        int, list of Problem: The number of fixed problems and the problems that were
+            not fixed because their session is closed.
+    """
+    closed = set(FrozenResults.objects
+                 .filter(collection__in=set(problem.collection_id for problem in problems))
+                 .values_list('collection', flat=True))
+    median_ids, schulze_ids = [], []
+    changes = OrderedDict()
+    skipped = []
+    for problem in problems:
+        if problem.kind == NO_OPTIONS:
+            continue
+        if problem.collection_id in closed:
+            skipped.append(problem)
+            continue
+        if problem.v_type == MEDIAN:
+            median_ids.extend(problem.vote_ids)
+        else:
+            schulze_ids.extend(problem.vote_ids)
+        changes.setdefault((problem.collection_id, problem.voter_id), []).append(
+            [problem.v_type, problem.voting_id, problem.vote, None])
+    with transaction.atomic():
+        # deleted one by one, so the history and caches are refreshed by the signals
+        MedianVote.objects.filter(id__in=median_ids).delete()
+        SchulzeVote.objects.filter(id__in=schulze_ids).delete()
+        names = voter_names(voter_id for _, voter_id in changes)
+        BallotEvent.objects.bulk_create(
+            BallotEvent(collection_id=collection_id, collection_ref=collection_id,
+                        voter_id=voter_id, voter_name=names[voter_id],
+                        source=BALLOT_SOURCE_CHECK,
+                        changes=json.dumps(voter_changes, separators=(',', ':')))
+            for (collection_id, voter_id), voter_changes in changes.items())
+    return sum(len(voter_changes) for voter_changes in changes.values()), skipped
+
+
+def mark_verified(modified):
+    """Marks sessions as verified.
+
+    A session is only marked if it has not been changed since the check started.
+
+    Args:
+        modified (dict): Maps the ids of the sessions to their change timestamp read
+            before they were checked.
+
+    Returns:
+        int: The number of sessions marked as verified.
+    """
+    res = 0
+    for collection_id, timestamp in modified.items():
+        res += (VotingCollection.objects
+                .filter(id=collection_id, modified=timestamp)
+                .update(votes_verified=timestamp))
+    return res
+
+
+def check_votes(collection_ids):
+    """Checks the votes of some sessions and marks the sessions without problems as verified.
+
+    Args:
+        collection_ids (iterable of int): The ids of the sessions.
+
+    Returns:
+        list of Problem, int: The problems and the number of sessions marked as verified.
+    """
+    modified = dict(VotingCollection.objects
+                    .filter(id__in=list(collection_ids))
+                    .values_list('id', 'modified'))
+    problems = find_problems(modified.keys())
+    for problem in problems:
+        modified.pop(problem.collection_id, None)
+    return problems, mark_verified(modified)
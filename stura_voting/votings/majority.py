@@ -0,0 +1,214 @@
+# Copyright 2018 - 2019 Fabian Wenzelmann
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Computation of the votes required for a majority with integer arithmetic only.
+
+A majority (or quorum) is a fraction numerator / denominator between 0 and 1. The
+number of votes required for a majority given the sum of all voting weights is
+floor(numerator * weight_sum / denominator): more than this number of votes is
+required. Both the parsed majorities and the computed thresholds are memoized, there
+are only a few distinct majorities and weight sums.
+
+A CompiledRule combines a majority with the handling of voters without a vote, it is
+used to evaluate the votings (see the quorum module for the rules of the votings).
+
+A majority can be described by:
+
+    * a string 'a/b', for example '2/3' (TWO_THIRDS_MAJORITY)
+    * a percentage 'p' or 'p%', for example '50' (FIFTY_MAJORITY) is 50 / 100 = 1 / 2
+    * a tuple (numerator, denominator)
+    * an object with numerator and denominator attributes, for example
+      fractions.Fraction or votings.fraction.Fraction
+
+"""
+
+import math
+
+from functools import lru_cache
+
+
+MEMO_SIZE = 1024
+
+
+def _reduce(numerator, denominator):
+    if not isinstance(numerator, int) or not isinstance(denominator, int):
+        raise ValueError('Majority must be a fraction of integers, got %s / %s' % (
+            numerator, denominator))
+    if denominator <= 0 or numerator < 0 or numerator > denominator:
+        raise ValueError('Invalid majority %s / %s: must be between 0 and 1' % (
+            numerator, denominator))
+    gcd = math.gcd(numerator, denominator)
+    return numerator // gcd, denominator // gcd
+
+
+@lru_cache(maxsize=MEMO_SIZE)
+def _parse_description(description):
+    s = description.strip()
+    try:
+        if '/' in s:
+            numerator, denominator = s.split('/', 1)
+            return _reduce(int(numerator), int(denominator))
+        if s.endswith('%'):
+            s = s[:-1]
+        return _reduce(int(s), 100)
+    except ValueError:
+        raise ValueError('Invalid majority description %s' % description)
+
+
+def parse_majority(majority):
+    """Returns the reduced fraction of a majority.
+
+    Args:
+        majority (str, tuple or fraction): The majority, see the module documentation.
+
+    Returns:
+        (int, int): Numerator and denominator of the reduced fraction.
+
+    Raises:
+        ValueError: If the majority is invalid or not between 0 and 1.
+    """
+    if isinstance(majority, str):
+        return _parse_description(majority)
+    if isinstance(majority, tuple):
+        return _reduce(*majority)
+    try:
+        return _reduce(majority.numerator, majority.denominator)
+    except AttributeError:
+        raise ValueError('Invalid majority %s' % str(majority))
+
+
+def majority_threshold(numerator, denominator, weight_sum):
+    """Returns the number of votes required for a majority.
+
+    More than the returned number of votes is required. This function is not memoized,
+    it is cheap enough to be called directly.
+
+    Args:
+        numerator (int): Numerator of the majority.
+        denominator (int): Denominator of the majority (> 0).
+        weight_sum (int): The sum of the voting weights.
+
+    Returns:
+        int: floor(numerator * weight_sum / denominator).
+    """
+    return (numerator * weight_sum) // denominator
+
+
+@lru_cache(maxsize=MEMO_SIZE)
+def _required_votes(numerator, denominator, weight_sum):
+    return majority_threshold(numerator, denominator, weight_sum)
+
+
+def required_votes(majority, weight_sum):
+    """Returns the number of votes required for a majority, results are memoized.
+
+    For example 51 voters and majority 1/2 ==> 25, that is > 25 votes are required.
+
+    Args:
+        majority (str, tuple or fraction): The majority, see the module documentation.
+        weight_sum (int): The sum of the voting weights.
+
+    Returns:
+        int: The number of votes required for a majority.
+
+    Raises:
+        ValueError: If the majority is invalid.
+    """
+    numerator, denominator = parse_majority(majority)
+    return _required_votes(numerator, denominator, weight_sum)
+
+
+@lru_cache(maxsize=MEMO_SIZE)
+def _required_votes_at_least(numerator, denominator, weight_sum):
+    # at least ceil(numerator * weight_sum / denominator) votes means more than this
+    # number minus one (but the evaluation requires at least one vote)
+    return max(-((-numerator * weight_sum) // denominator) - 1, 0)
+
+
+class CompiledRule(object):
+    """A majority rule prepared for the evaluation of votings.
+
+    Attributes:
+        numerator (int): Numerator of the reduced majority.
+        denominator (int): Denominator of the reduced majority.
+        strict (bool): True if more than the fraction of votes is required, False if at
+            least the fraction is required.
+        absolute (bool): True if the fraction is computed from the weights of all voters
+            entitled to vote.
+        abstentions_as_no (bool): True if voters without a vote are counted as a vote
+            for 0 (median) or no (schulze).
+        percent (int or None): The majority in percent if it is an integer percentage.
+
+    """
+    __slots__ = ('numerator', 'denominator', 'strict', 'absolute', 'abstentions_as_no',
+                 'percent', '_required')
+
+    def __init__(self, majority, strict=True, absolute=False, abstentions_as_no=False):
+        self.numerator, self.denominator = parse_majority(majority)
+        self.strict = strict
+        self.absolute = absolute
+        self.abstentions_as_no = abstentions_as_no
+        percent, rest = divmod(self.numerator * 100, self.denominator)
+        self.percent = percent if rest == 0 else None
+        self._required = _required_votes if strict else _required_votes_at_least
+
+    def required(self, weight_sum):
+        """Returns the number of votes required: more than this number is required.
+
+        Args:
+            weight_sum (int): The sum of the voting weights.
+
+        Returns:
+            int: The number of votes required.
+        """
+        return self._required(self.numerator, self.denominator, weight_sum)
+
+    def as_tuple(self):
+        """Returns the rule as a tuple, from_tuple restores it.
+
+        Returns:
+            tuple: (numerator, denominator, strict, absolute, abstentions_as_no).
+        """
+        return (self.numerator, self.denominator, self.strict, self.absolute,
+                self.abstentions_as_no)
+
+    @staticmethod
+    def from_tuple(t):
+        """Creates a rule from the result of as_tuple (or an equal list)."""
+        numerator, denominator, strict, absolute, abstentions_as_no = t
+        return CompiledRule((numerator, denominator), strict, absolute, abstentions_as_no)
+
+    def __str__(self):
+        if self.percent is not None:
+            return '%d%%' % self.percent
+        return '%d/%d' % (self.numerator, self.denominator)
+
+    def __repr__(self):
+        return 'CompiledRule(%s, strict=%s, absolute=%s, abstentions_as_no=%s)' % (
+            self, self.strict, self.absolute, self.abstentions_as_no)
+
+
+@lru_cache(maxsize=MEMO_SIZE)
+def legacy_rule(majority, absolute_majority):
+    """Returns the rule of a voting without a models.QuorumRule.
+
+    Args:
+        majority (str): The majority field of the voting.
+        absolute_majority (bool): The absolute_majority field of the voting, if true
+            all voters are considered and voters without a vote are counted as 0 / no.
+
+    Returns:
+        CompiledRule: The rule, must not be changed.
+    """
+    return CompiledRule(majority, True, absolute_majority, absolute_majority)
@@ -0,0 +1,44 @@
+# Copyright 2018 - 2019 Fabian Wenzelmann
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from votings.models import Period
+from votings.coldstorage import archive_period, ColdStorageError
+
+
+class Command(BaseCommand):
+    help = ('Move a finished period into cold storage: store all its sessions, votes and '
+            'results in a compressed snapshot and remove them from the database')
+
+    def add_arguments(self, parser):
+        parser.add_argument('period', type=int, help='Id of the period')
+        parser.add_argument('--force', action='store_true',
+                            help='Archive the period even if it has not ended yet')
+
+    def handle(self, *args, **options):
+        try:
+            period = Period.objects.get(pk=options['period'])
+        except Period.DoesNotExist:
+            raise CommandError('Period %d does not exist' % options['period'])
+        if not options['force'] and (period.end is None or period.end >= datetime.date.today()):
+            raise CommandError('Period "%s" has not ended yet, use --force to archive it anyway' % period)
+        try:
+            snapshot = archive_period(period)
+        except ColdStorageError as e:
+            raise CommandError(str(e))
+        self.stdout.write('Archived period "%s": %d bytes, compressed %d bytes' % (
+            period, snapshot.size, len(snapshot.data)))
@@ -0,0 +1,92 @@
+# Copyright 2018 - 2019 Fabian Wenzelmann
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from stura_voting_utils import parser as utils_parser
+
+from votings import parser
+from votings.parser import ParseErrors
+
+
+def voters_input(num_lines, error_every=0):
+    lines = []
+    for i in range(num_lines):
+        if error_every and i % error_every == 0:
+            lines.append('Voter %d - %d' % (i, 1 + i % 3))
+        else:
+            lines.append('* Voter %d: %d' % (i, 1 + i % 3))
+    return '\n'.join(lines)
+
+
+def collection_input(num_lines, error_every=0):
+    # groups of ten votings, median and schulze votings with three options alternate
+    lines = ['# Sitzung']
+    i = 0
+    while len(lines) < num_lines:
+        if i % 10 == 0:
+            lines.append('## Gruppe %d' % i)
+        lines.append('### Abstimmung %d' % i)
+        if i % 2 == 0:
+            lines.append('- %d,%02d €' % (i, i % 100))
+        else:
+            lines.extend(['* Ja', '* Vielleicht', '* Nein'])
+        if error_every and i % error_every == 0:
+            lines.append('invalid line %d' % i)
+        i += 1
+    return '\n'.join(lines)
+
+
+class Command(BaseCommand):
+    help = ('Measure the time to parse voter lists and collection descriptions with '
+            'stura_voting_utils and with the parser module')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', type=int, default=10000,
+                            help='Number of lines of the inputs')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Number of repetitions for each measurement')
+
+    def measure(self, name, repeat, f):
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            try:
+                f()
+            except (ParseErrors, utils_parser.ParseException):
+                pass
+            times.append(time.perf_counter() - start)
+        self.stdout.write('%-45s min %8.2f ms   avg %8.2f ms' % (
+            name, min(times) * 1000, sum(times) / len(times) * 1000))
+
+    def handle(self, *args, **options):
+        num_lines, repeat = options['lines'], options['repeat']
+        voters = voters_input(num_lines)
+        collection = collection_input(num_lines)
+        self.stdout.write('Inputs with %d lines' % num_lines)
+        self.measure('voters: stura_voting_utils', repeat,
+                     lambda: list(utils_parser.parse_voters(voters.split('\n'))))
+        self.measure('voters: parser', repeat, lambda: parser.parse_voters(voters))
+        self.measure('collection: stura_voting_utils', repeat,
+                     lambda: utils_parser.parse_voting_collection(collection.split('\n')))
+        self.measure('collection: parser', repeat,
+                     lambda: parser.parse_voting_collection(collection))
+        # stura_voting_utils stops at the first error, so only the parser is measured
+        voters = voters_input(num_lines, 100)
+        collection = collection_input(num_lines, 10)
+        self.measure('voters with errors: parser', repeat, lambda: parser.parse_voters(voters))
+        self.measure('collection with errors: parser', repeat,
+                     lambda: parser.parse_voting_collection(collection))
@@ -0,0 +1,121 @@
+# Copyright 2018 - 2019 Fabian Wenzelmann
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.template.loader import render_to_string
+from django.test.utils import override_settings
+
+from votings.models import *
+from votings.views import votes_list_context
+from votings.evaluation import session_results_context
+
+DUMMY_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+    }
+}
+
+NUM_OPTIONS = 4
+VOTINGS_PER_GROUP = 10
+
+
+def create_collection(num_voters, num_votings):
+    # creates a collection with the given number of voters and votings (half of them
+    # median, half of them schulze votings) and votes from all voters
+    period = Period.objects.create(name='Benchmark %f' % time.time())
+    revision = VotersRevision.objects.create(period=period, note='benchmark')
+    Voter.objects.bulk_create(
+        Voter(revision=revision, name='Voter %d' % i, weight=1 + i % 3)
+        for i in range(num_voters))
+    voters = list(Voter.objects.filter(revision=revision))
+    collection = VotingCollection.objects.create(name='Benchmark', revision=revision)
+    median_votes, schulze_votes = [], []
+    group = None
+    for i in range(num_votings):
+        if i % VOTINGS_PER_GROUP == 0:
+            group = VotingGroup.objects.create(
+                name='Group %d' % i, collection=collection, group_num=i)
+        if i % 2 == 0:
+            voting = MedianVoting.objects.create(
+                name='Median %d' % i, value=10000, group=group, voting_num=i)
+            for voter in voters:
+                median_votes.append(MedianVote(
+                    value=random.randint(0, voting.value), voter=voter, voting=voting))
+        else:
+            voting = SchulzeVoting.objects.create(
+                name='Schulze %d' % i, group=group, voting_num=i)
+            options = [SchulzeOption.objects.create(option='Option %d' % j, voting=voting,
+                                                    option_num=j)
+                       for j in range(NUM_OPTIONS)]
+            for voter in voters:
+                for option in options:
+                    schulze_votes.append(SchulzeVote(
+                        sorting_position=random.randint(0, NUM_OPTIONS), voter=voter,
+                        option=option))
+    MedianVote.objects.bulk_create(median_votes)
+    SchulzeVote.objects.bulk_create(schulze_votes)
+    return collection
+
+
+class Command(BaseCommand):
+    help = ('Measure the time to compute and render the votes list and results templates '
+            'for a generated collection (not stored in the database)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--voters', type=int, default=100,
+                            help='Number of voters')
+        parser.add_argument('--votings', type=int, default=50,
+                            help='Number of votings')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Number of repetitions for each measurement')
+
+    def measure(self, name, repeat, f):
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            f()
+            times.append(time.perf_counter() - start)
+        self.stdout.write('%-45s min %8.2f ms   avg %8.2f ms' % (
+            name, min(times) * 1000, sum(times) / len(times) * 1000))
+
+    def handle(self, *args, **options):
+        repeat = options['repeat']
+        with transaction.atomic():
+            collection = create_collection(options['voters'], options['votings'])
+            self.stdout.write('Collection with %d voters and %d votings' % (
+                options['voters'], options['votings']))
+
+            templates = (
+                ('votes_list', 'votings/votes/votes_list.html',
+                 lambda: votes_list_context(collection)),
+                ('session_results', 'votings/results/session_results.html',
+                 lambda: session_results_context(collection, False)),
+                ('session_results (detailed)', 'votings/results/session_results.html',
+                 lambda: session_results_context(collection, True)),
+            )
+            for name, template, get_context in templates:
+                self.measure('%s: context' % name, repeat, get_context)
+                context = get_context()
+                # without cache: all fragments are rendered
+                with override_settings(CACHES=DUMMY_CACHES):
+                    self.measure('%s: render' % name, repeat,
+                                 lambda: render_to_string(template, context))
+                self.measure('%s: render (cached)' % name, repeat,
+                             lambda: render_to_string(template, context))
+            # don't keep anything
+            transaction.set_rollback(True)
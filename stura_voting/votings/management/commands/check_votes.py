@@ -0,0 +1,63 @@
+# Copyright 2018 - 2019 Fabian Wenzelmann
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.core.management.base import BaseCommand, CommandError
+
+from votings.models import VotingCollection
+from votings import integrity
+
+
+class Command(BaseCommand):
+    help = ('Check the votes of sessions for invalid votes and mark the sessions without '
+            'problems as verified, with --fix invalid votes are deleted')
+
+    def add_arguments(self, parser):
+        parser.add_argument('sessions', type=int, nargs='*',
+                            help='Ids of the sessions, default: all sessions')
+        parser.add_argument('--period', type=int, action='append', default=[],
+                            help='Check all sessions of the period (can be repeated)')
+        parser.add_argument('--fix', action='store_true',
+                            help='Delete invalid votes (they are not counted anyway), '
+                                 'closed sessions are not changed')
+
+    def handle(self, *args, **options):
+        sessions = VotingCollection.objects.all()
+        if options['sessions'] or options['period']:
+            sessions = sessions.filter(id__in=options['sessions']) | sessions.filter(
+                revision__period__in=options['period'])
+        if options['sessions']:
+            missing = set(options['sessions']) - set(sessions.values_list('id', flat=True))
+            if missing:
+                raise CommandError('Sessions %s do not exist' % ', '.join(map(str, sorted(missing))))
+        names = dict(sessions.values_list('id', 'name'))
+        problems, verified = integrity.check_votes(names.keys())
+        for problem in problems:
+            if problem.kind == integrity.NO_OPTIONS:
+                self.stdout.write('Session "%s" (%d): schulze voting %d has no options' % (
+                    names[problem.collection_id], problem.collection_id, problem.voting_id))
+            else:
+                self.stdout.write('Session "%s" (%d): %s, voter %d, %s voting %d, vote %s' % (
+                    names[problem.collection_id], problem.collection_id, problem.kind,
+                    problem.voter_id, problem.v_type, problem.voting_id, problem.vote))
+        if problems and options['fix']:
+            fixed, skipped = integrity.fix_problems(problems)
+            self.stdout.write('Deleted the votes of %d problems' % fixed)
+            for problem in skipped:
+                self.stdout.write('Not fixed, session "%s" (%d) is closed: %s, voter %d, %s voting %d' % (
+                    names[problem.collection_id], problem.collection_id, problem.kind,
+                    problem.voter_id, problem.v_type, problem.voting_id))
+            # the deletion changed the sessions, check them again
+            problems, verified = integrity.check_votes(names.keys())
+        self.stdout.write('Checked %d sessions: %d problems, %d sessions verified' % (
+            len(names), len(problems), verified))
@@ -0,0 +1,152 @@
+# Copyright 2018 - 2019 Fabian Wenzelmann
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import cProfile
+import pstats
+import time
+
+from collections import OrderedDict
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from schulze_voting import evaluate_schulze
+from stura_voting_utils.utils import output_currency
+
+from votings.models import *
+from votings.cache import get_revision_voters
+from votings.median import median_for_evaluation, single_median_statistics
+from votings.schulze import schulze_for_evaluation, single_schulze_instance
+
+
+class Stage(object):
+    # measurements of one stage over all repetitions
+
+    def __init__(self, name):
+        self.name = name
+        self.times = []
+        self.queries = []
+
+    def run(self, f):
+        with CaptureQueriesContext(connection) as ctx:
+            start = time.perf_counter()
+            res = f()
+            self.times.append(time.perf_counter() - start)
+        self.queries.append(len(ctx.captured_queries))
+        return res
+
+
+class Command(BaseCommand):
+    help = ('Evaluate all votings of a session (the same steps as for the results page) '
+            'and print the results with the time and number of queries of each step')
+
+    def add_arguments(self, parser):
+        parser.add_argument('session', type=int, help='Id of the session')
+        parser.add_argument('--repeat', type=int, default=1,
+                            help='Number of times the session is evaluated')
+        parser.add_argument('--profile', action='store_true',
+                            help='Profile the evaluation with cProfile')
+        parser.add_argument('--profile-limit', type=int, default=30,
+                            help='Number of functions in the profile output')
+        parser.add_argument('--profile-sort', default='cumulative',
+                            help='Sort key of the profile output (see pstats)')
+
+    def evaluate(self, collection, stages):
+        voters = stages['voters'].run(lambda: get_revision_voters(collection.revision_id))
+        median = stages['median_for_evaluation'].run(lambda: median_for_evaluation(collection))
+        median.fill_missing_voters(voters)
+        schulze = stages['schulze_for_evaluation'].run(
+            lambda: schulze_for_evaluation(collection))
+        schulze.fill_missing_voters(voters)
+
+        def median_results():
+            res = []
+            for v_id, voting in median.votings.items():
+                instance = single_median_statistics(voting, median.votes[v_id], voters)
+                res.append((voting, instance,
+                            instance.instance.median(votes_required=instance.majority)))
+            return res
+
+        def schulze_instances():
+            res = []
+            for v_id, voting in schulze.votings.items():
+                options = schulze.voting_description[v_id]
+                res.append((voting, options, single_schulze_instance(
+                    voting, schulze.votes[v_id], options, voters)))
+            return res
+
+        def schulze_results(instances):
+            return [(voting, options, instance,
+                     evaluate_schulze(instance.instance, len(options)))
+                    for voting, options, instance in instances]
+
+        median_res = stages['single_median_statistics'].run(median_results)
+        instances = stages['single_schulze_instance'].run(schulze_instances)
+        schulze_res = stages['evaluate_schulze'].run(lambda: schulze_results(instances))
+        return median_res, schulze_res, median.warnings + schulze.warnings
+
+    def print_results(self, median_res, schulze_res, warnings):
+        for voting, instance, result in median_res:
+            if result is None:
+                result_str = 'kein Wert'
+            else:
+                result_str = output_currency(result, voting.currency)
+            print('Median %-40s %s von %s (Gewicht %d, benötigt %d)' % (
+                voting.name, result_str, output_currency(voting.value, voting.currency),
+                instance.weight_sum, instance.majority))
+        for voting, options, instance, result in schulze_res:
+            ranking = ' > '.join(', '.join(options[i].option for i in group)
+                                 for group in result.candidate_wins)
+            print('Schulze %-39s %s (Gewicht %d, benötigt %d)' % (
+                voting.name, ranking, instance.weight_sum, instance.majority))
+        for warning in warnings:
+            print('Warnung: %s' % warning)
+
+    def handle(self, *args, **options):
+        try:
+            collection = VotingCollection.objects.get(pk=options['session'])
+        except VotingCollection.DoesNotExist:
+            raise CommandError('Session %d does not exist' % options['session'])
+        repeat = options['repeat']
+        if repeat < 1:
+            raise CommandError('--repeat must be at least 1')
+        stages = OrderedDict((name, Stage(name)) for name in (
+            'voters', 'median_for_evaluation', 'schulze_for_evaluation',
+            'single_median_statistics', 'single_schulze_instance', 'evaluate_schulze'))
+        profile = cProfile.Profile() if options['profile'] else None
+        res = None
+        for _ in range(repeat):
+            if profile is not None:
+                profile.enable()
+            res = self.evaluate(collection, stages)
+            if profile is not None:
+                profile.disable()
+        print('Session "%s" (%s)' % (collection.name, collection.time))
+        self.print_results(*res)
+        print()
+        print('%-26s %10s %10s %10s %8s' % ('stage', 'min ms', 'avg ms', 'max ms', 'queries'))
+        total = 0
+        for stage in stages.values():
+            avg = sum(stage.times) / len(stage.times)
+            total += avg
+            print('%-26s %10.2f %10.2f %10.2f %8d' % (
+                stage.name, min(stage.times) * 1000, avg * 1000, max(stage.times) * 1000,
+                max(stage.queries)))
+        print('%-26s %21.2f' % ('total', total * 1000))
+        if profile is not None:
+            print()
+            stats = pstats.Stats(profile)
+            stats.strip_dirs().sort_stats(options['profile_sort']).print_stats(
+                options['profile_limit'])
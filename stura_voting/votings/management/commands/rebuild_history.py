@@ -0,0 +1,28 @@
+# Copyright 2018 - 2019 Fabian Wenzelmann
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.core.management.base import BaseCommand
+
+from votings import history
+from votings.models import VoteHistoryEntry
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the vote history and the period statistics from the votes, '
+            'required once for votes entered before they existed')
+
+    def handle(self, *args, **options):
+        print('Rebuilding vote history...')
+        history.rebuild()
+        print('Done, %d entries' % VoteHistoryEntry.objects.count())
@@ -0,0 +1,47 @@
+# Copyright 2018 - 2019 Fabian Wenzelmann
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from votings.models import VotingCollection, PrintRendition
+from votings.printing import store_print
+
+
+class Command(BaseCommand):
+    help = ('Render the ballot sheets of sessions in advance, by default of all upcoming '
+            'sessions without a sheet')
+
+    def add_arguments(self, parser):
+        parser.add_argument('sessions', type=int, nargs='*',
+                            help='Ids of the sessions, default: all upcoming sessions')
+        parser.add_argument('--force', action='store_true',
+                            help='Render the sheets even if they are up to date')
+
+    def handle(self, *args, **options):
+        if options['sessions']:
+            sessions = VotingCollection.objects.filter(id__in=options['sessions'])
+            missing = set(options['sessions']) - set(sessions.values_list('id', flat=True))
+            if missing:
+                raise CommandError('Sessions %s do not exist' % ', '.join(map(str, sorted(missing))))
+        else:
+            sessions = VotingCollection.objects.filter(time__gte=timezone.now())
+        if not options['force']:
+            sessions = sessions.exclude(
+                id__in=PrintRendition.objects.values('collection'))
+        count = 0
+        for session in sessions.order_by('time', 'id'):
+            store_print(session)
+            count += 1
+        print('Rendered %d ballot sheets' % count)
@@ -0,0 +1,82 @@
+# Copyright 2018 - 2019 Fabian Wenzelmann
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.core.management.base import BaseCommand, CommandError
+
+from votings.models import VotingCollection
+from votings import replay
+
+
+class Command(BaseCommand):
+    help = ('Replay the ballot log of sessions and compare it with the votes, with '
+            '--rebuild the votes and everything derived from them are rebuilt from the log')
+
+    def add_arguments(self, parser):
+        parser.add_argument('sessions', type=int, nargs='*',
+                            help='Ids of the sessions, default: all sessions')
+        parser.add_argument('--period', type=int, action='append', default=[],
+                            help='Replay all sessions of the period (can be repeated)')
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Rebuild the votes from the log instead of only comparing')
+
+    def handle(self, *args, **options):
+        sessions = VotingCollection.objects.all()
+        if options['sessions'] or options['period']:
+            sessions = sessions.filter(id__in=options['sessions']) | sessions.filter(
+                revision__period__in=options['period'])
+        if options['sessions']:
+            missing = set(options['sessions']) - set(sessions.values_list('id', flat=True))
+            if missing:
+                raise CommandError('Sessions %s do not exist' % ', '.join(map(str, sorted(missing))))
+        names = dict(sessions.values_list('id', 'name'))
+        if options['rebuild']:
+            reports = replay.rebuild(names.keys())
+        else:
+            reports = replay.check(names.keys())
+        num_sessions, num_events, num_failed, num_removed = 0, 0, 0, 0
+        for report in reports:
+            num_sessions += 1
+            num_events += report.events
+            num_removed += len(report.removed)
+            if options['verbosity'] > 1:
+                for diff in report.removed:
+                    self.stdout.write('  deleted voting: session %d, voter %d, %s voting %d' % (
+                        report.collection_id, diff.voter_id, diff.v_type, diff.voting_id))
+            if report.ok():
+                continue
+            num_failed += 1
+            self.stdout.write('Session "%s" (%d): %d events, %d differences, %d conflicts%s' % (
+                names[report.collection_id], report.collection_id, report.events,
+                len(report.differences), len(report.conflicts),
+                ', rebuilt' if report.rebuilt else ''))
+            if options['verbosity'] > 1:
+                for diff in report.differences:
+                    self.stdout.write('  voter %d, %s voting %d: log %s, votes %s' % (
+                        diff.voter_id, diff.v_type, diff.voting_id, diff.log, diff.live))
+                for conflict in report.conflicts:
+                    self.stdout.write('  event %d, voter %d, %s voting %d: old %s, replayed %s' % (
+                        conflict.event_id, conflict.voter_id, conflict.v_type,
+                        conflict.voting_id, conflict.old, conflict.replayed))
+            for diff in report.skipped:
+                self.stdout.write('  not rebuilt: voter %d, %s voting %d' % (
+                    diff.voter_id, diff.v_type, diff.voting_id))
+            for diff, error in report.rejected:
+                self.stdout.write('  rejected: voter %d, %s voting %d, log %s: %s' % (
+                    diff.voter_id, diff.v_type, diff.voting_id, diff.log, error))
+        self.stdout.write('Replayed %d events of %d sessions, %d sessions %s from the log' % (
+            num_events, num_sessions, num_failed,
+            'differed' if options['rebuild'] else 'differ'))
+        if num_removed:
+            self.stdout.write('%d logged votes belong to deleted votings or options and '
+                              'were not compared' % num_removed)
@@ -0,0 +1,36 @@
+# Copyright 2018 - 2019 Fabian Wenzelmann
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.core.management.base import BaseCommand, CommandError
+
+from votings.models import Period
+from votings.coldstorage import restore_period, ColdStorageError
+
+
+class Command(BaseCommand):
+    help = 'Restore a period from cold storage into the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('period', type=int, help='Id of the period')
+
+    def handle(self, *args, **options):
+        try:
+            period = Period.objects.get(pk=options['period'])
+        except Period.DoesNotExist:
+            raise CommandError('Period %d does not exist' % options['period'])
+        try:
+            restore_period(period)
+        except ColdStorageError as e:
+            raise CommandError(str(e))
+        self.stdout.write('Restored period "%s"' % period)
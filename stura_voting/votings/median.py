@@ -17,21 +17,27 @@ from itertools import groupby
 
 from .results import *
 from .models import *
-from .utils import compute_majority
+from .quorum import voting_rule
 
 from django.utils.translation import gettext
 
 import median_voting as mv
 
 
-def median_for_evaluation(collection):
-    # TODO check revisions or is this not required?
+def median_for_evaluation(collection, voters=None):
+    # voters: if not None only the votes of these voters are fetched
+    # new votes are checked by the database (see migration 0025_vote_constraints), but
+    # votes written before might be invalid, so the checks of the votes are only
+    # skipped if the votes of the collection have been verified, see integrity
+    verified = collection.votes_are_verified()
     all_votings = median_votings(collection=collection)
     # now get all votes for all votings
     votes_qs = (MedianVote.objects
                 .filter(voting__group__collection=collection)
                 .select_related('voting', 'voter')
                 .order_by('voting__id', '-value'))
+    if voters is not None:
+        votes_qs = votes_qs.filter(voter__in=[voter.id for voter in voters])
     # TODO did we somewhere use order_by(voting) (or something like that)
     # instead of voting__id?
 
@@ -41,6 +47,11 @@ def median_for_evaluation(collection):
     # as key
     for voting, votes in groupby(votes_qs, lambda vote: vote.voting):
         voter_mapping = OrderedDict()
+        if verified:
+            for vote in votes:
+                voter_mapping[vote.voter_id] = vote
+            all_votings.votes[voting.id] = voter_mapping
+            continue
         for vote in votes:
             if vote.voting.id not in all_votings.votings:
                 # this should really not happen ;)
@@ -66,8 +77,13 @@ def median_for_evaluation(collection):
     return all_votings
 
 
-def single_median_statistics(voting, votes, voters_map):
+def single_median_statistics(voting, votes, voters):
+    # voters: cache.WeightedVoters of the revision, for an absolute majority
+    # its weight_sum is the total weight of all voters
+    # the majority is computed by the compiled rule of the voting
+    rule = voting_rule(voting)
     res = GenericVotingInstance()
+    res.rule = rule
     # create list of MedianVote instances
     median_votes = []
     # compute sum of all weights
@@ -76,14 +92,16 @@ def single_median_statistics(voting, votes, voters_map):
     # should not be really necessary because all None votes are at the end
     # though
     additional_votes = []
-    absolute = voting.absolute_majority
+    # voters without a vote are counted as a vote for 0
+    as_no = rule.abstentions_as_no
+    additional_weight = 0
     # only for debuging to ensure the queryset is sorted
     last_vote = None
     for voter_id, vote in votes.items():
         if vote is None:
-            if absolute:
-                weight = voters_map[voter_id].weight
-                weight_sum += weight
+            if as_no:
+                weight = voters[voter_id].weight
+                additional_weight += weight
                 v = mv.MedianVote(0, weight)
                 additional_votes.append(v)
                 res.votes[voter_id] = v
@@ -101,6 +119,12 @@ def single_median_statistics(voting, votes, voters_map):
     # append all missing
     median_votes.extend(additional_votes)
     res.instance = mv.MedianStatistics(median_votes, is_sorted=True)
+    if rule.absolute:
+        # all voters of the revision are considered, so the total weight is
+        # already known
+        weight_sum = voters.weight_sum
+    elif as_no:
+        weight_sum += additional_weight
     res.weight_sum = weight_sum
-    res.majority = compute_majority(voting.majority, weight_sum)
+    res.majority = rule.required(weight_sum)
     return res
@@ -0,0 +1,77 @@
+from django.db import migrations
+
+
+# PostgreSQL: trigram index usable by icontains (UPPER(name::text) LIKE UPPER(...))
+POSTGRES_FORWARD = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX votings_voter_name_trgm ON votings_voter USING gin ((UPPER(name::text)) gin_trgm_ops)',
+]
+
+POSTGRES_BACKWARD = [
+    'DROP INDEX IF EXISTS votings_voter_name_trgm',
+]
+
+# SQLite: external content FTS5 table with the trigram tokenizer, kept in sync
+# with triggers
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE votings_voter_fts USING fts5(name, content='votings_voter', content_rowid='id', tokenize='trigram')",
+    """CREATE TRIGGER votings_voter_fts_ai AFTER INSERT ON votings_voter BEGIN
+        INSERT INTO votings_voter_fts(rowid, name) VALUES (new.id, new.name);
+    END""",
+    """CREATE TRIGGER votings_voter_fts_ad AFTER DELETE ON votings_voter BEGIN
+        INSERT INTO votings_voter_fts(votings_voter_fts, rowid, name) VALUES ('delete', old.id, old.name);
+    END""",
+    """CREATE TRIGGER votings_voter_fts_au AFTER UPDATE ON votings_voter BEGIN
+        INSERT INTO votings_voter_fts(votings_voter_fts, rowid, name) VALUES ('delete', old.id, old.name);
+        INSERT INTO votings_voter_fts(rowid, name) VALUES (new.id, new.name);
+    END""",
+    "INSERT INTO votings_voter_fts(votings_voter_fts) VALUES ('rebuild')",
+]
+
+SQLITE_BACKWARD = [
+    'DROP TRIGGER IF EXISTS votings_voter_fts_ai',
+    'DROP TRIGGER IF EXISTS votings_voter_fts_ad',
+    'DROP TRIGGER IF EXISTS votings_voter_fts_au',
+    'DROP TABLE IF EXISTS votings_voter_fts',
+]
+
+
+def _execute(schema_editor, statements):
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        _execute(schema_editor, POSTGRES_FORWARD)
+    elif vendor == 'sqlite':
+        # the trigram tokenizer requires SQLite >= 3.34, without it searching
+        # falls back to icontains
+        from django.db import DatabaseError
+        try:
+            with schema_editor.connection.cursor() as cursor:
+                cursor.execute("CREATE VIRTUAL TABLE votings_voter_fts_check USING fts5(name, tokenize='trigram')")
+                cursor.execute('DROP TABLE votings_voter_fts_check')
+        except DatabaseError:
+            return
+        _execute(schema_editor, SQLITE_FORWARD)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        _execute(schema_editor, POSTGRES_BACKWARD)
+    elif vendor == 'sqlite':
+        _execute(schema_editor, SQLITE_BACKWARD)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('votings', '0013_auto_20190418_1926'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 2.2.7 on 2026-10-19 06:06
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('votings', '0014_voter_name_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VoteHistoryEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('voter_name', models.CharField(max_length=150)),
+                ('collection_time', models.DateTimeField()),
+                ('group_num', models.PositiveIntegerField()),
+                ('voting_num', models.PositiveIntegerField()),
+                ('voting_name', models.CharField(max_length=150)),
+                ('vote', models.TextField()),
+                ('outcome', models.TextField()),
+                ('collection', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='votings.VotingCollection')),
+                ('median_voting', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='votings.MedianVoting')),
+                ('period', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='votings.Period')),
+                ('schulze_voting', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='votings.SchulzeVoting')),
+                ('voter', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='votings.Voter')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='votehistoryentry',
+            index=models.Index(fields=['voter_name', 'collection_time'], name='votings_history_name_time'),
+        ),
+        migrations.AddIndex(
+            model_name='votehistoryentry',
+            index=models.Index(fields=['period', 'voter_name'], name='votings_history_period_name'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 2.2.7 on 2026-10-19 06:08
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('votings', '0015_vote_history'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VotingStatistics',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('num_votes', models.PositiveIntegerField()),
+                ('votes_weight', models.PositiveIntegerField()),
+                ('requested', models.PositiveIntegerField(blank=True, null=True)),
+                ('approved', models.PositiveIntegerField(blank=True, null=True)),
+                ('num_options', models.PositiveIntegerField(blank=True, null=True)),
+                ('margin', models.IntegerField(blank=True, null=True)),
+                ('collection', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='votings.VotingCollection')),
+                ('median_voting', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='votings.MedianVoting')),
+                ('period', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='votings.Period')),
+                ('schulze_voting', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='votings.SchulzeVoting')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='VoterPeriodStatistics',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('voter_name', models.CharField(max_length=150)),
+                ('votings', models.PositiveIntegerField()),
+                ('votes', models.PositiveIntegerField()),
+                ('period', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='votings.Period')),
+            ],
+            options={
+                'unique_together': {('period', 'voter_name')},
+            },
+        ),
+    ]
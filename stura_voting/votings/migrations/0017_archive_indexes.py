@@ -0,0 +1,21 @@
+# Generated by Django 2.2.7 on 2026-10-19 06:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('votings', '0016_period_statistics'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='period',
+            index=models.Index(fields=['start', 'created', 'id'], name='votings_period_archive'),
+        ),
+        migrations.AddIndex(
+            model_name='votingcollection',
+            index=models.Index(fields=['time', 'id'], name='votings_collection_archive'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 2.2.7 on 2026-10-19 06:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('votings', '0017_archive_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PeriodSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('data', models.BinaryField()),
+                ('size', models.PositiveIntegerField()),
+                ('period', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='votings.Period')),
+            ],
+        ),
+    ]
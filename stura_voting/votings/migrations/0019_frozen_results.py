@@ -0,0 +1,24 @@
+# Generated by Django 2.2.7 on 2026-10-19 06:14
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('votings', '0018_period_snapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FrozenResults',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('closed', models.DateTimeField(default=django.utils.timezone.now)),
+                ('data', models.TextField()),
+                ('collection', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='votings.VotingCollection')),
+            ],
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 2.2.7 on 2026-10-19 09:02
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('votings', '0019_frozen_results'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='votingcollection',
+            name='modified',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
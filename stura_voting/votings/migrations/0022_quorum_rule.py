@@ -0,0 +1,60 @@
+# Generated by Django 2.2.7 on 2026-10-19 06:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.db.models.expressions
+
+
+# the rules equivalent to the majority and absolute_majority fields
+STANDARD_RULES = (
+    ('50%', 1, 2, False),
+    ('50% (absolut)', 1, 2, True),
+    ('2/3', 2, 3, False),
+    ('2/3 (absolut)', 2, 3, True),
+)
+
+
+def create_standard_rules(apps, schema_editor):
+    QuorumRule = apps.get_model('votings', 'QuorumRule')
+    for name, numerator, denominator, absolute in STANDARD_RULES:
+        QuorumRule.objects.get_or_create(
+            name=name,
+            defaults={'numerator': numerator, 'denominator': denominator, 'strict': True,
+                      'absolute': absolute, 'abstentions': 'no' if absolute else 'ignore'})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('votings', '0021_print_rendition'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuorumRule',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='Name of the rule', max_length=150, unique=True)),
+                ('numerator', models.PositiveIntegerField(help_text='Numerator of the required fraction of votes')),
+                ('denominator', models.PositiveIntegerField(help_text='Denominator of the required fraction of votes')),
+                ('strict', models.BooleanField(default=True, help_text='Set to true if more than the fraction is required, otherwise at least the fraction is required')),
+                ('absolute', models.BooleanField(default=False, help_text='Set to true if the fraction is computed from the weights of all voters')),
+                ('abstentions', models.CharField(choices=[('ignore', 'Voters without a vote are not considered'), ('no', 'Voters without a vote are counted as a vote for 0 / no')], default='ignore', help_text='How voters without a vote are handled', max_length=10)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='quorumrule',
+            constraint=models.CheckConstraint(check=models.Q(('denominator__gt', 0), ('numerator__lte', django.db.models.expressions.F('denominator'))), name='votings_quorum_fraction'),
+        ),
+        migrations.AddField(
+            model_name='medianvoting',
+            name='quorum',
+            field=models.ForeignKey(blank=True, help_text='Majority rule for the voting, overrides majority and absolute majority', null=True, on_delete=django.db.models.deletion.PROTECT, to='votings.QuorumRule'),
+        ),
+        migrations.AddField(
+            model_name='schulzevoting',
+            name='quorum',
+            field=models.ForeignKey(blank=True, help_text='Majority rule for the voting, overrides majority and absolute majority', null=True, on_delete=django.db.models.deletion.PROTECT, to='votings.QuorumRule'),
+        ),
+        migrations.RunPython(create_standard_rules, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 2.2.7 on 2026-10-19 06:30
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import json
+
+
+def log_existing_votes(apps, schema_editor):
+    # one import event for each voter with votes in a session, see
+    # ballotlog.record_ballots
+    MedianVote = apps.get_model('votings', 'MedianVote')
+    SchulzeVote = apps.get_model('votings', 'SchulzeVote')
+    BallotEvent = apps.get_model('votings', 'BallotEvent')
+    changes = dict()
+    median_votes = (MedianVote.objects
+                    .order_by('voting__group__collection', 'voter', 'voting')
+                    .values_list('voting__group__collection', 'voter', 'voting', 'value'))
+    for collection_id, voter_id, voting_id, value in median_votes:
+        changes.setdefault((collection_id, voter_id), []).append(
+            ['median', voting_id, None, value])
+    schulze_votes = (SchulzeVote.objects
+                     .order_by('option__voting__group__collection', 'voter',
+                               'option__voting', 'option__option_num')
+                     .values_list('option__voting__group__collection', 'voter',
+                                  'option__voting', 'sorting_position'))
+    positions = dict()
+    for collection_id, voter_id, voting_id, position in schulze_votes:
+        positions.setdefault((collection_id, voter_id, voting_id), []).append(position)
+    for (collection_id, voter_id, voting_id), voter_positions in sorted(positions.items()):
+        changes.setdefault((collection_id, voter_id), []).append(
+            ['schulze', voting_id, None, voter_positions])
+    BallotEvent.objects.bulk_create(
+        BallotEvent(collection_id=collection_id, voter_id=voter_id, source='import',
+                    changes=json.dumps(voter_changes, separators=(',', ':')))
+        for (collection_id, voter_id), voter_changes in sorted(changes.items()))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('votings', '0022_quorum_rule'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BallotEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_name', models.CharField(blank=True, max_length=150)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('source', models.CharField(choices=[('entry', 'Entered by a user'), ('import', 'Existing votes added to the log')], default='entry', max_length=10)),
+                ('changes', models.TextField()),
+                ('collection', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='votings.VotingCollection')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+                ('voter', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='votings.Voter')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='ballotevent',
+            index=models.Index(fields=['collection', 'id'], name='votings_ballot_coll_id'),
+        ),
+        migrations.RunPython(log_existing_votes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.7 on 2026-10-19 06:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('votings', '0023_ballot_log'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='votingcollection',
+            name='votes_verified',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AlterField(
+            model_name='ballotevent',
+            name='source',
+            field=models.CharField(choices=[('entry', 'Entered by a user'), ('import', 'Existing votes added to the log'), ('check', 'Invalid votes removed by the integrity check')], default='entry', max_length=10),
+        ),
+    ]
@@ -0,0 +1,318 @@
+import warnings
+
+from django.db import migrations
+from django.db.models import Count, F
+
+
+# Rules for the votes that can't be expressed as check constraints because they span
+# several tables, enforced by triggers:
+#
+#   * the voter of a vote belongs to the revision of the session
+#   * the value of a median vote is not greater than the value of the voting
+#   * a schulze ranking contains one vote for each option of the voting (PostgreSQL only,
+#     it can only be checked at the end of the transaction)
+#
+# Updates that would make existing votes invalid (revision of a session or voter with
+# votes, lowering the value of a median voting) are rejected as well. The lookups return
+# NULL if a referenced row does not exist (yet, foreign keys are deferred), these rows are
+# not rejected.
+
+POSTGRES_FORWARD = [
+    """CREATE FUNCTION votings_check_median_vote() RETURNS trigger AS $$
+    BEGIN
+        IF NEW.value > (SELECT value FROM votings_medianvoting WHERE id = NEW.voting_id) THEN
+            RAISE EXCEPTION 'median vote for voting % is greater than the value of the voting', NEW.voting_id
+                USING ERRCODE = 'check_violation';
+        END IF;
+        IF (SELECT revision_id FROM votings_voter WHERE id = NEW.voter_id) <>
+           (SELECT c.revision_id FROM votings_medianvoting v
+            JOIN votings_votinggroup g ON g.id = v.group_id
+            JOIN votings_votingcollection c ON c.id = g.collection_id
+            WHERE v.id = NEW.voting_id) THEN
+            RAISE EXCEPTION 'voter % does not belong to the revision of median voting %', NEW.voter_id, NEW.voting_id
+                USING ERRCODE = 'check_violation';
+        END IF;
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql""",
+    """CREATE TRIGGER votings_medianvote_check BEFORE INSERT OR UPDATE ON votings_medianvote
+    FOR EACH ROW EXECUTE PROCEDURE votings_check_median_vote()""",
+    """CREATE FUNCTION votings_check_schulze_vote() RETURNS trigger AS $$
+    BEGIN
+        IF (SELECT revision_id FROM votings_voter WHERE id = NEW.voter_id) <>
+           (SELECT c.revision_id FROM votings_schulzeoption o
+            JOIN votings_schulzevoting v ON v.id = o.voting_id
+            JOIN votings_votinggroup g ON g.id = v.group_id
+            JOIN votings_votingcollection c ON c.id = g.collection_id
+            WHERE o.id = NEW.option_id) THEN
+            RAISE EXCEPTION 'voter % does not belong to the revision of schulze option %', NEW.voter_id, NEW.option_id
+                USING ERRCODE = 'check_violation';
+        END IF;
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql""",
+    """CREATE TRIGGER votings_schulzevote_check BEFORE INSERT OR UPDATE ON votings_schulzevote
+    FOR EACH ROW EXECUTE PROCEDURE votings_check_schulze_vote()""",
+    """CREATE FUNCTION votings_check_median_voting() RETURNS trigger AS $$
+    BEGIN
+        IF NEW.value < OLD.value AND EXISTS (
+                SELECT 1 FROM votings_medianvote WHERE voting_id = NEW.id AND value > NEW.value) THEN
+            RAISE EXCEPTION 'median voting % has votes greater than %', NEW.id, NEW.value
+                USING ERRCODE = 'check_violation';
+        END IF;
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql""",
+    """CREATE TRIGGER votings_medianvoting_check BEFORE UPDATE OF value ON votings_medianvoting
+    FOR EACH ROW EXECUTE PROCEDURE votings_check_median_voting()""",
+    """CREATE FUNCTION votings_check_collection_revision() RETURNS trigger AS $$
+    BEGIN
+        IF NEW.revision_id <> OLD.revision_id AND (
+                EXISTS (SELECT 1 FROM votings_medianvote mv
+                        JOIN votings_medianvoting v ON v.id = mv.voting_id
+                        JOIN votings_votinggroup g ON g.id = v.group_id
+                        WHERE g.collection_id = NEW.id) OR
+                EXISTS (SELECT 1 FROM votings_schulzevote sv
+                        JOIN votings_schulzeoption o ON o.id = sv.option_id
+                        JOIN votings_schulzevoting v ON v.id = o.voting_id
+                        JOIN votings_votinggroup g ON g.id = v.group_id
+                        WHERE g.collection_id = NEW.id)) THEN
+            RAISE EXCEPTION 'the revision of session % with votes can not be changed', NEW.id
+                USING ERRCODE = 'check_violation';
+        END IF;
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql""",
+    """CREATE TRIGGER votings_votingcollection_check BEFORE UPDATE OF revision_id ON votings_votingcollection
+    FOR EACH ROW EXECUTE PROCEDURE votings_check_collection_revision()""",
+    """CREATE FUNCTION votings_check_voter_revision() RETURNS trigger AS $$
+    BEGIN
+        IF NEW.revision_id <> OLD.revision_id AND (
+                EXISTS (SELECT 1 FROM votings_medianvote WHERE voter_id = NEW.id) OR
+                EXISTS (SELECT 1 FROM votings_schulzevote WHERE voter_id = NEW.id)) THEN
+            RAISE EXCEPTION 'the revision of voter % with votes can not be changed', NEW.id
+                USING ERRCODE = 'check_violation';
+        END IF;
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql""",
+    """CREATE TRIGGER votings_voter_check BEFORE UPDATE OF revision_id ON votings_voter
+    FOR EACH ROW EXECUTE PROCEDURE votings_check_voter_revision()""",
+    # complete rankings, checked when the transaction is committed: the votes of a
+    # ranking are written one by one
+    """CREATE FUNCTION votings_check_schulze_ranking(ranking_voter integer, ranking_voting integer) RETURNS void AS $$
+    DECLARE
+        num_votes integer;
+        num_options integer;
+    BEGIN
+        SELECT count(*) INTO num_votes FROM votings_schulzevote sv
+            JOIN votings_schulzeoption o ON o.id = sv.option_id
+            WHERE sv.voter_id = ranking_voter AND o.voting_id = ranking_voting;
+        SELECT count(*) INTO num_options FROM votings_schulzeoption WHERE voting_id = ranking_voting;
+        IF num_votes <> 0 AND num_votes <> num_options THEN
+            RAISE EXCEPTION 'ranking of voter % for schulze voting % has % votes but the voting has % options',
+                ranking_voter, ranking_voting, num_votes, num_options
+                USING ERRCODE = 'check_violation';
+        END IF;
+    END;
+    $$ LANGUAGE plpgsql""",
+    """CREATE FUNCTION votings_check_schulze_vote_ranking() RETURNS trigger AS $$
+    BEGIN
+        -- the option is gone if it has been deleted in the same transaction, then
+        -- the option trigger checks the voting
+        IF TG_OP <> 'DELETE' THEN
+            PERFORM votings_check_schulze_ranking(NEW.voter_id, voting_id)
+                FROM votings_schulzeoption WHERE id = NEW.option_id;
+        END IF;
+        IF TG_OP <> 'INSERT' THEN
+            PERFORM votings_check_schulze_ranking(OLD.voter_id, voting_id)
+                FROM votings_schulzeoption WHERE id = OLD.option_id;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql""",
+    """CREATE CONSTRAINT TRIGGER votings_schulzevote_ranking AFTER INSERT OR UPDATE OR DELETE ON votings_schulzevote
+    DEFERRABLE INITIALLY DEFERRED
+    FOR EACH ROW EXECUTE PROCEDURE votings_check_schulze_vote_ranking()""",
+    """CREATE FUNCTION votings_check_schulze_option_rankings() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP <> 'DELETE' THEN
+            PERFORM votings_check_schulze_ranking(voter_id, NEW.voting_id) FROM (
+                SELECT DISTINCT sv.voter_id FROM votings_schulzevote sv
+                JOIN votings_schulzeoption o ON o.id = sv.option_id
+                WHERE o.voting_id = NEW.voting_id) AS voters;
+        END IF;
+        IF TG_OP <> 'INSERT' THEN
+            PERFORM votings_check_schulze_ranking(voter_id, OLD.voting_id) FROM (
+                SELECT DISTINCT sv.voter_id FROM votings_schulzevote sv
+                JOIN votings_schulzeoption o ON o.id = sv.option_id
+                WHERE o.voting_id = OLD.voting_id) AS voters;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql""",
+    """CREATE CONSTRAINT TRIGGER votings_schulzeoption_ranking AFTER INSERT OR UPDATE OR DELETE ON votings_schulzeoption
+    DEFERRABLE INITIALLY DEFERRED
+    FOR EACH ROW EXECUTE PROCEDURE votings_check_schulze_option_rankings()""",
+]
+
+POSTGRES_BACKWARD = [
+    'DROP TRIGGER IF EXISTS votings_medianvote_check ON votings_medianvote',
+    'DROP TRIGGER IF EXISTS votings_schulzevote_check ON votings_schulzevote',
+    'DROP TRIGGER IF EXISTS votings_medianvoting_check ON votings_medianvoting',
+    'DROP TRIGGER IF EXISTS votings_votingcollection_check ON votings_votingcollection',
+    'DROP TRIGGER IF EXISTS votings_voter_check ON votings_voter',
+    'DROP TRIGGER IF EXISTS votings_schulzevote_ranking ON votings_schulzevote',
+    'DROP TRIGGER IF EXISTS votings_schulzeoption_ranking ON votings_schulzeoption',
+    'DROP FUNCTION IF EXISTS votings_check_median_vote()',
+    'DROP FUNCTION IF EXISTS votings_check_schulze_vote()',
+    'DROP FUNCTION IF EXISTS votings_check_median_voting()',
+    'DROP FUNCTION IF EXISTS votings_check_collection_revision()',
+    'DROP FUNCTION IF EXISTS votings_check_voter_revision()',
+    'DROP FUNCTION IF EXISTS votings_check_schulze_vote_ranking()',
+    'DROP FUNCTION IF EXISTS votings_check_schulze_option_rankings()',
+    'DROP FUNCTION IF EXISTS votings_check_schulze_ranking(integer, integer)',
+]
+
+# SQLite: one trigger for each event, the conditions are the same as for PostgreSQL.
+# Complete rankings can't be checked, SQLite has no deferred triggers: the rankings are
+# only complete because the views write all votes of a ranking at once, incomplete
+# rankings are found by manage.py check_votes and ignored by the evaluation.
+SQLITE_MEDIAN_VOTE = """(
+    NEW.value > (SELECT value FROM votings_medianvoting WHERE id = NEW.voting_id) OR
+    (SELECT revision_id FROM votings_voter WHERE id = NEW.voter_id) <>
+    (SELECT c.revision_id FROM votings_medianvoting v
+     JOIN votings_votinggroup g ON g.id = v.group_id
+     JOIN votings_votingcollection c ON c.id = g.collection_id
+     WHERE v.id = NEW.voting_id))"""
+
+SQLITE_SCHULZE_VOTE = """(
+    (SELECT revision_id FROM votings_voter WHERE id = NEW.voter_id) <>
+    (SELECT c.revision_id FROM votings_schulzeoption o
+     JOIN votings_schulzevoting v ON v.id = o.voting_id
+     JOIN votings_votinggroup g ON g.id = v.group_id
+     JOIN votings_votingcollection c ON c.id = g.collection_id
+     WHERE o.id = NEW.option_id))"""
+
+SQLITE_FORWARD = [
+    """CREATE TRIGGER votings_medianvote_check_insert BEFORE INSERT ON votings_medianvote
+    WHEN %s BEGIN
+        SELECT RAISE(ABORT, 'invalid median vote: value too high or voter of another revision');
+    END""" % SQLITE_MEDIAN_VOTE,
+    """CREATE TRIGGER votings_medianvote_check_update BEFORE UPDATE ON votings_medianvote
+    WHEN %s BEGIN
+        SELECT RAISE(ABORT, 'invalid median vote: value too high or voter of another revision');
+    END""" % SQLITE_MEDIAN_VOTE,
+    """CREATE TRIGGER votings_schulzevote_check_insert BEFORE INSERT ON votings_schulzevote
+    WHEN %s BEGIN
+        SELECT RAISE(ABORT, 'invalid schulze vote: voter of another revision');
+    END""" % SQLITE_SCHULZE_VOTE,
+    """CREATE TRIGGER votings_schulzevote_check_update BEFORE UPDATE ON votings_schulzevote
+    WHEN %s BEGIN
+        SELECT RAISE(ABORT, 'invalid schulze vote: voter of another revision');
+    END""" % SQLITE_SCHULZE_VOTE,
+    """CREATE TRIGGER votings_medianvoting_check BEFORE UPDATE OF value ON votings_medianvoting
+    WHEN NEW.value < OLD.value AND EXISTS (
+        SELECT 1 FROM votings_medianvote WHERE voting_id = NEW.id AND value > NEW.value)
+    BEGIN
+        SELECT RAISE(ABORT, 'median voting has votes greater than the new value');
+    END""",
+    """CREATE TRIGGER votings_votingcollection_check BEFORE UPDATE OF revision_id ON votings_votingcollection
+    WHEN NEW.revision_id <> OLD.revision_id AND (
+        EXISTS (SELECT 1 FROM votings_medianvote mv
+                JOIN votings_medianvoting v ON v.id = mv.voting_id
+                JOIN votings_votinggroup g ON g.id = v.group_id
+                WHERE g.collection_id = NEW.id) OR
+        EXISTS (SELECT 1 FROM votings_schulzevote sv
+                JOIN votings_schulzeoption o ON o.id = sv.option_id
+                JOIN votings_schulzevoting v ON v.id = o.voting_id
+                JOIN votings_votinggroup g ON g.id = v.group_id
+                WHERE g.collection_id = NEW.id))
+    BEGIN
+        SELECT RAISE(ABORT, 'the revision of a session with votes can not be changed');
+    END""",
+    """CREATE TRIGGER votings_voter_check BEFORE UPDATE OF revision_id ON votings_voter
+    WHEN NEW.revision_id <> OLD.revision_id AND (
+        EXISTS (SELECT 1 FROM votings_medianvote WHERE voter_id = NEW.id) OR
+        EXISTS (SELECT 1 FROM votings_schulzevote WHERE voter_id = NEW.id))
+    BEGIN
+        SELECT RAISE(ABORT, 'the revision of a voter with votes can not be changed');
+    END""",
+]
+
+SQLITE_BACKWARD = [
+    'DROP TRIGGER IF EXISTS votings_medianvote_check_insert',
+    'DROP TRIGGER IF EXISTS votings_medianvote_check_update',
+    'DROP TRIGGER IF EXISTS votings_schulzevote_check_insert',
+    'DROP TRIGGER IF EXISTS votings_schulzevote_check_update',
+    'DROP TRIGGER IF EXISTS votings_medianvoting_check',
+    'DROP TRIGGER IF EXISTS votings_votingcollection_check',
+    'DROP TRIGGER IF EXISTS votings_voter_check',
+]
+
+
+def _execute(schema_editor, statements):
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def report_violations(apps, schema_editor):
+    # the triggers only check new and changed rows, existing invalid votes are
+    # reported (as a warning in the output of migrate) and can be removed with
+    # manage.py check_votes --fix
+    MedianVote = apps.get_model('votings', 'MedianVote')
+    SchulzeVote = apps.get_model('votings', 'SchulzeVote')
+    SchulzeOption = apps.get_model('votings', 'SchulzeOption')
+    db_alias = schema_editor.connection.alias
+    median_votes = MedianVote.objects.using(db_alias)
+    schulze_votes = SchulzeVote.objects.using(db_alias)
+    too_high = median_votes.filter(value__gt=F('voting__value')).count()
+    wrong_revision = (
+        median_votes.exclude(voter__revision=F('voting__group__collection__revision')).count() +
+        schulze_votes.exclude(voter__revision=F('option__voting__group__collection__revision')).count())
+    num_options = dict(SchulzeOption.objects.using(db_alias)
+                       .order_by()
+                       .values('voting')
+                       .annotate(num=Count('id'))
+                       .values_list('voting', 'num'))
+    rankings = (schulze_votes
+                .order_by()
+                .values('voter', 'option__voting')
+                .annotate(num=Count('id'))
+                .values_list('option__voting', 'num'))
+    incomplete = sum(1 for voting_id, num in rankings if num != num_options.get(voting_id, 0))
+    if too_high or wrong_revision or incomplete:
+        warnings.warn(
+            'Found invalid votes that violate the new constraints: %d median votes greater '
+            'than the value of the voting, %d votes of voters from another revision, %d '
+            'incomplete schulze rankings. Run "manage.py check_votes --fix" to delete them.' % (
+                too_high, wrong_revision, incomplete),
+            RuntimeWarning)
+
+
+def create_constraints(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        _execute(schema_editor, POSTGRES_FORWARD)
+    elif vendor == 'sqlite':
+        _execute(schema_editor, SQLITE_FORWARD)
+
+
+def drop_constraints(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        _execute(schema_editor, POSTGRES_BACKWARD)
+    elif vendor == 'sqlite':
+        _execute(schema_editor, SQLITE_BACKWARD)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('votings', '0024_votes_verified'),
+    ]
+
+    operations = [
+        migrations.RunPython(report_violations, migrations.RunPython.noop),
+        migrations.RunPython(create_constraints, drop_constraints),
+    ]
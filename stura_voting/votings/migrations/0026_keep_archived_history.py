@@ -0,0 +1,52 @@
+# Generated by Django 2.2.7 on 2026-10-19 09:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_history_fields(apps, schema_editor):
+    VoteHistoryEntry = apps.get_model('votings', 'VoteHistoryEntry')
+    VotingCollection = apps.get_model('votings', 'VotingCollection')
+    db_alias = schema_editor.connection.alias
+    entries = VoteHistoryEntry.objects.using(db_alias)
+    entries.filter(schulze_voting__isnull=False).update(voting_type='schulze')
+    for collection_id, name in VotingCollection.objects.using(db_alias).values_list('id', 'name'):
+        entries.filter(collection=collection_id).update(collection_name=name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('votings', '0025_vote_constraints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='votehistoryentry',
+            name='collection_name',
+            field=models.CharField(default='', max_length=150),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='votehistoryentry',
+            name='voting_type',
+            field=models.CharField(default='median', max_length=10),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name='votehistoryentry',
+            name='collection',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='votings.VotingCollection'),
+        ),
+        migrations.AlterField(
+            model_name='votehistoryentry',
+            name='voter',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='votings.Voter'),
+        ),
+        migrations.AlterField(
+            model_name='votingstatistics',
+            name='collection',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='votings.VotingCollection'),
+        ),
+        migrations.RunPython(fill_history_fields, migrations.RunPython.noop),
+    ]
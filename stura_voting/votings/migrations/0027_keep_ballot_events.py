@@ -0,0 +1,50 @@
+# Generated by Django 2.2.7 on 2026-10-19 14:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_event_fields(apps, schema_editor):
+    BallotEvent = apps.get_model('votings', 'BallotEvent')
+    Voter = apps.get_model('votings', 'Voter')
+    db_alias = schema_editor.connection.alias
+    events = BallotEvent.objects.using(db_alias)
+    events.update(collection_ref=models.F('collection_id'))
+    voter_ids = events.values_list('voter', flat=True).distinct()
+    for voter_id, name in (Voter.objects.using(db_alias)
+                           .filter(id__in=voter_ids)
+                           .values_list('id', 'name')):
+        events.filter(voter=voter_id).update(voter_name=name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('votings', '0026_keep_archived_history'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ballotevent',
+            name='collection_ref',
+            field=models.PositiveIntegerField(default=0),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='ballotevent',
+            name='voter_name',
+            field=models.CharField(default='', max_length=150),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name='ballotevent',
+            name='collection',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='votings.VotingCollection'),
+        ),
+        migrations.AlterField(
+            model_name='ballotevent',
+            name='voter',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='votings.Voter'),
+        ),
+        migrations.RunPython(fill_event_fields, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.7 on 2026-10-19 14:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('votings', '0027_keep_ballot_events'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='votingstatistics',
+            name='outdated',
+            field=models.BooleanField(default=False),
+        ),
+    ]
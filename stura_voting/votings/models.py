@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from django.conf import settings
 from django.db import models
 
 from django.utils import timezone
@@ -63,6 +64,12 @@ class Period(models.Model):
     def __str__(self):
         return str(self.name)
 
+    class Meta:
+        indexes = [
+            # sort key of the archive
+            models.Index(fields=['start', 'created', 'id'], name='votings_period_archive'),
+        ]
+
 
 class VotersRevision(models.Model):
     """A revision is a collection of different voters.
@@ -128,6 +135,10 @@ class VotingCollection(models.Model):
         name (models.CharField): The name of the session / collection.
         time (models.DateTimeField): The time when the session takes place.
         revision (VotersRevision): The revision identifying the voters for this session.
+        modified (models.DateTimeField): The time of the last change of the session, its
+            votings, votes or voters (maintained by the changes module).
+        votes_verified (models.DateTimeField): The value of modified when the votes were
+            last verified by the integrity module (manage.py check_votes), None if never.
 
     """
     name = models.CharField(
@@ -140,6 +151,18 @@ class VotingCollection(models.Model):
         'VotersRevision',
         on_delete=models.CASCADE,
         help_text=gettext_lazy('Group of voters for this session'))
+    modified = models.DateTimeField(auto_now=True)
+    votes_verified = models.DateTimeField(blank=True, null=True, editable=False)
+
+    def votes_are_verified(self):
+        """Returns True if the votes have been verified and nothing has changed since.
+
+        The sanity checks of the votes can be skipped for verified sessions.
+
+        Returns:
+            bool: True if the votes are verified.
+        """
+        return self.votes_verified is not None and self.votes_verified == self.modified
 
     class Meta:
         permissions = (
@@ -148,6 +171,10 @@ class VotingCollection(models.Model):
             ("enter_collection_results",
              "Can enter results for all who are entitled to vote"),
         )
+        indexes = [
+            # sort key of the archive
+            models.Index(fields=['time', 'id'], name='votings_collection_archive'),
+        ]
 
 
 class VotingGroup(models.Model):
@@ -178,6 +205,65 @@ class VotingGroup(models.Model):
                            ('group_num', 'collection'),)
 
 
+ABSTENTIONS_IGNORE = 'ignore'
+ABSTENTIONS_NO = 'no'
+
+ABSTENTION_CHOICES = (
+    (ABSTENTIONS_IGNORE, gettext_lazy('Voters without a vote are not considered')),
+    (ABSTENTIONS_NO, gettext_lazy('Voters without a vote are counted as a vote for 0 / no')),
+)
+
+
+class QuorumRule(models.Model):
+    """A configurable majority rule for votings.
+
+    A rule requires a fraction numerator / denominator of the votes. If strict is true
+    more than this fraction is required, otherwise at least this fraction. If absolute is
+    true the fraction is computed from the weights of all voters entitled to vote,
+    otherwise only from the voters that are counted. abstentions defines how voters
+    without a vote are handled.
+
+    A voting without a rule uses its majority and absolute_majority fields. The rules are
+    compiled into majority.CompiledRule objects, see the quorum module.
+
+    Attributes:
+        name (models.CharField): Unique name of the rule.
+        numerator (models.PositiveIntegerField): The numerator of the fraction.
+        denominator (models.PositiveIntegerField): The denominator of the fraction.
+        strict (models.BooleanField): True if more than the fraction is required.
+        absolute (models.BooleanField): True if the fraction is computed from all voters.
+        abstentions (models.CharField): ABSTENTIONS_IGNORE or ABSTENTIONS_NO.
+
+    """
+    name = models.CharField(max_length=150, unique=True,
+                            help_text=gettext_lazy('Name of the rule'))
+    numerator = models.PositiveIntegerField(
+        help_text=gettext_lazy('Numerator of the required fraction of votes'))
+    denominator = models.PositiveIntegerField(
+        help_text=gettext_lazy('Denominator of the required fraction of votes'))
+    strict = models.BooleanField(
+        default=True,
+        help_text=gettext_lazy('Set to true if more than the fraction is required, otherwise at least the fraction is required'))
+    absolute = models.BooleanField(
+        default=False,
+        help_text=gettext_lazy('Set to true if the fraction is computed from the weights of all voters'))
+    abstentions = models.CharField(
+        max_length=10,
+        choices=ABSTENTION_CHOICES,
+        default=ABSTENTIONS_IGNORE,
+        help_text=gettext_lazy('How voters without a vote are handled'))
+
+    class Meta:
+        constraints = [
+            models.CheckConstraint(
+                check=models.Q(denominator__gt=0, numerator__lte=models.F('denominator')),
+                name='votings_quorum_fraction'),
+        ]
+
+    def __str__(self):
+        return self.name
+
+
 class MedianVoting(models.Model):
     """A median voting, i.e. a voting of integers in which the first one with a majority wins.
 
@@ -197,6 +283,7 @@ class MedianVoting(models.Model):
             MAJORiTY_CHOICES.
         absolute_majority (models.BooleanField): If true all votes should be counted for the majority, not just the
             votes casted. All voters without a vote should be inserted as a vote for 0 cent.
+        quorum (QuorumRule): The majority rule, if set majority and absolute_majority are ignored.
         currency (models.CharField): The currency to display, only used for displaying. E.g. 4200 with currency "€" is
             displayed as "42,00 €".
         group (VotingGroup): The group to which this poll belongs to.
@@ -214,6 +301,12 @@ class MedianVoting(models.Model):
     absolute_majority = models.BooleanField(
         help_text=gettext_lazy('Set to true if all voters should be considerd, even those who did not cast a vote. Thes voters will be treated as if they voted for 0€'),
         default=False)
+    quorum = models.ForeignKey(
+        'QuorumRule',
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        help_text=gettext_lazy('Majority rule for the voting, overrides majority and absolute majority'))
     currency = models.CharField(
         max_length=10,
         blank=True,
@@ -243,6 +336,7 @@ class SchulzeVoting(models.Model):
             MAJORiTY_CHOICES.
         absolute_majority (models.BooleanField): If true all votes should be counted for the majority, not just the
             votes casted.
+        quorum (QuorumRule): The majority rule, if set majority and absolute_majority are ignored.
         group (VotingGroup): The group to which this poll belongs to.
         voting_num (models.PositiveIntegerField): The sorting position inside the group, must be unique for that group.
 
@@ -256,6 +350,12 @@ class SchulzeVoting(models.Model):
     absolute_majority = models.BooleanField(
         help_text=gettext_lazy('Set to true if all voters should be considerd, even those who did not cast a vote. Thes voters will be treated as if they voted for no (which is considered to be the last option)'),
         default=False)
+    quorum = models.ForeignKey(
+        'QuorumRule',
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        help_text=gettext_lazy('Majority rule for the voting, overrides majority and absolute majority'))
     group = models.ForeignKey(
         'VotingGroup',
         on_delete=models.CASCADE,
@@ -290,9 +390,8 @@ class MedianVote(models.Model):
     """A vote for a median voting.
 
     The vote consists of the value voted for and the voter that voted for this
-    It is not checked on a database level if voter.revision == voting.group.collection.revision, even though only this
-    would make sense.
-    It is also not checked (on database level) if value <= voting.value.
+    The database checks (with triggers, see migration 0025_vote_constraints) that
+    voter.revision == voting.group.collection.revision and value <= voting.value.
 
     Attributes:
         value (models.PositiveIntegerField): Value the voter voted for.
@@ -320,8 +419,8 @@ class SchulzeVote(models.Model):
     For a given schulze poll and a voter there must exist one one vote entry for all its options.
     That is Each vote is associated with an option and the ranking position is stored in the vote for that option.
     So if you have two options "A" and "B" for a voter there must be two entries, one for "A" and one for "B".
-    This is however not checked on a database level. As in a median poll the revision of the voting and the voter
-    are not checked on a database level.
+    This is checked by the database at the end of the transaction on PostgreSQL only. As in a median poll the
+    database checks that the revision of the voting and the voter are the same.
 
     Attributes:
         sorting_position (models.IntegerField): The sorting position, the lower the number the higher ranked.
@@ -343,3 +442,248 @@ class SchulzeVote(models.Model):
 
     class Meta:
         unique_together = ('voter', 'option',)
+
+
+class VoteHistoryEntry(models.Model):
+    """A materialized entry of the vote history of a voter.
+
+    For each (counted) vote of a voter there is one entry containing the formatted vote
+    and the outcome of the voting. The entries are derived from the votes and are kept
+    up to date by the history module, they should never be changed directly.
+    The voter name, period and time of the session are stored in the entry as well,
+    so all votes of a voter (by name, over all revisions) can be looked up with a
+    single index scan.
+    When the period is archived the entries are kept, but voter, collection and the
+    voting are set to None (they're deleted), see coldstorage.archive_period.
+
+    Attributes:
+        voter (Voter): The voter that cast the vote, None if archived.
+        voter_name (models.CharField): The name of the voter.
+        period (Period): The period of the session.
+        collection (VotingCollection): The session the voting belongs to, None if
+            archived.
+        collection_name (models.CharField): The name of the session.
+        collection_time (models.DateTimeField): The time the session takes place.
+        group_num (models.PositiveIntegerField): The group_num of the voting's group.
+        voting_num (models.PositiveIntegerField): The voting_num of the voting.
+        voting_type (models.CharField): 'median' or 'schulze'.
+        median_voting (MedianVoting): The voting if it is a median voting, else None
+            (and None if archived).
+        schulze_voting (SchulzeVoting): The voting if it is a schulze voting, else None
+            (and None if archived).
+        voting_name (models.CharField): The name of the voting.
+        vote (models.TextField): The vote as displayed, the value for a median voting or
+            the sorting positions for a schulze voting.
+        outcome (models.TextField): The outcome of the voting as displayed.
+
+    """
+    voter = models.ForeignKey('Voter', on_delete=models.CASCADE, blank=True, null=True)
+    voter_name = models.CharField(max_length=150)
+    period = models.ForeignKey('Period', on_delete=models.CASCADE)
+    collection = models.ForeignKey('VotingCollection', on_delete=models.CASCADE,
+                                   blank=True, null=True)
+    collection_name = models.CharField(max_length=150)
+    collection_time = models.DateTimeField()
+    group_num = models.PositiveIntegerField()
+    voting_num = models.PositiveIntegerField()
+    voting_type = models.CharField(max_length=10)
+    median_voting = models.ForeignKey('MedianVoting', on_delete=models.CASCADE,
+                                      blank=True, null=True)
+    schulze_voting = models.ForeignKey('SchulzeVoting', on_delete=models.CASCADE,
+                                       blank=True, null=True)
+    voting_name = models.CharField(max_length=150)
+    vote = models.TextField()
+    outcome = models.TextField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['voter_name', 'collection_time'],
+                         name='votings_history_name_time'),
+            models.Index(fields=['period', 'voter_name'],
+                         name='votings_history_period_name'),
+        ]
+
+
+class VotingStatistics(models.Model):
+    """Precomputed statistics of a single voting, used for the period statistics.
+
+    The statistics are derived from the votes and kept up to date together with the vote
+    history (see the history and stats modules). As the history the statistics are kept
+    when the period is archived, collection and the voting are set to None then.
+
+    Attributes:
+        period (Period): The period of the session.
+        collection (VotingCollection): The session the voting belongs to, None if archived.
+        median_voting (MedianVoting): The voting if it is a median voting, else None
+            (and None if archived).
+        schulze_voting (SchulzeVoting): The voting if it is a schulze voting, else None
+            (and None if archived).
+        num_votes (models.PositiveIntegerField): Number of counted votes.
+        votes_weight (models.PositiveIntegerField): The weight used to compute the majority.
+        requested (models.PositiveIntegerField): For median votings the value of the voting,
+            None for schulze votings.
+        approved (models.PositiveIntegerField): For median votings the value that got a
+            majority, None if no value got a majority.
+        num_options (models.PositiveIntegerField): For schulze votings the number of options.
+        margin (models.IntegerField): For schulze votings the difference of the votes
+            (weights) preferring the winner over the second option and vice versa.
+        outdated (models.BooleanField): True if votes have changed since the voting was
+            evaluated, the statistics and the outcome of the history entries must be
+            computed again before they're read (see history.refresh_outdated).
+
+    """
+    period = models.ForeignKey('Period', on_delete=models.CASCADE)
+    collection = models.ForeignKey('VotingCollection', on_delete=models.CASCADE,
+                                   blank=True, null=True)
+    median_voting = models.OneToOneField('MedianVoting', on_delete=models.CASCADE,
+                                         blank=True, null=True)
+    schulze_voting = models.OneToOneField('SchulzeVoting', on_delete=models.CASCADE,
+                                          blank=True, null=True)
+    num_votes = models.PositiveIntegerField()
+    votes_weight = models.PositiveIntegerField()
+    requested = models.PositiveIntegerField(blank=True, null=True)
+    approved = models.PositiveIntegerField(blank=True, null=True)
+    num_options = models.PositiveIntegerField(blank=True, null=True)
+    margin = models.IntegerField(blank=True, null=True)
+    outdated = models.BooleanField(default=False)
+
+
+class VoterPeriodStatistics(models.Model):
+    """Precomputed participation of a voter in a period.
+
+    Voters are identified by name over all revisions of the period.
+
+    Attributes:
+        period (Period): The period.
+        voter_name (models.CharField): The name of the voter.
+        votings (models.PositiveIntegerField): Number of votings the voter was entitled to
+            vote in.
+        votes (models.PositiveIntegerField): Number of votings the voter voted in.
+
+    """
+    period = models.ForeignKey('Period', on_delete=models.CASCADE)
+    voter_name = models.CharField(max_length=150)
+    votings = models.PositiveIntegerField()
+    votes = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = ('period', 'voter_name',)
+
+
+class PeriodSnapshot(models.Model):
+    """An immutable compressed snapshot of a finished period (cold storage).
+
+    When a period is archived all its revisions, voters, sessions, votings and votes are
+    stored in the snapshot together with the computed results and then removed from the
+    other tables. The snapshot can be displayed (read-only) and restored, see the
+    coldstorage module.
+
+    Attributes:
+        period (Period): The archived period.
+        created (models.DateTimeField): The time the snapshot was created.
+        data (models.BinaryField): The zlib compressed JSON snapshot.
+        size (models.PositiveIntegerField): The size of the uncompressed JSON in bytes.
+
+    """
+    period = models.OneToOneField('Period', on_delete=models.CASCADE)
+    created = models.DateTimeField(default=timezone.now)
+    data = models.BinaryField()
+    size = models.PositiveIntegerField()
+
+
+class FrozenResults(models.Model):
+    """The stored results of a closed session.
+
+    If a session has a FrozenResults record it is closed: The results are read from the
+    record instead of being computed from the votes and votes can't be changed anymore.
+    See the frozen module for the format of the data.
+
+    Attributes:
+        collection (VotingCollection): The closed session.
+        closed (models.DateTimeField): The time the session was closed.
+        data (models.TextField): The results as JSON.
+
+    """
+    collection = models.OneToOneField('VotingCollection', on_delete=models.CASCADE)
+    closed = models.DateTimeField(default=timezone.now)
+    data = models.TextField()
+
+
+class PrintRendition(models.Model):
+    """The rendered ballot sheet (print view) of a session.
+
+    The sheet is rendered once and served from this record until the session, its groups,
+    votings or options change (see the printing module).
+
+    Attributes:
+        collection (VotingCollection): The session.
+        created (models.DateTimeField): The time the sheet was rendered.
+        html (models.TextField): The rendered sheet.
+
+    """
+    collection = models.OneToOneField('VotingCollection', on_delete=models.CASCADE)
+    created = models.DateTimeField(default=timezone.now)
+    html = models.TextField()
+
+
+BALLOT_SOURCE_ENTRY = 'entry'
+BALLOT_SOURCE_IMPORT = 'import'
+BALLOT_SOURCE_CHECK = 'check'
+
+BALLOT_SOURCE_CHOICES = (
+    (BALLOT_SOURCE_ENTRY, gettext_lazy('Entered by a user')),
+    (BALLOT_SOURCE_IMPORT, gettext_lazy('Existing votes added to the log')),
+    (BALLOT_SOURCE_CHECK, gettext_lazy('Invalid votes removed by the integrity check')),
+)
+
+
+class BallotEvent(models.Model):
+    """An entry in the append-only ballot log.
+
+    Each save of a ballot (the votes of a voter in a session) that changes at least one
+    vote creates a single event containing all changes, see the ballotlog module for the
+    format. Events are never changed or deleted, so save and delete raise a ValueError
+    for existing events. If the session or the voter is deleted the event is kept, the
+    id of the session and the name of the voter are stored in the event. When a period
+    is archived the events of its sessions are moved into the snapshot (see the
+    coldstorage module).
+
+    Attributes:
+        collection (VotingCollection): The session, None if it has been deleted.
+        collection_ref (models.PositiveIntegerField): The id of the session when the
+            event was created.
+        voter (Voter): The voter whose ballot was changed, None if the voter has been
+            deleted.
+        voter_name (models.CharField): The name of the voter.
+        user (User): The user that entered the ballot, None if unknown or deleted.
+        user_name (models.CharField): The name of the user when the ballot was entered.
+        created (models.DateTimeField): The time the ballot was entered.
+        source (models.CharField): How the event was created (see BALLOT_SOURCE_CHOICES).
+        changes (models.TextField): The changed votes as JSON.
+
+    """
+    collection = models.ForeignKey('VotingCollection', on_delete=models.SET_NULL,
+                                   blank=True, null=True)
+    collection_ref = models.PositiveIntegerField()
+    voter = models.ForeignKey('Voter', on_delete=models.SET_NULL, blank=True, null=True)
+    voter_name = models.CharField(max_length=150)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL,
+                             blank=True, null=True)
+    user_name = models.CharField(max_length=150, blank=True)
+    created = models.DateTimeField(default=timezone.now)
+    source = models.CharField(max_length=10, choices=BALLOT_SOURCE_CHOICES,
+                              default=BALLOT_SOURCE_ENTRY)
+    changes = models.TextField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['collection', 'id'], name='votings_ballot_coll_id'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.pk is not None:
+            raise ValueError('Ballot events can not be changed')
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValueError('Ballot events can not be deleted')
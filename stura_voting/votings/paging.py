@@ -0,0 +1,216 @@
+# Copyright 2018 - 2019 Fabian Wenzelmann
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Keyset (seek) pagination.
+
+Instead of an offset a page remembers the sort key of its first and last object. The
+next page contains the objects following the last object, so the database can seek to
+that position in an index on the sort key. The time to load a page does not depend on
+the number of objects before it.
+
+All objects are sorted descending by the given keys, the last key must be unique
+(usually the id). Only the first key can be nullable, objects with a None value are
+sorted after all other objects. They are queried separately, so each query can be
+sorted by an (ascending) index on the keys: an index scan in reverse order, without
+sorting the objects.
+
+"""
+
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+# default number of objects on a page
+PAGE_SIZE = 25
+
+NEXT = 'next'
+PREVIOUS = 'previous'
+
+
+def encode_cursor(values):
+    """Encodes the sort key of an object into a string usable in a URL.
+
+    Args:
+        values (list): The values of the sort key (date, datetime, int or None).
+
+    Returns:
+        str: The cursor.
+    """
+    values = [value if value is None or isinstance(value, int) else value.isoformat()
+              for value in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(model, keys, cursor):
+    """Decodes a cursor created by encode_cursor.
+
+    Args:
+        model (class): The model the keys belong to.
+        keys (list of str): The names of the sort key fields.
+        cursor (str): The cursor.
+
+    Returns:
+        list or None: The values of the sort key, None if the cursor is invalid.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except (ValueError, binascii.Error):
+        return None
+    if not isinstance(values, list) or len(values) != len(keys):
+        return None
+    res = []
+    for key, value in zip(keys, values):
+        field = model._meta.get_field(key)
+        if value is None:
+            if not field.null:
+                return None
+            res.append(None)
+            continue
+        try:
+            res.append(field.to_python(value))
+        except ValidationError:
+            return None
+    return res
+
+
+def _after(keys, values):
+    # objects after the (not None) values in descending order
+    # the first key is bounded by itself as well, so the database can seek in an index
+    # instead of combining the results of the alternatives
+    key, value = keys[0], values[0]
+    if len(keys) == 1:
+        return Q(**{'%s__lt' % key: value})
+    return Q(**{'%s__lte' % key: value}) & (
+        Q(**{'%s__lt' % key: value}) | Q(**{key: value}) & _after(keys[1:], values[1:]))
+
+
+def _before(keys, values):
+    # objects before the (not None) values in descending order, see _after
+    key, value = keys[0], values[0]
+    if len(keys) == 1:
+        return Q(**{'%s__gt' % key: value})
+    return Q(**{'%s__gte' % key: value}) & (
+        Q(**{'%s__gt' % key: value}) | Q(**{key: value}) & _before(keys[1:], values[1:]))
+
+
+def _ordering(keys, descending):
+    # no NULLS LAST / NULLS FIRST, the ordering must match an index on the keys
+    if descending:
+        return ['-%s' % key for key in keys]
+    return list(keys)
+
+
+def _segments(queryset, keys, values, descending):
+    # returns the querysets that contain the objects after (descending) or before
+    # (not descending) the values, in this order
+    # the objects with a None value in the first key are sorted last, they're queried
+    # separately so that both queries can be sorted by an index on the keys
+    model = queryset.model
+    for key in keys[1:]:
+        if model._meta.get_field(key).null:
+            raise ValueError('Only the first sort key can be nullable, got %s' % key)
+    ordering = _ordering(keys, descending)
+    seek = _after if descending else _before
+    if not model._meta.get_field(keys[0]).null:
+        if values is not None:
+            queryset = queryset.filter(seek(keys, values))
+        return [queryset.order_by(*ordering)]
+    not_null = queryset.filter(**{'%s__isnull' % keys[0]: False}).order_by(*ordering)
+    null = queryset.filter(**{'%s__isnull' % keys[0]: True}).order_by(*ordering)
+    if values is not None and values[0] is None:
+        if len(keys) > 1:
+            null = null.filter(seek(keys[1:], values[1:]))
+        else:
+            null = null.none()
+        return [null] if descending else [null, not_null]
+    if values is not None:
+        not_null = not_null.filter(seek(keys, values))
+    return [not_null, null] if descending else [not_null]
+
+
+def _fetch(segments, limit):
+    # the first limit + 1 objects of the segments
+    objects = []
+    for queryset in segments:
+        objects.extend(queryset[:limit + 1 - len(objects)])
+        if len(objects) > limit:
+            break
+    return objects
+
+
+class KeysetPage(object):
+    """A page of objects.
+
+    Attributes:
+        object_list (list): The objects on this page.
+        has_next (bool): True if there are objects after this page.
+        has_previous (bool): True if there are objects before this page.
+        next_cursor (str or None): Cursor to get the next page (with direction NEXT).
+        previous_cursor (str or None): Cursor to get the previous page (with direction
+            PREVIOUS).
+
+    """
+    def __init__(self, object_list, has_next, has_previous, keys):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.has_previous = has_previous
+        self.next_cursor, self.previous_cursor = None, None
+        if object_list:
+            if has_next:
+                self.next_cursor = encode_cursor(
+                    [getattr(object_list[-1], key) for key in keys])
+            if has_previous:
+                self.previous_cursor = encode_cursor(
+                    [getattr(object_list[0], key) for key in keys])
+
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+
+def keyset_page(queryset, keys, cursor=None, direction=NEXT, limit=PAGE_SIZE):
+    """Returns a page of a queryset sorted descending by the keys.
+
+    Args:
+        queryset (queryset): The (filtered) objects.
+        keys (list of str): The names of the fields to sort by, the last one must be
+            unique and only the first one can be nullable.
+        cursor (str or None): The cursor from a previous page, None for the first page.
+            An invalid cursor is treated as None.
+        direction (str): NEXT to get the objects after the cursor, PREVIOUS to get the
+            objects before the cursor.
+        limit (int): Maximal number of objects on the page.
+
+    Returns:
+        KeysetPage: The page.
+    """
+    values = None
+    if cursor is not None:
+        values = decode_cursor(queryset.model, keys, cursor)
+    if values is None:
+        objects = _fetch(_segments(queryset, keys, None, True), limit)
+        return KeysetPage(objects[:limit], len(objects) > limit, False, keys)
+    if direction == PREVIOUS:
+        objects = _fetch(_segments(queryset, keys, values, False), limit)
+        if not objects:
+            return keyset_page(queryset, keys, limit=limit)
+        has_previous = len(objects) > limit
+        objects = objects[:limit]
+        objects.reverse()
+        return KeysetPage(objects, True, has_previous, keys)
+    objects = _fetch(_segments(queryset, keys, values, True), limit)
+    return KeysetPage(objects[:limit], len(objects) > limit, True, keys)
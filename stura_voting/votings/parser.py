@@ -0,0 +1,280 @@
+# Copyright 2018 - 2019 Fabian Wenzelmann
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Single pass parsers for voter lists, schulze options and voting collections.
+
+The syntax is the same as in stura_voting_utils.parser and the parsers return the same
+objects (WeightedVoter, VotingCollection etc.). But instead of stopping at the first
+error all lines are parsed and all errors are reported together with their line
+numbers (raised as ParseErrors). Each line is classified by its first character, so
+at most one regular expression is matched per line.
+
+"""
+
+import re
+
+from stura_voting_utils import (WeightedVoter, VotingCollection, VotingGroup,
+                                MedianVotingSkeleton, SchulzeVotingSkeleton)
+from stura_voting_utils.parser import ParseException, currency_match
+
+
+# maximal number of errors reported, further errors are only counted
+MAX_ERRORS = 50
+
+_voter_rx = re.compile(r'[*]\s+(?P<name>.+?):\s*(?P<weight>\d+)$')
+_heading_rx = re.compile(r'(?P<level>#{1,3})\s+(?P<text>.+?)$')
+_schulze_option_rx = re.compile(r'[*]\s+(?P<option>.+?)$')
+_median_option_rx = re.compile(
+    r'[-]\s+(?P<euro>\d+)(?:[.,](?P<cent>\d{1,2}))?\s*(?P<currency>[€$£])?$')
+
+# line kinds of a collection description
+HEAD = 1
+GROUP = 2
+VOTING = 3
+SCHULZE_OPTION = 4
+MEDIAN_OPTION = 5
+INVALID = 6
+
+
+class ParseErrors(ParseException):
+    """Raised by the parsers if the input contains errors.
+
+    Attributes:
+        errors (list of (int, str)): The line numbers (0 if the error doesn't belong to a
+            line) and messages of the first MAX_ERRORS errors.
+        num_errors (int): The number of all errors.
+
+    """
+    def __init__(self, errors, num_errors):
+        self.errors = errors
+        self.num_errors = num_errors
+        super().__init__('; '.join(self.messages()))
+
+    def messages(self):
+        """Returns the error messages.
+
+        Returns:
+            list of str: The messages, each containing the line number.
+        """
+        res = [('Line %d: %s' % (line_num, msg)) if line_num else msg
+               for line_num, msg in self.errors]
+        if self.num_errors > len(self.errors):
+            res.append('%d more errors' % (self.num_errors - len(self.errors)))
+        return res
+
+
+class _Errors(object):
+    # collects the errors of a parser
+
+    def __init__(self):
+        self.errors = []
+        self.num_errors = 0
+
+    def add(self, line_num, msg):
+        self.num_errors += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append((line_num, msg))
+
+    def check(self):
+        if self.num_errors:
+            # some errors are only detected at the end of a voting or group
+            raise ParseErrors(sorted(self.errors, key=lambda error: error[0]),
+                              self.num_errors)
+
+
+def parse_voters(text):
+    """Parses a list of voters, each line must be of the form "* <NAME>: <WEIGHT>".
+
+    Empty lines and lines starting with # are ignored. Each name must be unique.
+
+    Args:
+        text (str): The input.
+
+    Returns:
+        list of WeightedVoter: The voters.
+
+    Raises:
+        ParseErrors: If at least one line is invalid.
+    """
+    errors = _Errors()
+    voters = []
+    names = dict()
+    match = _voter_rx.match
+    for line_num, line in enumerate(text.split('\n'), 1):
+        line = line.strip()
+        if not line or line[0] == '#':
+            continue
+        m = match(line)
+        if m is None:
+            errors.add(line_num, 'Invalid syntax, must be of form "* voter: weight"')
+            continue
+        name = m.group('name')
+        if name in names:
+            errors.add(line_num, 'Voter "%s" already defined in line %d' % (name, names[name]))
+            continue
+        names[name] = line_num
+        voters.append(WeightedVoter(name, int(m.group('weight'))))
+    errors.check()
+    return voters
+
+
+def parse_schulze_options(text, min_options=2):
+    """Parses the options of a schulze voting, each line must be of the form "* <OPTION>".
+
+    Args:
+        text (str): The input.
+        min_options (int): Minimal number of options.
+
+    Returns:
+        list of str: The options.
+
+    Raises:
+        ParseErrors: If at least one line is invalid or there are not enough options.
+    """
+    errors = _Errors()
+    options = []
+    match = _schulze_option_rx.match
+    for line_num, line in enumerate(text.split('\n'), 1):
+        line = line.strip()
+        if not line:
+            continue
+        m = match(line)
+        if m is None:
+            errors.add(line_num, 'Invalid option, must be of form "* option"')
+            continue
+        options.append(m.group('option').strip())
+    if len(options) < min_options:
+        errors.add(0, 'Not enough options for voting')
+    errors.check()
+    return options
+
+
+def classify_line(line):
+    """Returns the kind of a line of a collection description.
+
+    Args:
+        line (str): The stripped, non empty line.
+
+    Returns:
+        int, match: The kind (HEAD, GROUP, VOTING, SCHULZE_OPTION, MEDIAN_OPTION or INVALID)
+            and the match object (None for INVALID).
+    """
+    first = line[0]
+    if first == '#':
+        m = _heading_rx.match(line)
+        if m is None:
+            return INVALID, None
+        return len(m.group('level')), m
+    elif first == '*':
+        m = _schulze_option_rx.match(line)
+        return (SCHULZE_OPTION, m) if m is not None else (INVALID, None)
+    elif first == '-':
+        m = _median_option_rx.match(line)
+        return (MEDIAN_OPTION, m) if m is not None else (INVALID, None)
+    return INVALID, None
+
+
+def parse_voting_collection(text, min_options=2):
+    """Parses a collection description.
+
+    The syntax is the same as in stura_voting_utils.parse_voting_collection:
+    A head "# <TITLE>", followed by groups "## <GROUP>". Each group contains votings
+    "### <VOTING>" followed either by one median value "- <VALUE>" or the schulze options
+    "* <OPTION>".
+
+    Args:
+        text (str): The input.
+        min_options (int): Minimal number of options of a schulze voting.
+
+    Returns:
+        VotingCollection: The parsed collection.
+
+    Raises:
+        ParseErrors: If the description contains at least one error.
+    """
+    errors = _Errors()
+    res = VotingCollection('', None, [])
+    # the current group and its line
+    group, group_line = None, 0
+    # the voting without options yet and its line
+    voting_name, voting_line = None, 0
+    # the schulze voting options are appended to and its line
+    schulze, schulze_line = None, 0
+    first = True
+
+    def finish_voting():
+        if voting_name is not None:
+            errors.add(voting_line, 'Voting "%s" has no options' % voting_name)
+        if schulze is not None and len(schulze.options) < min_options:
+            errors.add(schulze_line, 'Not enough options for schulze voting "%s"' % schulze.name)
+
+    def finish_group():
+        if group is not None and len(group) == 0:
+            errors.add(group_line, 'Group "%s" has no votings' % group.name)
+
+    for line_num, line in enumerate(text.split('\n'), 1):
+        line = line.strip()
+        if not line:
+            continue
+        kind, m = classify_line(line)
+        if first:
+            first = False
+            if kind == HEAD:
+                res.name = m.group('text')
+                continue
+            errors.add(line_num, 'Invalid head line, must be "# <TITLE>"')
+            if kind == INVALID:
+                continue
+        if kind == HEAD:
+            errors.add(line_num, 'Head "# <TITLE>" must be the first line')
+        elif kind == GROUP:
+            finish_voting()
+            finish_group()
+            voting_name, schulze = None, None
+            group, group_line = VotingGroup(m.group('text'), [], []), line_num
+            res.groups.append(group)
+        elif kind == VOTING:
+            if group is None:
+                errors.add(line_num, 'Voting before the first group "## <GROUP>"')
+                continue
+            finish_voting()
+            schulze = None
+            voting_name, voting_line = m.group('text'), line_num
+        elif kind == SCHULZE_OPTION:
+            if schulze is not None:
+                schulze.options.append(m.group('option'))
+            elif voting_name is not None:
+                schulze = SchulzeVotingSkeleton(voting_name, [m.group('option')], id=len(group))
+                schulze_line = voting_line
+                group.schulze_votings.append(schulze)
+                voting_name = None
+            else:
+                errors.add(line_num, 'Schulze option without a voting "### <VOTING>"')
+        elif kind == MEDIAN_OPTION:
+            if voting_name is None:
+                errors.add(line_num, 'Median value without a voting "### <VOTING>"')
+                continue
+            val, currency = currency_match(m)
+            group.median_votings.append(
+                MedianVotingSkeleton(voting_name, val, currency, id=len(group)))
+            voting_name = None
+        else:
+            errors.add(line_num, 'Invalid syntax, must be a group, voting, median value or '
+                                 'schulze option')
+    finish_voting()
+    finish_group()
+    if first:
+        errors.add(0, 'Empty description')
+    errors.check()
+    return res
@@ -0,0 +1,97 @@
+# Copyright 2018 - 2019 Fabian Wenzelmann
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Precomputed ballot sheets (the print view of a session).
+
+The sheet of a session is rendered once and stored in a models.PrintRendition record,
+all further requests only read the stored HTML. The record is deleted when the session,
+its groups, votings or options change (see signals), the next request (or the
+render_print command) renders it again. Votes and voters don't appear on the sheet.
+
+"""
+
+from django.db import transaction, IntegrityError
+from django.template.loader import render_to_string
+
+from .models import *
+from .utils import get_groups_template
+
+
+PRINT_TEMPLATE = 'votings/session/session_print.html'
+
+
+def render_print(collection):
+    """Renders the ballot sheet of a session.
+
+    The sheet is rendered without a request, it must not depend on the user.
+
+    Args:
+        collection (models.VotingCollection): The session.
+
+    Returns:
+        str: The rendered sheet.
+    """
+    groups, option_map, _ = get_groups_template(collection, empty_groups=False)
+    return render_to_string(PRINT_TEMPLATE, {
+        'object': collection,
+        'voting_session': collection,
+        'groups': groups,
+        'option_map': option_map,
+    })
+
+
+def store_print(collection):
+    """Renders the ballot sheet of a session and stores it, replacing an existing sheet.
+
+    Args:
+        collection (models.VotingCollection): The session.
+
+    Returns:
+        models.PrintRendition: The stored sheet.
+    """
+    html = render_print(collection)
+    with transaction.atomic():
+        PrintRendition.objects.filter(collection=collection).delete()
+        return PrintRendition.objects.create(collection=collection, html=html)
+
+
+def get_print(collection):
+    """Returns the ballot sheet of a session, renders and stores it if required.
+
+    Args:
+        collection (models.VotingCollection): The session.
+
+    Returns:
+        str: The rendered sheet.
+    """
+    rendition = PrintRendition.objects.filter(collection=collection).first()
+    if rendition is not None:
+        return rendition.html
+    html = render_print(collection)
+    try:
+        with transaction.atomic():
+            PrintRendition.objects.create(collection=collection, html=html)
+    except IntegrityError:
+        # stored by a concurrent request
+        pass
+    return html
+
+
+def invalidate_print(collection_id):
+    """Deletes the stored ballot sheet of a session.
+
+    Args:
+        collection_id (int): The primary key of the collection.
+    """
+    PrintRendition.objects.filter(collection=collection_id).delete()
@@ -0,0 +1,75 @@
+# Copyright 2018 - 2019 Fabian Wenzelmann
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""The majority rules of votings.
+
+A voting with a models.QuorumRule is evaluated with the compiled rule, a voting without
+one with the rule described by its majority and absolute_majority fields
+(majority.legacy_rule). All quorum rules are compiled at once and kept in memory until
+a rule is changed (see cache.invalidate_quorum_rules), there are only a few of them.
+
+"""
+
+from .models import *
+from .cache import LocalCache, get_version, QUORUM_VERSION_KEY
+from .majority import CompiledRule, legacy_rule
+
+
+_local_rules = LocalCache(max_size=1)
+
+
+def compile_quorum_rule(rule):
+    """Compiles a quorum rule.
+
+    Args:
+        rule (models.QuorumRule): The rule.
+
+    Returns:
+        majority.CompiledRule: The compiled rule.
+    """
+    return CompiledRule((rule.numerator, rule.denominator), rule.strict, rule.absolute,
+                        rule.abstentions == ABSTENTIONS_NO)
+
+
+def quorum_rules():
+    """Returns all compiled quorum rules.
+
+    Returns:
+        dict: Maps the ids of the models.QuorumRule objects to their compiled rules, must
+            not be changed.
+    """
+    version = get_version(QUORUM_VERSION_KEY)
+    rules = _local_rules.get(QUORUM_VERSION_KEY, version)
+    if rules is None:
+        rules = {rule.id: compile_quorum_rule(rule) for rule in QuorumRule.objects.all()}
+        _local_rules.set(QUORUM_VERSION_KEY, version, rules)
+    return rules
+
+
+def voting_rule(voting):
+    """Returns the compiled rule of a voting.
+
+    Args:
+        voting (models.MedianVoting or models.SchulzeVoting): The voting.
+
+    Returns:
+        majority.CompiledRule: The rule of the voting, must not be changed.
+    """
+    if voting.quorum_id is None:
+        return legacy_rule(voting.majority, voting.absolute_majority)
+    rule = quorum_rules().get(voting.quorum_id, None)
+    if rule is None:
+        # created after the rules have been cached and not yet invalidated
+        rule = compile_quorum_rule(QuorumRule.objects.get(id=voting.quorum_id))
+    return rule
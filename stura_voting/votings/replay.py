@@ -0,0 +1,355 @@
+# Copyright 2018 - 2019 Fabian Wenzelmann
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Replays the ballot log (see the ballotlog module).
+
+The events of all sessions are read in a single pass sorted by session, so only the
+ballots of one session are kept in memory. The replayed ballots can be compared with
+the live vote tables (check) or written to them (rebuild). A rebuild only changes the
+votes that differ from the log and then recomputes everything derived from the votes
+of the session: the vote history, the voting statistics, the participation of the
+period and the cached results.
+
+Deleting a voting or an option deletes its votes in a cascade without an event, so the
+replayed votes for these votings are not compared but reported separately. The events
+of deleted voters are skipped, their votes have been deleted as well.
+
+"""
+
+import json
+
+from collections import namedtuple
+from functools import partial
+from itertools import groupby
+from operator import itemgetter
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count
+
+from .models import *
+from .ballotlog import MEDIAN, current_ballots
+from . import cache
+from . import changes
+from . import history
+
+
+# a vote that differs between the log and the live tables, log and live are the votes
+# (value or list of sorting positions) or None if there is no vote
+Difference = namedtuple('Difference', ['collection_id', 'voter_id', 'v_type', 'voting_id',
+                                       'log', 'live'])
+
+# an event whose old value does not match the replayed vote, the vote was changed
+# without an event (for example in the admin)
+Conflict = namedtuple('Conflict', ['event_id', 'collection_id', 'voter_id', 'v_type',
+                                   'voting_id', 'old', 'replayed'])
+
+
+class ReplayedBallots(object):
+    """The ballots of a session after replaying some changes.
+
+    Attributes:
+        collection_id (int): The id of the session.
+        ballots (dict): Maps voter ids to the ballot of the voter, a dict mapping
+            (type, voting_id) to the vote. Voters without votes are not contained.
+        events (int): The number of replayed events.
+        conflicts (list of Conflict): The changes whose old value did not match.
+
+    """
+    def __init__(self, collection_id):
+        self.collection_id = collection_id
+        self.ballots = dict()
+        self.events = 0
+        self.conflicts = []
+
+    def apply(self, event_id, voter_id, changes_list):
+        """Applies the changes of an event.
+
+        Args:
+            event_id (int or None): The id of the event, None if the changes are not
+                from the log (they are not counted as events).
+            voter_id (int): The id of the voter.
+            changes_list (list): The changes as stored in the event.
+        """
+        ballot = self.ballots.setdefault(voter_id, dict())
+        for v_type, voting_id, old, new in changes_list:
+            key = (v_type, voting_id)
+            current = ballot.get(key, None)
+            if current != old:
+                self.conflicts.append(Conflict(event_id, self.collection_id, voter_id,
+                                               v_type, voting_id, old, current))
+            if new is None:
+                ballot.pop(key, None)
+            else:
+                ballot[key] = new
+        if not ballot:
+            del self.ballots[voter_id]
+        if event_id is not None:
+            self.events += 1
+
+    def compare(self, other):
+        """Returns the votes that differ between two states of the same session.
+
+        Args:
+            other (ReplayedBallots): The other state, usually from live_ballots.
+
+        Returns:
+            list of Difference: The differences, log is the vote in self and live the
+                vote in other. Sorted by voter, type and voting.
+        """
+        res = []
+        for voter_id in sorted(set(self.ballots) | set(other.ballots)):
+            ballot = self.ballots.get(voter_id, {})
+            other_ballot = other.ballots.get(voter_id, {})
+            for key in sorted(set(ballot) | set(other_ballot)):
+                vote, other_vote = ballot.get(key, None), other_ballot.get(key, None)
+                if vote != other_vote:
+                    res.append(Difference(self.collection_id, voter_id, key[0], key[1],
+                                          vote, other_vote))
+        return res
+
+    def drop_deleted(self, median_ids, num_options, other):
+        """Removes the votes for votings that have been deleted.
+
+        Schulze votes are removed as well if the number of options of the voting has
+        changed (the votes of a deleted option are deleted in a cascade).
+
+        Args:
+            median_ids (set of int): The ids of the existing median votings.
+            num_options (dict int to int): Maps the ids of the existing schulze votings
+                to their number of options.
+            other (ReplayedBallots): The other state, usually from live_ballots. The
+                removed votes are removed there as well.
+
+        Returns:
+            list of Difference: The removed votes, log is the vote in self and live the
+                vote in other. Sorted by voter, type and voting.
+        """
+        res = []
+        for voter_id in sorted(self.ballots):
+            ballot = self.ballots[voter_id]
+            other_ballot = other.ballots.get(voter_id, {})
+            for key in sorted(ballot):
+                v_type, voting_id = key
+                if v_type == MEDIAN:
+                    exists = voting_id in median_ids
+                else:
+                    exists = len(ballot[key]) == num_options.get(voting_id, 0)
+                if not exists:
+                    res.append(Difference(self.collection_id, voter_id, v_type, voting_id,
+                                          ballot.pop(key), other_ballot.pop(key, None)))
+            if not ballot:
+                del self.ballots[voter_id]
+        return res
+
+
+def replay(collection_ids):
+    """Replays the log of some sessions.
+
+    The events are read with a single query, the ballots of a session are created when
+    the session is reached. So the result should be consumed session by session.
+
+    Args:
+        collection_ids (iterable of int): The ids of the sessions.
+
+    Yields:
+        ReplayedBallots: The replayed ballots for each session, sorted by id.
+    """
+    collection_ids = sorted(set(collection_ids))
+    if not collection_ids:
+        return
+    events = (BallotEvent.objects
+              .filter(collection__in=collection_ids)
+              .order_by('collection', 'id')
+              .values_list('collection', 'id', 'voter', 'changes')
+              .iterator())
+    groups = groupby(events, key=itemgetter(0))
+    group = next(groups, None)
+    for collection_id in collection_ids:
+        state = ReplayedBallots(collection_id)
+        if group is not None and group[0] == collection_id:
+            for _, event_id, voter_id, changes_data in group[1]:
+                # the voter has been deleted, and its votes with it
+                if voter_id is not None:
+                    state.apply(event_id, voter_id, json.loads(changes_data))
+            group = next(groups, None)
+        yield state
+
+
+def live_ballots(collection_id):
+    """Returns the votes in the live tables of a session.
+
+    Args:
+        collection_id (int): The id of the session.
+
+    Returns:
+        ReplayedBallots: The current ballots.
+    """
+    res = ReplayedBallots(collection_id)
+    for (_, voter_id), ballot_changes in current_ballots([collection_id]).items():
+        res.apply(None, voter_id, ballot_changes.changes)
+    return res
+
+
+class ReplayReport(object):
+    """The result of checking or rebuilding a session.
+
+    Attributes:
+        collection_id (int): The id of the session.
+        events (int): The number of replayed events.
+        differences (list of Difference): The votes that differ(ed) from the log.
+        conflicts (list of Conflict): The events whose old value did not match.
+        removed (list of Difference): The logged votes for votings that have been
+            deleted, see ReplayedBallots.drop_deleted. They are not contained in
+            differences and are never rebuilt.
+        rebuilt (bool): True if the votes have been rebuilt from the log.
+        skipped (list of Difference): Differences that were not rebuilt because the
+            voting or an option does not exist anymore, or the session was not rebuilt.
+        rejected (list of (Difference, str)): Differences that were not rebuilt because
+            the database rejected the logged votes (see migration 0025_vote_constraints,
+            e.g. the value of the voting has been lowered) and the error message.
+
+    """
+    def __init__(self, state, differences, removed):
+        self.collection_id = state.collection_id
+        self.events = state.events
+        self.differences = differences
+        self.removed = removed
+        self.conflicts = state.conflicts
+        self.rebuilt = False
+        self.skipped = []
+        self.rejected = []
+
+    def ok(self):
+        return not self.differences and not self.conflicts
+
+
+def check(collection_ids):
+    """Compares the replayed log of some sessions with the live vote tables.
+
+    Args:
+        collection_ids (iterable of int): The ids of the sessions.
+
+    Yields:
+        ReplayReport: The report for each session, sorted by id.
+    """
+    for state in replay(collection_ids):
+        yield _compare(state)
+
+
+def _compare(state):
+    # compares the replayed ballots with the live tables, the votes for deleted votings
+    # are reported separately
+    collection_id = state.collection_id
+    live = live_ballots(collection_id)
+    median_ids = set(MedianVoting.objects
+                     .filter(group__collection=collection_id)
+                     .values_list('id', flat=True))
+    num_options = dict(SchulzeVoting.objects
+                       .filter(group__collection=collection_id)
+                       .annotate(num=Count('schulzeoption'))
+                       .values_list('id', 'num'))
+    removed = state.drop_deleted(median_ids, num_options, live)
+    return ReplayReport(state, state.compare(live), removed)
+
+
+def _write_votes(collection_id, differences):
+    # changes the live votes to the replayed ones, returns the differences that can't
+    # be written and the differences rejected by the database (with the error), each
+    # difference is written in its own savepoint so a rejected one keeps the old votes
+    skipped, rejected = [], []
+    median_ids = set(MedianVoting.objects
+                     .filter(group__collection=collection_id)
+                     .values_list('id', flat=True))
+    options = dict()
+    options_qs = (SchulzeOption.objects
+                  .filter(voting__group__collection=collection_id)
+                  .order_by('voting', 'option_num'))
+    for option in options_qs:
+        options.setdefault(option.voting_id, []).append(option)
+    for diff in differences:
+        if diff.v_type == MEDIAN:
+            if diff.voting_id not in median_ids:
+                skipped.append(diff)
+                continue
+        elif diff.log is not None and len(diff.log) != len(options.get(diff.voting_id, [])):
+            skipped.append(diff)
+            continue
+        try:
+            with transaction.atomic():
+                _write_difference(diff, options.get(diff.voting_id, []))
+        except IntegrityError as e:
+            rejected.append((diff, str(e)))
+    return skipped, rejected
+
+
+def _write_difference(diff, voting_options):
+    voter_id = diff.voter_id
+    if diff.v_type == MEDIAN:
+        MedianVote.objects.filter(voter=voter_id, voting=diff.voting_id).delete()
+        if diff.log is not None:
+            MedianVote.objects.create(voter_id=voter_id, voting_id=diff.voting_id,
+                                      value=diff.log)
+    else:
+        SchulzeVote.objects.filter(voter=voter_id, option__voting=diff.voting_id).delete()
+        if diff.log is not None:
+            SchulzeVote.objects.bulk_create(
+                SchulzeVote(voter_id=voter_id, option=option, sorting_position=position)
+                for option, position in zip(voting_options, diff.log))
+
+
+def rebuild(collection_ids):
+    """Rebuilds the votes of some sessions from the log and everything derived from them.
+
+    Closed sessions and sessions without any event (their votes were never logged) are
+    not changed, the reports contain the differences. The history, statistics and cached
+    results are refreshed after the transaction of each session has been committed.
+
+    Args:
+        collection_ids (iterable of int): The ids of the sessions.
+
+    Yields:
+        ReplayReport: The report for each session, sorted by id.
+    """
+    closed = set(FrozenResults.objects
+                 .filter(collection__in=collection_ids)
+                 .values_list('collection', flat=True))
+    for state in replay(collection_ids):
+        collection_id = state.collection_id
+        if collection_id in closed or not state.events:
+            report = _compare(state)
+            report.skipped = report.differences
+            yield report
+            continue
+        with transaction.atomic():
+            report = _compare(state)
+            if report.differences:
+                report.skipped, report.rejected = _write_votes(collection_id,
+                                                               report.differences)
+            report.rebuilt = True
+            # the vote signals only refresh what changed, derived data might be wrong
+            # for unchanged votes as well
+            history.schedule_refresh(history.COLLECTION, collection_id)
+            changes.schedule_touch(changes.COLLECTION, collection_id)
+            transaction.on_commit(partial(_invalidate_results, collection_id))
+        yield report
+
+
+def _invalidate_results(collection_id):
+    for voting_id in MedianVoting.objects.filter(
+            group__collection=collection_id).values_list('id', flat=True):
+        cache.invalidate_median_votes(voting_id)
+    for voting_id in SchulzeVoting.objects.filter(
+            group__collection=collection_id).values_list('id', flat=True):
+        cache.invalidate_schulze_votes(voting_id)
+    cache.invalidate_collection(collection_id)
@@ -17,10 +17,12 @@ from itertools import groupby
 from heapq import merge
 
 from django.utils.translation import gettext
+from django.utils.functional import cached_property
+
+from stura_voting_utils.utils import output_currency
 
 from . import utils
 from . import models as voting_models
-from django.db.models import Q
 
 
 # TODO in subpackage (stura_voting_utils) specify requirements
@@ -340,7 +342,7 @@ def median_votings(select_for_update=False, **kwargs):
         collection = kwargs['collection']
         votings_qs = (
             voting_models.MedianVoting.objects.filter(
-                group__collection=collection) .order_by(
+                group__collection=collection) .select_related('group') .order_by(
                 'group__group_num', 'voting_num'))
     elif 'group' in kwargs:
         group = kwargs['group']
@@ -372,7 +374,7 @@ def schulze_votings(select_for_update=False, **kwargs):
         collection = kwargs['collection']
         votings_qs = (
             voting_models.SchulzeVoting.objects.filter(
-                group__collection=collection) .order_by(
+                group__collection=collection) .select_related('group') .order_by(
                 'group__group_num', 'voting_num'))
     elif 'group' in kwargs:
         group = kwargs['group']
@@ -406,7 +408,7 @@ def schulze_votings(select_for_update=False, **kwargs):
         res.votings[voting.id] = voting
     # group options according to votings
     for option in options_qs:
-        voting_id = option.voting.id
+        voting_id = option.voting_id
         # just to be sure, should not happen
         if voting_id not in res.votings:
             msg = gettext(
@@ -423,91 +425,88 @@ def schulze_votings(select_for_update=False, **kwargs):
     return res
 
 
-# TODO add select_for_update?
-def median_votes_for_voter(collection, voter):
-    votings_qs = (
-        voting_models.MedianVoting.objects.filter(
-            group__collection=collection) .order_by(
-            'group__group_num',
-            'voting_num'))
-    votes_qs = (voting_models.MedianVote.objects
-                .select_for_update()
-                .filter(voter=voter, voting__group__collection=collection)
-                .select_related('voting'))
+def add_median_votes_for_voter(res, collection, voter):
+    """Adds the median votes of a voter to the votings in res.
 
-    res = GenericVotingResult()
-    # fetch all median votings
-    for voting in votings_qs:
-        voting_id = voting.id
-        res.votings[voting_id] = voting
-        res.voting_description[voting_id] = voting.value
+    The votes are locked (select_for_update) and their voting attribute is set to the
+    voting in res.votings, so no further queries are required.
 
+    Args:
+        res (GenericVotingResult): The median votings of the collection, for example
+            from median_votings. The votes and warnings are added to it.
+        collection (models.VotingCollection): The collection.
+        voter (models.Voter): The voter.
+    """
+    votes_qs = (voting_models.MedianVote.objects
+                .select_for_update()
+                .filter(voter=voter, voting__group__collection=collection))
     # fetch all votings for which there exists a vote and perform sanity check
     for vote in votes_qs:
-        res.votes[vote.voting.id] = vote
-        if vote.value > vote.voting.value:
-            warning = MedianWarning(vote.voting, vote.value)
+        voting = res.votings.get(vote.voting_id, None)
+        if voting is None:
+            msg = gettext(
+                'Found a vote with id %(vote)d for median voting %(voting)d, but voting does not exist' % {
+                    'vote': vote.id,
+                    'voting': vote.voting_id,
+                })
+            res.warnings.append(msg)
+            continue
+        vote.voting = voting
+        res.votes[voting.id] = vote
+        if vote.value > voting.value:
+            warning = MedianWarning(voting, vote.value)
             res.warnings.append(warning)
+
+
+def median_votes_for_voter(collection, voter):
+    res = median_votings(collection=collection)
+    add_median_votes_for_voter(res, collection, voter)
     return res
 
 
-def schulze_votes_for_voter(collection, voter):
-    # all votings
-    votings_qs = (
-        voting_models.SchulzeVoting.objects.filter(
-            group__collection=collection) .order_by(
-            'group__group_num',
-            'voting_num'))
-    # all options
-    options_qs = (
-        voting_models.SchulzeOption.objects.filter(
-            voting__group__collection=collection) .order_by(
-            'voting__id', 'option_num'))
+def add_schulze_votes_for_voter(res, collection, voter, verified=False):
+    """Adds the schulze votes of a voter to the votings in res.
+
+    Works as add_median_votes_for_voter, the option of each vote is set to the option in
+    res.voting_description. For each voting the votes are a list sorted by option_num.
+
+    Args:
+        res (GenericVotingResult): The schulze votings of the collection, for example
+            from schulze_votings. The votes and warnings are added to it.
+        collection (models.VotingCollection): The collection.
+        voter (models.Voter): The voter.
+        verified (bool): If true the rankings are not checked, see
+            models.VotingCollection.votes_are_verified.
+    """
+    options = {option.id: option
+               for voting_options in res.voting_description.values()
+               for option in voting_options}
     # all options voted for
     votes_qs = (
         voting_models.SchulzeVote.objects.filter(
             voter=voter,
-            option__voting__group__collection=collection) .select_for_update() .select_related('option') .order_by(
+            option__voting__group__collection=collection) .select_for_update() .order_by(
             'option__voting__id',
             'option__option_num'))
-    res = GenericVotingResult()
-
-    # fetch all schulze votings
-    for voting in votings_qs:
-        res.votings[voting.id] = voting
-    # group options according to votings
-    for option in options_qs:
-        voting_id = option.voting.id
-        # just to be sure, should not happen
-        if voting_id not in res.votings:
-            msg = gettext(
-                'Found option with id %(option)d for voting %(voting)d, but voting does not exist' % {
-                    'option': option.id,
-                    'voting': voting_id,
-                })
-            res.warnings.append(SchulzeWarning(msg))
-            continue
-        if voting_id in res.voting_description:
-            res.voting_description[voting_id].append(option)
-        else:
-            res.voting_description[voting_id] = [option]
-    # do the same for casted votes
     for schulze_vote in votes_qs:
-        voting_id = schulze_vote.option.voting.id
+        option = options.get(schulze_vote.option_id, None)
         # just to be sure
-        if voting_id not in res.votings:
+        if option is None or option.voting_id not in res.votings:
             msg = gettext(
-                'Found a vote with id %(vote)d for schulze option with id %(option)d for voting %(voting)d, but voting does not exist' % {
+                'Found a vote with id %(vote)d for schulze option with id %(option)d, but voting does not exist' % {
                     'vote': schulze_vote.id,
-                    'option': schulze_vote.option.id,
-                    'voting': voting_id,
+                    'option': schulze_vote.option_id,
                 })
             res.warnings.append(SchulzeWarning(msg))
             continue
+        schulze_vote.option = option
+        voting_id = option.voting_id
         if voting_id in res.votes:
             res.votes[voting_id].append(schulze_vote)
         else:
             res.votes[voting_id] = [schulze_vote]
+    if verified:
+        return
     # now perform sanity checks
     for voting_id, votes in res.votes.items():
         if voting_id not in res.voting_description:
@@ -525,18 +524,13 @@ def schulze_votes_for_voter(collection, voter):
                     'voting': voting_id,
                 })
             res.warnings.append(SchulzeWarning(msg))
-            continue
-        for vote, option in zip(votes, voting_options):
-            if vote.option != option:
-                msg = gettext(
-                    'Invalid vote for option for voting %(voting)d: Got vote for option %(option)d instead of %(for)d' % {
-                        'voting': voting_id,
-                        'option': vote.option.id,
-                        'for': option.id,
-                    })
-                res.warnings.append(SchulzeWarning(msg))
-                # no continue here, evaluation works fine but probably
-                # something is wrong
+        # a ranking of the right length contains each option once, see
+        # schulze_for_evaluation
+
+
+def schulze_votes_for_voter(collection, voter):
+    res = schulze_votings(collection=collection)
+    add_schulze_votes_for_voter(res, collection, voter, collection.votes_are_verified())
     return res
 
 
@@ -558,6 +552,159 @@ def for_votes_list_template(voting_result):
     return groups
 
 
+def median_vote_str(vote, voting):
+    return output_currency(vote.value, voting.currency)
+
+
+def schulze_vote_str(vote):
+    # vote is a list of models.SchulzeVote
+    return ' '.join(str(option_vote.sorting_position) for option_vote in vote)
+
+
+def schulze_ranking_str(vote):
+    # vote is a schulze_voting.SchulzeVote
+    return ' '.join(map(str, vote.ranking))
+
+
+def votes_list_rows(voting_result, voters):
+    """Returns the rows for the votes list template.
+
+    Assumes that missing entries have been filled with fill_missing_voters.
+    Each row contains the voter and the formatted vote for each voting (in the order of
+    combined_votings), '/' if the voter did not vote. This way the template doesn't have
+    to look up anything.
+
+    Args:
+        voting_result (CombinedVotingResult): The votings and votes.
+        voters (iterable of models.Voter): All voters, one row is created for each voter.
+
+    Returns:
+        list of (voter, list of str): The rows of the table.
+    """
+    columns = []
+    for v in voting_result.combined_votings():
+        if isinstance(v, voting_models.MedianVoting):
+            columns.append(('median', v, voting_result.get_median_vote(v.id)))
+        elif isinstance(v, voting_models.SchulzeVoting):
+            columns.append(('schulze', v, voting_result.get_schulze_vote(v.id)))
+        else:
+            assert False
+    rows = []
+    for voter in voters:
+        cells = []
+        for v_type, v, votes in columns:
+            vote = votes.get(voter.id, None)
+            if vote is None:
+                cells.append('/')
+            elif v_type == 'median':
+                cells.append(median_vote_str(vote, v))
+            else:
+                cells.append(schulze_vote_str(vote))
+        rows.append((voter, cells))
+    return rows
+
+
+class MedianResultEntry(object):
+    """All data required to render the result of a median voting.
+
+    The rows for the detailed view are only computed when accessed, if the rendered
+    result is cached they're not computed at all.
+
+    Attributes:
+        v_type (str): Always 'median'.
+        voting (models.MedianVoting): The voting.
+        votes (dict): Maps voter ids to the models.MedianVote (or None).
+        instance (GenericVotingInstance): The evaluation instance for the voting.
+        result (int or None): The value that got a majority.
+        voters (iterable of models.Voter): All voters of the collection.
+        version (str): Version of the result, used as a cache key.
+
+    """
+    v_type = 'median'
+
+    def __init__(self, voting, votes, instance, result, voters, version=None):
+        self.voting = voting
+        self.votes = votes
+        self.instance = instance
+        self.result = result
+        self.voters = voters
+        self.version = version
+
+    @cached_property
+    def detail_rows(self):
+        """List of (voter, vote, corrected vote), the votes as strings or None."""
+        res = []
+        actual_votes = self.instance.votes
+        for voter in self.voters:
+            vote = self.votes.get(voter.id, None)
+            actual = actual_votes.get(voter.id, None)
+            res.append((
+                voter,
+                None if vote is None else median_vote_str(vote, self.voting),
+                None if actual is None else median_vote_str(actual, self.voting),
+            ))
+        return res
+
+
+class SchulzeResultEntry(object):
+    """All data required to render the result of a schulze voting.
+
+    As in MedianResultEntry the rows for the detailed view and the ranking are computed
+    when accessed.
+
+    Attributes:
+        v_type (str): Always 'schulze'.
+        voting (models.SchulzeVoting): The voting.
+        votes (dict): Maps voter ids to a list of models.SchulzeVote (or None).
+        instance (GenericVotingInstance): The evaluation instance for the voting.
+        result (schulze_voting.SchulzeRes): The result of the evaluation.
+        options (list of models.SchulzeOption): The options of the voting.
+        num_no (list of int): For each option the number of votes that ranked the
+            option before the last option (no).
+        percent_no (list of float): num_no in percent of all votes.
+        voters (iterable of models.Voter): All voters of the collection.
+        version (str): Version of the result, used as a cache key.
+
+    """
+    v_type = 'schulze'
+
+    def __init__(self, voting, votes, instance, result, options, num_no, percent_no,
+                 voters, version=None):
+        self.voting = voting
+        self.votes = votes
+        self.instance = instance
+        self.result = result
+        self.options = options
+        self.num_no = num_no
+        self.percent_no = percent_no
+        self.voters = voters
+        self.version = version
+
+    @cached_property
+    def ranking(self):
+        """The ranked groups of options, each a list of (option, num_no, percent_no)."""
+        res = []
+        for group in self.result.candidate_wins:
+            res.append([(self.options[i].option, self.num_no[i], self.percent_no[i])
+                        for i in group])
+        return res
+
+    @cached_property
+    def detail_rows(self):
+        """List of (voter, vote, corrected vote), the votes as strings or None."""
+        res = []
+        actual_votes = self.instance.votes
+        for voter in self.voters:
+            vote = self.votes.get(voter.id, None)
+            actual = actual_votes.get(voter.id, None)
+            res.append((
+                voter,
+                None if vote is None else schulze_vote_str(vote),
+                None if actual is None else schulze_ranking_str(actual),
+            ))
+        return res
+
+
 class GenericVotingInstance(object):
     # fields: instance, MedianStatistics for median
     # or list of list of schulze_voting.SchulzeVote for schulze
@@ -565,59 +712,11 @@ class GenericVotingInstance(object):
     # majority: required votes (int)
     # an instance of schulze_voting.SchulzeVote
     # weight_sum: sum of weights used
+    # rule: majority.CompiledRule used to compute the majority
     def __init__(self):
         self.instance = None
         self.votes = dict()
         self.weight_sum = None
         self.majority = None
+        self.rule = None
 
-
-def query_votes(**kwargs):
-    # filter by: timespan or specific user (bound to revision) or
-    # username contains
-    # also possible: all of it
-    # returns, what? for voting? for session
-    # for session is good: all votings for which a voter voted something
-    period = kwargs.pop('period', None)
-    start, end = kwargs.pop('start', None), kwargs.pop('end', None)
-    query = kwargs.pop('query', None)
-    # build filter args
-    schulze_kwargs = dict()
-    median_kwargs = dict()
-    if period is not None:
-        schulze_kwargs.update(option__voting__group__collection__revision__period=period)
-        median_kwargs.update(voting__group__collection__revision__period=period)
-    if start is not None:
-        schulze_kwargs.update(option__voting__group__collection__time__gte=start)
-        median_kwargs.update(voting__group__collection__time__gte=start)
-    if end is not None:
-        schulze_kwargs.update(option__voting__group__collection__time__lte=end)
-        median_kwargs.update(voting__group__collection__time__lte=end)
-    schulze_q, median_q = None, None
-    if query is not None:
-        if kwargs.pop('split', False):
-            split = query.split(' ')
-            split = map(lambda s: s.strip(), split)
-            split = list(filter(lambda s: s, split))
-            if split:
-                schulze_q = Q()
-                median_q = Q()
-                for sub in map(lambda s: s.strip(), split):
-                    schulze_q = schulze_q | Q(voter__name__icontains=sub)
-                    median_q = median_q | Q(voter__name__icontains=sub)
-        else:
-            if query:
-                schulze_kwargs.update(voter__name__icontains=query)
-                median_kwargs.update(voter__name__icontains=query)
-    schulze_args, median_args = (), ()
-    if schulze_q is not None:
-        schulze_args += (schulze_q,)
-    if median_q is not None:
-        median_args += (median_q,)
-    schulze_votes = voting_models.SchulzeVote.objects.filter(*schulze_args, **schulze_kwargs)
-    median_votes = voting_models.MedianVote.objects.filter(*median_args, **median_kwargs)
-    for v in schulze_votes:
-        print(v)
-    for v in median_votes:
-        print(v)
-    print('Total:', len(schulze_votes) + len(median_votes))
@@ -16,12 +16,18 @@ from itertools import groupby
 
 from .results import *
 from .models import *
+from .quorum import voting_rule
 
 import schulze_voting as sv
 
 
-def schulze_for_evaluation(collection):
-    # TODO check revisions or is this not required?
+def schulze_for_evaluation(collection, voters=None):
+    # voters: if not None only the votes of these voters are fetched
+    # the revisions of the voters are checked by the database (see migration
+    # 0025_vote_constraints), complete rankings only on PostgreSQL, so their length is
+    # still checked here
+    # the checks of the votes are skipped if the votes of the collection have been
+    # verified, see integrity
     all_votings = schulze_votings(collection=collection)
     # now get all votes
     votes_qs = (
@@ -32,20 +38,26 @@ def schulze_for_evaluation(collection):
                 'option__voting__id',
                 'voter__id',
             'option__option_num'))
+    if voters is not None:
+        votes_qs = votes_qs.filter(voter__in=[voter.id for voter in voters])
     # now fill all_votings.votes with ordered dicts: for each voting
     # map to a list of lists of SchulzeVote objects and do some sanity checks
     # we do this in some places so probably we could write a nicer function
     # for this...
 
     # sanity checks are postponed until later to keep the code clearer
-    for voting, votes_for_voting in groupby(
-            votes_qs, lambda vote: vote.option.voting):
+    # group by the ids: the voting is not selected, accessing it would
+    # require a query for each vote
+    for voting_id, votes_for_voting in groupby(
+            votes_qs, lambda vote: vote.option.voting_id):
         voter_mapping = dict()
-        for voter, votes_for_voter in groupby(
-                votes_for_voting, lambda vote: vote.voter):
+        for voter_id, votes_for_voter in groupby(
+                votes_for_voting, lambda vote: vote.voter_id):
             votes_list = list(votes_for_voter)
-            voter_mapping[voter.id] = votes_list
-        all_votings.votes[voting.id] = voter_mapping
+            voter_mapping[voter_id] = votes_list
+        all_votings.votes[voting_id] = voter_mapping
+    if collection.votes_are_verified():
+        return all_votings
     # now for the sanity checks
     # we might need to remove votings if they're invalid
     votings_to_remove = set()
@@ -83,18 +95,9 @@ def schulze_for_evaluation(collection):
                 # remove entry for this voter
                 voters_to_remove.add(voter_id)
                 continue
-            for vote, option in zip(votes_for_voter, options):
-                if vote.option != option:
-                    msg = gettext(
-                        'Invalid vote for voting %(voting_name)s: Expected vote for %(expected_name)s and got vote for %(got_name)s' % {
-                            'voting_name': voting.name,
-                            'expected_name': option.option,
-                            'got_name': vote.option.name,
-                        })
-                    all_votings.warnings.append(QueryWarning(msg))
-                    # remove
-                    voters_to_remove.add(voter_id)
-                    continue
+            # the options of the votes don't have to be compared: the votes are sorted by
+            # option_num and there is at most one vote per voter and option, so a ranking
+            # of the right length contains each option exactly once
 
         # now remove all voters that had invalid votes
         for remove in voters_to_remove:
@@ -117,21 +120,27 @@ def schulze_for_evaluation(collection):
     return all_votings
 
 
-def single_schulze_instance(voting, votes, options, voters_map):
+def single_schulze_instance(voting, votes, options, voters):
     # TODO how to check if we have at least two options?
     # voting: SchulzeVoting instance, votes: map as computed in view
     # options: list of options for instance (map)
-    # voters_map: map voter_id to voter
+    # voters: cache.WeightedVoters of the revision, for an absolute majority
+    # its weight_sum is the total weight of all voters
+    # the majority is computed by the compiled rule of the voting
+    rule = voting_rule(voting)
     res = GenericVotingInstance()
+    res.rule = rule
     schulze_votes = []
     weight_sum = 0
-    absolute = voting.absolute_majority
+    # voters without a vote are counted as a vote for no
+    as_no = rule.abstentions_as_no
+    additional_weight = 0
     for voter_id, vote in votes.items():
-        weight = voters_map[voter_id].weight
+        weight = voters[voter_id].weight
         if vote is None:
-            if absolute:
+            if as_no:
+                additional_weight += weight
                 # make a vote for last option (No)
-                weight_sum += weight
                 n = len(options)
                 assert n
                 ranking = [2] * (n - 1)
@@ -148,6 +157,12 @@ def single_schulze_instance(voting, votes, options, voters_map):
             schulze_votes.append(v)
             res.votes[voter_id] = v
     res.instance = schulze_votes
+    if rule.absolute:
+        # all voters of the revision are considered, so the total weight is
+        # already known
+        weight_sum = voters.weight_sum
+    elif as_no:
+        weight_sum += additional_weight
     res.weight_sum = weight_sum
-    res.majority = compute_majority(voting.majority, weight_sum)
+    res.majority = rule.required(weight_sum)
     return res
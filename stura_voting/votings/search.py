@@ -0,0 +1,213 @@
+# Copyright 2018 - 2019 Fabian Wenzelmann
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Search for voters and their votes over all sessions.
+
+Voter names are searched through an index (created in migration 0014):
+On PostgreSQL a trigram index on UPPER(name) is used, this index is used by Django's
+icontains lookup. On SQLite a FTS5 table with the trigram tokenizer (kept up to date by
+triggers) is used. Queries shorter than three characters can't use a trigram index, in
+this case (and for other databases) a plain icontains filter is used.
+
+"""
+
+from collections import OrderedDict
+from heapq import merge
+
+from django.db import connection, transaction, DatabaseError
+from django.db.models import Q
+
+from . import models as voting_models
+from .results import median_vote_str, schulze_vote_str
+
+
+# length of the shortest query that can be looked up in a trigram index
+MIN_INDEX_QUERY_LENGTH = 3
+
+SQLITE_FTS_TABLE = 'votings_voter_fts'
+
+
+def split_query(query, split=False):
+    """Returns the terms to search for.
+
+    Args:
+        query (str): The query string.
+        split (bool): If true the query is split into words, each word is a term.
+
+    Returns:
+        list of str: The (non empty) terms.
+    """
+    if split:
+        terms = query.split(' ')
+    else:
+        terms = [query]
+    terms = map(lambda s: s.strip(), terms)
+    return list(filter(lambda s: s, terms))
+
+
+def _sqlite_fts_ids(terms):
+    # returns the ids of all voters containing one of the terms or None if the fts
+    # table is not available
+    match = ' OR '.join('"%s"' % term.replace('"', '""') for term in terms)
+    sql = 'SELECT rowid FROM %s WHERE %s MATCH %%s' % (SQLITE_FTS_TABLE, SQLITE_FTS_TABLE)
+    try:
+        # savepoint: an error must not break an outer transaction
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [match])
+                return [row[0] for row in cursor.fetchall()]
+    except DatabaseError:
+        return None
+
+
+def search_voters(query, split=False):
+    """Returns all voters (from all revisions) whose name contains the query.
+
+    Case is ignored. If split is true the query is split into words and a voter must
+    contain at least one of the words.
+
+    Args:
+        query (str): The query string.
+        split (bool): If true search for each word in query.
+
+    Returns:
+        queryset: All models.Voter matching the query.
+    """
+    terms = split_query(query, split)
+    if not terms:
+        return voting_models.Voter.objects.none()
+    use_index = all(len(term) >= MIN_INDEX_QUERY_LENGTH for term in terms)
+    if use_index and connection.vendor == 'sqlite':
+        ids = _sqlite_fts_ids(terms)
+        if ids is not None:
+            return voting_models.Voter.objects.filter(id__in=ids)
+    # on PostgreSQL this uses the trigram index
+    q = Q()
+    for term in terms:
+        q = q | Q(name__icontains=term)
+    return voting_models.Voter.objects.filter(q)
+
+
+def search_sessions(voters, period=None, start=None, end=None):
+    """Returns all sessions in which at least one of the voters was entitled to vote.
+
+    Args:
+        voters (queryset): The voters, for example from search_voters.
+        period (models.Period or None): If given only sessions in this period are returned.
+        start (datetime.date or None): If given only sessions on or after this day are returned.
+        end (datetime.date or None): If given only sessions on or before this day are returned.
+
+    Returns:
+        queryset: The models.VotingCollection objects, newest first.
+    """
+    sessions = voting_models.VotingCollection.objects.filter(
+        revision__in=voters.values('revision'))
+    if period is not None:
+        sessions = sessions.filter(revision__period=period)
+    if start is not None:
+        sessions = sessions.filter(time__date__gte=start)
+    if end is not None:
+        sessions = sessions.filter(time__date__lte=end)
+    return sessions.select_related('revision__period').order_by('-time', '-id')
+
+
+class SessionParticipation(object):
+    """The votes of some voters in a session.
+
+    Attributes:
+        collection (models.VotingCollection): The session.
+        votings (list): All median and schulze votings of the session, sorted.
+        rows (list of (models.Voter, list of str)): For each voter the formatted vote
+            for each voting ('/' if the voter didn't vote).
+
+    """
+    def __init__(self, collection):
+        self.collection = collection
+        self.votings = []
+        self.rows = []
+
+
+def participation(sessions, voters):
+    """Returns the votes of the voters in the given sessions.
+
+    All sessions are handled with a fixed number of queries, so sessions should be only
+    one page of the search_sessions result.
+
+    Args:
+        sessions (iterable of models.VotingCollection): The sessions.
+        voters (queryset): The voters, for example from search_voters.
+
+    Returns:
+        list of SessionParticipation: One entry for each session (in the same order).
+    """
+    sessions = list(sessions)
+    if not sessions:
+        return []
+    session_ids = [session.id for session in sessions]
+    res = OrderedDict((session.id, SessionParticipation(session)) for session in sessions)
+    # all voters that might appear in these sessions
+    revision_ids = set(session.revision_id for session in sessions)
+    voters = list(voters.filter(revision__in=revision_ids).order_by('name'))
+    voter_ids = [voter.id for voter in voters]
+
+    def key(v):
+        return v.group.group_num, v.voting_num
+
+    median_qs = (voting_models.MedianVoting.objects
+                 .filter(group__collection__in=session_ids)
+                 .select_related('group')
+                 .order_by('group__group_num', 'voting_num'))
+    schulze_qs = (voting_models.SchulzeVoting.objects
+                  .filter(group__collection__in=session_ids)
+                  .select_related('group')
+                  .order_by('group__group_num', 'voting_num'))
+    median_by_session, schulze_by_session = dict(), dict()
+    for v in median_qs:
+        median_by_session.setdefault(v.group.collection_id, []).append(v)
+    for v in schulze_qs:
+        schulze_by_session.setdefault(v.group.collection_id, []).append(v)
+    for session_id, entry in res.items():
+        entry.votings = list(merge(median_by_session.get(session_id, []),
+                                   schulze_by_session.get(session_id, []),
+                                   key=key))
+
+    # votes: map (voter_id, voting key) to the formatted vote
+    votes = dict()
+    median_votes = (voting_models.MedianVote.objects
+                    .filter(voter__in=voter_ids, voting__group__collection__in=session_ids)
+                    .select_related('voting'))
+    for vote in median_votes:
+        votes[(vote.voter_id, 'median', vote.voting_id)] = median_vote_str(vote, vote.voting)
+    schulze_votes = (voting_models.SchulzeVote.objects
+                     .filter(voter__in=voter_ids,
+                             option__voting__group__collection__in=session_ids)
+                     .select_related('option')
+                     .order_by('voter__id', 'option__voting__id', 'option__option_num'))
+    schulze_lists = dict()
+    for vote in schulze_votes:
+        schulze_lists.setdefault((vote.voter_id, 'schulze', vote.option.voting_id), []).append(vote)
+    for k, vote_list in schulze_lists.items():
+        votes[k] = schulze_vote_str(vote_list)
+
+    for entry in res.values():
+        for voter in voters:
+            if voter.revision_id != entry.collection.revision_id:
+                continue
+            cells = []
+            for v in entry.votings:
+                v_type = 'median' if isinstance(v, voting_models.MedianVoting) else 'schulze'
+                cells.append(votes.get((voter.id, v_type, v.id), '/'))
+            entry.rows.append((voter, cells))
+    return list(res.values())
+
@@ -0,0 +1,275 @@
+# Copyright 2018 - 2019 Fabian Wenzelmann
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Signal handlers that invalidate the caches from the cache module, refresh the
+vote history from the history module, update the change timestamps of the sessions
+from the changes module and delete the outdated ballot sheets from the printing module.
+
+All invalidations are executed after the current transaction has been committed,
+otherwise another process could cache the old state again before the commit.
+
+The handlers are connected in VotingsConfig.ready.
+
+"""
+
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from . import cache
+from . import history
+from . import changes
+from . import printing
+from .models import *
+
+
+def _collection_id(instance):
+    # returns the id of the collection a group, voting or option belongs to
+    # None if it can't be found (for example if the collection is deleted
+    # in a cascade, in this case the collection itself invalidates the cache)
+    try:
+        if isinstance(instance, VotingGroup):
+            return instance.collection_id
+        elif isinstance(instance, (MedianVoting, SchulzeVoting)):
+            return instance.group.collection_id
+        elif isinstance(instance, SchulzeOption):
+            return instance.voting.group.collection_id
+    except ObjectDoesNotExist:
+        pass
+    return None
+
+
+@receiver(post_save, sender=Period)
+@receiver(post_delete, sender=Period)
+@receiver(post_save, sender=VotersRevision)
+@receiver(post_delete, sender=VotersRevision)
+@receiver(post_save, sender=PeriodSnapshot)
+@receiver(post_delete, sender=PeriodSnapshot)
+def archive_changed(sender, instance, **kwargs):
+    transaction.on_commit(cache.invalidate_archive)
+
+
+@receiver(post_save, sender=FrozenResults)
+@receiver(post_delete, sender=FrozenResults)
+def frozen_results_changed(sender, instance, **kwargs):
+    collection_id = instance.collection_id
+    transaction.on_commit(lambda: cache.invalidate_collection(collection_id))
+
+
+@receiver(post_save, sender=QuorumRule)
+@receiver(post_delete, sender=QuorumRule)
+def quorum_rule_changed(sender, instance, **kwargs):
+    transaction.on_commit(cache.invalidate_quorum_rules)
+    # new rules are not used yet and used rules can't be deleted
+    if kwargs.get('created', True):
+        return
+    for voting_id in MedianVoting.objects.filter(quorum=instance).values_list('id', flat=True):
+        history.schedule_refresh(history.MEDIAN, voting_id)
+    for voting_id in SchulzeVoting.objects.filter(quorum=instance).values_list('id', flat=True):
+        history.schedule_refresh(history.SCHULZE, voting_id)
+    changes.schedule_touch(changes.MEDIAN_QUORUM, instance.id)
+    changes.schedule_touch(changes.SCHULZE_QUORUM, instance.id)
+
+
+@receiver(post_save, sender=VotingCollection)
+@receiver(post_delete, sender=VotingCollection)
+def collection_changed(sender, instance, **kwargs):
+    collection_id = instance.id
+    transaction.on_commit(cache.invalidate_archive)
+    transaction.on_commit(lambda: cache.invalidate_collection(collection_id))
+
+
+@receiver(post_save, sender=VotingGroup)
+@receiver(post_delete, sender=VotingGroup)
+@receiver(post_save, sender=MedianVoting)
+@receiver(post_delete, sender=MedianVoting)
+@receiver(post_save, sender=SchulzeVoting)
+@receiver(post_delete, sender=SchulzeVoting)
+@receiver(post_save, sender=SchulzeOption)
+@receiver(post_delete, sender=SchulzeOption)
+def collection_content_changed(sender, instance, **kwargs):
+    collection_id = _collection_id(instance)
+    if collection_id is not None:
+        transaction.on_commit(
+            lambda: cache.invalidate_collection(collection_id))
+
+
+@receiver(post_save, sender=Voter)
+@receiver(post_delete, sender=Voter)
+def voter_changed(sender, instance, **kwargs):
+    revision_id = instance.revision_id
+    transaction.on_commit(
+        lambda: cache.invalidate_revision_voters(revision_id))
+
+
+@receiver(post_save, sender=MedianVote)
+@receiver(post_delete, sender=MedianVote)
+def median_vote_changed(sender, instance, **kwargs):
+    voting_id = instance.voting_id
+    transaction.on_commit(lambda: cache.invalidate_median_votes(voting_id))
+
+
+@receiver(post_save, sender=SchulzeVote)
+@receiver(post_delete, sender=SchulzeVote)
+def schulze_vote_changed(sender, instance, **kwargs):
+    try:
+        voting_id = instance.option.voting_id
+    except ObjectDoesNotExist:
+        # option deleted in a cascade, invalidated by collection_content_changed
+        return
+    transaction.on_commit(lambda: cache.invalidate_schulze_votes(voting_id))
+
+
+# vote history and statistics: the history of a voting depends on its votes, the
+# voting itself and the voters (name and weight), the collection and revision
+
+
+@receiver(post_save, sender=VotersRevision)
+@receiver(post_save, sender=Voter)
+@receiver(post_delete, sender=Voter)
+def history_voters_changed(sender, instance, **kwargs):
+    revision_id = instance.id if isinstance(instance, VotersRevision) else instance.revision_id
+    history.schedule_refresh(history.REVISION, revision_id)
+
+
+@receiver(post_save, sender=VotingCollection)
+def history_collection_changed(sender, instance, **kwargs):
+    history.schedule_refresh(history.COLLECTION, instance.id)
+
+
+@receiver(post_save, sender=VotingGroup)
+def history_group_changed(sender, instance, **kwargs):
+    history.schedule_refresh(history.COLLECTION, instance.collection_id)
+
+
+@receiver(post_delete, sender=VotersRevision)
+@receiver(post_delete, sender=VotingCollection)
+@receiver(post_delete, sender=MedianVoting)
+@receiver(post_delete, sender=SchulzeVoting)
+def history_voting_deleted(sender, instance, **kwargs):
+    # the entries are deleted in the cascade, but the participation in the period
+    # changes
+    try:
+        if isinstance(instance, VotersRevision):
+            period_id = instance.period_id
+        elif isinstance(instance, VotingCollection):
+            period_id = instance.revision.period_id
+        else:
+            period_id = instance.group.collection.revision.period_id
+    except ObjectDoesNotExist:
+        # deleted in a cascade, handled by the deletion of the parent
+        return
+    history.schedule_refresh(history.PERIOD, period_id)
+
+
+@receiver(post_save, sender=MedianVoting)
+def history_median_voting_changed(sender, instance, **kwargs):
+    history.schedule_refresh(history.MEDIAN, instance.id)
+
+
+@receiver(post_save, sender=SchulzeVoting)
+def history_schulze_voting_changed(sender, instance, **kwargs):
+    history.schedule_refresh(history.SCHULZE, instance.id)
+
+
+@receiver(post_save, sender=SchulzeOption)
+@receiver(post_delete, sender=SchulzeOption)
+def history_option_changed(sender, instance, **kwargs):
+    history.schedule_refresh(history.SCHULZE, instance.voting_id)
+
+
+@receiver(post_save, sender=MedianVote)
+@receiver(post_delete, sender=MedianVote)
+def history_median_vote_changed(sender, instance, **kwargs):
+    history.schedule_refresh(history.MEDIAN_VOTE, (instance.voting_id, instance.voter_id))
+
+
+@receiver(post_save, sender=SchulzeVote)
+@receiver(post_delete, sender=SchulzeVote)
+def history_schulze_vote_changed(sender, instance, **kwargs):
+    try:
+        voting_id = instance.option.voting_id
+    except ObjectDoesNotExist:
+        # option deleted in a cascade, refreshed by history_option_changed
+        return
+    history.schedule_refresh(history.SCHULZE_VOTE, (voting_id, instance.voter_id))
+
+
+# change timestamps of the sessions
+
+
+@receiver(post_save, sender=VotersRevision)
+@receiver(post_save, sender=Voter)
+@receiver(post_delete, sender=Voter)
+def changes_voters_changed(sender, instance, **kwargs):
+    revision_id = instance.id if isinstance(instance, VotersRevision) else instance.revision_id
+    changes.schedule_touch(changes.REVISION, revision_id)
+
+
+@receiver(post_save, sender=FrozenResults)
+@receiver(post_delete, sender=FrozenResults)
+@receiver(post_save, sender=VotingGroup)
+@receiver(post_delete, sender=VotingGroup)
+def changes_collection_changed(sender, instance, **kwargs):
+    # VotingCollection.modified is set by the save of the collection itself
+    changes.schedule_touch(changes.COLLECTION, instance.collection_id)
+
+
+@receiver(post_save, sender=MedianVoting)
+@receiver(post_delete, sender=MedianVoting)
+@receiver(post_save, sender=SchulzeVoting)
+@receiver(post_delete, sender=SchulzeVoting)
+def changes_voting_changed(sender, instance, **kwargs):
+    # on delete the voting doesn't exist any more, use the group
+    changes.schedule_touch(changes.GROUP, instance.group_id)
+
+
+@receiver(post_save, sender=SchulzeOption)
+@receiver(post_delete, sender=SchulzeOption)
+def changes_option_changed(sender, instance, **kwargs):
+    changes.schedule_touch(changes.SCHULZE, instance.voting_id)
+
+
+@receiver(post_save, sender=MedianVote)
+@receiver(post_delete, sender=MedianVote)
+def changes_median_vote_changed(sender, instance, **kwargs):
+    changes.schedule_touch(changes.MEDIAN, instance.voting_id)
+
+
+@receiver(post_save, sender=SchulzeVote)
+@receiver(post_delete, sender=SchulzeVote)
+def changes_schulze_vote_changed(sender, instance, **kwargs):
+    changes.schedule_touch(changes.SCHULZE_OPTION, instance.option_id)
+
+
+# ballot sheets
+
+
+@receiver(post_save, sender=VotingCollection)
+@receiver(post_save, sender=VotingGroup)
+@receiver(post_delete, sender=VotingGroup)
+@receiver(post_save, sender=MedianVoting)
+@receiver(post_delete, sender=MedianVoting)
+@receiver(post_save, sender=SchulzeVoting)
+@receiver(post_delete, sender=SchulzeVoting)
+@receiver(post_save, sender=SchulzeOption)
+@receiver(post_delete, sender=SchulzeOption)
+def print_changed(sender, instance, **kwargs):
+    if isinstance(instance, VotingCollection):
+        collection_id = instance.id
+    else:
+        collection_id = _collection_id(instance)
+    if collection_id is not None:
+        transaction.on_commit(lambda: printing.invalidate_print(collection_id))
@@ -0,0 +1,228 @@
+# Copyright 2018 - 2019 Fabian Wenzelmann
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Rollup tables for the period statistics.
+
+models.VotingStatistics contains one row for each voting and is written by the history
+module whenever a whole voting is refreshed (the voting is evaluated there anyway). If
+only votes changed the number of votes is adjusted and the row is marked as outdated,
+the remaining fields are computed when the statistics are read. models.VoterPeriodStatistics contains the participation of each voter in a
+period and is recomputed for all periods affected by a refresh of a whole voting. If
+only votes changed the number of votes is adjusted instead. The rows of archived
+periods are kept and never recomputed.
+The dashboard only reads these tables.
+
+"""
+
+from collections import defaultdict
+
+from django.db.models import Count, F
+
+from .models import *
+
+
+# upper bounds (in percent) of the margin classes shown in the dashboard
+MARGIN_CLASSES = (10, 25, 50, 100)
+
+
+def median_voting_statistics(voting, collection, counted, instance, result):
+    """Returns the statistics for an evaluated median voting.
+
+    Args:
+        voting (models.MedianVoting): The voting.
+        collection (models.VotingCollection): The collection of the voting.
+        counted (list of models.MedianVote): All counted votes.
+        instance (results.GenericVotingInstance): The evaluation instance, None if there
+            are no votes.
+        result (int or None): The value that got a majority.
+
+    Returns:
+        models.VotingStatistics: The (unsaved) statistics.
+    """
+    return VotingStatistics(
+        period_id=collection.revision.period_id,
+        collection=collection,
+        median_voting=voting,
+        num_votes=len(counted),
+        votes_weight=0 if instance is None else instance.weight_sum,
+        requested=voting.value,
+        approved=result)
+
+
+def schulze_margin(s_res):
+    # difference between the votes preferring the winner over the best other option
+    # and the votes preferring that option over the winner
+    wins = s_res.candidate_wins
+    if len(wins[0]) > 1:
+        # tie
+        return 0
+    if len(wins) < 2:
+        return None
+    winner, second = wins[0][0], wins[1][0]
+    return s_res.d[winner][second] - s_res.d[second][winner]
+
+
+def schulze_voting_statistics(voting, collection, counted, instance, s_res, num_options):
+    """Returns the statistics for an evaluated schulze voting.
+
+    Args:
+        voting (models.SchulzeVoting): The voting.
+        collection (models.VotingCollection): The collection of the voting.
+        counted (list): All counted votes.
+        instance (results.GenericVotingInstance): The evaluation instance, None if there
+            are no votes.
+        s_res (schulze_voting.SchulzeRes): The result, None if there are no votes.
+        num_options (int): The number of options.
+
+    Returns:
+        models.VotingStatistics: The (unsaved) statistics.
+    """
+    return VotingStatistics(
+        period_id=collection.revision.period_id,
+        collection=collection,
+        schulze_voting=voting,
+        num_votes=len(counted),
+        votes_weight=0 if instance is None else instance.weight_sum,
+        num_options=num_options,
+        margin=None if s_res is None else schulze_margin(s_res))
+
+
+def refresh_participation(period_ids):
+    """Recomputes the participation of all voters in the given periods.
+
+    Archived periods are skipped, their voters and votings don't exist anymore and
+    the participation is kept as it was when the period was archived.
+
+    Args:
+        period_ids (iterable of int): The ids of the periods.
+    """
+    archived = set(PeriodSnapshot.objects
+                   .filter(period__in=period_ids)
+                   .values_list('period', flat=True))
+    for period_id in period_ids:
+        if period_id not in archived:
+            _refresh_period_participation(period_id)
+
+
+def adjust_participation(period_id, deltas):
+    """Adjusts the number of votes in the participation of a period.
+
+    Used if only votes have changed, the votings a voter is entitled to vote in stay
+    the same then.
+
+    Args:
+        period_id (int): The id of the period.
+        deltas (dict str to int): Maps the name of a voter to the number of votes that
+            were added (negative if votes were removed).
+    """
+    for name, delta in deltas.items():
+        if delta:
+            (VoterPeriodStatistics.objects
+             .filter(period=period_id, voter_name=name)
+             .update(votes=F('votes') + delta))
+
+
+def _refresh_period_participation(period_id):
+    VoterPeriodStatistics.objects.filter(period=period_id).delete()
+    # number of votings in each revision of the period
+    votings = defaultdict(int)
+    collections = (VotingCollection.objects
+                   .filter(revision__period=period_id)
+                   .values_list('id', 'revision_id'))
+    revision_of = dict(collections)
+    for kind in (MedianVoting, SchulzeVoting):
+        counts = (kind.objects
+                  .filter(group__collection__in=revision_of.keys())
+                  .values('group__collection')
+                  .annotate(num=Count('id'))
+                  .values_list('group__collection', 'num'))
+        for collection_id, num in counts:
+            votings[revision_of[collection_id]] += num
+    entitled = defaultdict(int)
+    voters = (Voter.objects
+              .filter(revision__in=set(revision_of.values()))
+              .values_list('revision_id', 'name'))
+    for revision_id, name in voters:
+        entitled[name] += votings[revision_id]
+    votes = dict(VoteHistoryEntry.objects
+                 .filter(period=period_id)
+                 .values('voter_name')
+                 .annotate(num=Count('id'))
+                 .values_list('voter_name', 'num'))
+    VoterPeriodStatistics.objects.bulk_create(
+        VoterPeriodStatistics(period_id=period_id, voter_name=name, votings=num,
+                              votes=votes.get(name, 0))
+        for name, num in entitled.items())
+
+
+class PeriodStatistics(object):
+    """The statistics of a period as shown in the dashboard, computed from the rollups.
+
+    Attributes:
+        period (models.Period): The period.
+        participation (list of (str, int, int, float)): For each voter the name, the number
+            of votings the voter was entitled to vote in, the number of votes and the
+            participation in percent.
+        num_median (int): Number of median votings.
+        requested (int): Sum of the values of all median votings.
+        approved (int): Sum of the approved values of all median votings.
+        approved_percent (float): approved in percent of requested.
+        num_approved (int): Number of median votings with an approved value > 0.
+        num_schulze (int): Number of schulze votings.
+        margins (list of (str, int)): The number of schulze votings for each margin class
+            (the margin in percent of the votes).
+
+    """
+    def __init__(self, period):
+        self.period = period
+        self.participation = []
+        for entry in (VoterPeriodStatistics.objects
+                      .filter(period=period)
+                      .order_by('voter_name')):
+            percent = 0.0
+            if entry.votings:
+                percent = entry.votes / entry.votings * 100
+            self.participation.append((entry.voter_name, entry.votings, entry.votes, percent))
+        self.num_median, self.requested, self.approved = 0, 0, 0
+        self.num_approved = 0
+        self.num_schulze = 0
+        margin_counts = [0] * len(MARGIN_CLASSES)
+        no_margin = 0
+        for entry in VotingStatistics.objects.filter(period=period):
+            # the voting is None in archived periods
+            if entry.requested is not None:
+                self.num_median += 1
+                self.requested += entry.requested
+                if entry.approved:
+                    self.approved += entry.approved
+                    self.num_approved += 1
+            else:
+                self.num_schulze += 1
+                if entry.margin is None or not entry.votes_weight:
+                    no_margin += 1
+                    continue
+                percent = abs(entry.margin) / entry.votes_weight * 100
+                for i, bound in enumerate(MARGIN_CLASSES):
+                    if percent < bound or i == len(MARGIN_CLASSES) - 1:
+                        margin_counts[i] += 1
+                        break
+        self.approved_percent = 0.0
+        if self.requested:
+            self.approved_percent = self.approved / self.requested * 100
+        self.margins = []
+        lower = 0
+        for bound, count in zip(MARGIN_CLASSES, margin_counts):
+            self.margins.append(('%d - %d%%' % (lower, bound), count))
+            lower = bound
+        self.margins.append(('Keine Stimmen', no_margin))
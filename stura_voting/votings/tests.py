@@ -12,6 +12,825 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from django.test import TestCase
+import datetime
+import fractions
+import random
+import unittest
 
-# Create your tests here.
+from stura_voting_utils import parser as utils_parser
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, SimpleTestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .ballotlog import BallotChanges, event_changes, log_ballot
+from .evaluation import (close_collection, get_frozen_results, reopen_collection,
+                         session_results_context, SessionClosedError)
+from .forms import SchulzeVotingCreateForm
+from .fraction import Fraction
+from .majority import CompiledRule, legacy_rule, parse_majority, required_votes
+from . import cache as voting_cache
+from . import coldstorage
+from . import history
+from . import integrity
+from . import paging
+from . import quorum
+from . import parser
+from . import replay
+from .management.commands.benchmark_parser import voters_input, collection_input
+from .history import voter_history
+from .models import *
+from .stats import PeriodStatistics
+from .utils import compute_majority
+
+
+class MajorityTest(SimpleTestCase):
+    # the integer computation must agree with fractions.Fraction for random
+    # majorities and weight sums
+
+    def test_random_majorities(self):
+        rnd = random.Random(42)
+        for _ in range(5000):
+            denominator = rnd.randint(1, 1000)
+            numerator = rnd.randint(0, denominator)
+            weight_sum = rnd.randint(0, 10 ** 6)
+            expected = (fractions.Fraction(numerator, denominator) * weight_sum).__floor__()
+            self.assertEqual(required_votes((numerator, denominator), weight_sum), expected)
+            self.assertEqual(
+                required_votes('%d/%d' % (numerator, denominator), weight_sum), expected)
+            self.assertEqual(
+                compute_majority(Fraction(numerator, denominator), weight_sum), expected)
+
+    def test_random_percentages(self):
+        rnd = random.Random(23)
+        for _ in range(1000):
+            percent = rnd.randint(0, 100)
+            weight_sum = rnd.randint(0, 10 ** 4)
+            expected = (fractions.Fraction(percent, 100) * weight_sum).__floor__()
+            self.assertEqual(required_votes('%d%%' % percent, weight_sum), expected)
+            self.assertEqual(required_votes(str(percent), weight_sum), expected)
+
+    def test_model_majorities(self):
+        self.assertEqual(compute_majority(FIFTY_MAJORITY, 51), 25)
+        self.assertEqual(compute_majority(FIFTY_MAJORITY, 50), 25)
+        self.assertEqual(compute_majority(TWO_THIRDS_MAJORITY, 30), 20)
+        self.assertEqual(compute_majority(TWO_THIRDS_MAJORITY, 31), 20)
+        self.assertEqual(parse_majority(fractions.Fraction(4, 6)), (2, 3))
+
+    def test_invalid_majorities(self):
+        for majority in ('', 'foo', '3/2', '1/0', '-1/2', '101', (1, 0), (3, 2), 0.5):
+            with self.assertRaises(ValueError):
+                required_votes(majority, 10)
+
+
+def _collection_tuple(collection):
+    return (collection.name,
+            [(group.name,
+              [(v.name, v.value, v.currency, v.id) for v in group.median_votings],
+              [(v.name, v.options, v.id) for v in group.schulze_votings])
+             for group in collection.groups])
+
+
+class ParserTest(SimpleTestCase):
+    # the parser must return the same results as stura_voting_utils for valid
+    # inputs and report all errors for invalid inputs
+
+    def test_voters(self):
+        text = voters_input(500)
+        expected = [(voter.name, voter.weight)
+                    for voter in utils_parser.parse_voters(text.split('\n'))]
+        self.assertEqual([(voter.name, voter.weight) for voter in parser.parse_voters(text)],
+                         expected)
+
+    def test_collection(self):
+        text = collection_input(500)
+        expected = utils_parser.parse_voting_collection(text.split('\n'))
+        self.assertEqual(_collection_tuple(parser.parse_voting_collection(text)),
+                         _collection_tuple(expected))
+
+    def test_all_errors(self):
+        text = '\n'.join(['# Sitzung', '## G', '### A', '### B', '- 12,5', '* x', '## H',
+                          '## I', '### S', '* only', 'foo'])
+        with self.assertRaises(parser.ParseErrors) as ctx:
+            parser.parse_voting_collection(text)
+        self.assertEqual([line_num for line_num, _ in ctx.exception.errors], [3, 6, 7, 9, 11])
+        with self.assertRaises(parser.ParseErrors) as ctx:
+            parser.parse_voters('* a: 1\n* a: 2\nb 3\n# comment\n')
+        self.assertEqual([line_num for line_num, _ in ctx.exception.errors], [2, 3])
+
+    def test_max_errors(self):
+        with self.assertRaises(parser.ParseErrors) as ctx:
+            parser.parse_voters(voters_input(1000, 1))
+        self.assertEqual(len(ctx.exception.errors), parser.MAX_ERRORS)
+        self.assertEqual(ctx.exception.num_errors, 1000)
+
+
+class ReplayTest(SimpleTestCase):
+    # replaying the changes of events, without the database
+
+    def test_apply(self):
+        state = replay.ReplayedBallots(1)
+        state.apply(1, 10, [['median', 1, None, 500], ['schulze', 2, None, [1, 0]]])
+        state.apply(2, 10, [['median', 1, 500, 250], ['schulze', 2, [1, 0], None]])
+        state.apply(3, 11, [['median', 1, None, 100]])
+        state.apply(4, 11, [['median', 1, 100, None]])
+        self.assertEqual(state.ballots, {10: {('median', 1): 250}})
+        self.assertEqual(state.events, 4)
+        self.assertEqual(state.conflicts, [])
+        # the vote was changed without an event
+        state.apply(5, 10, [['median', 1, 300, 400]])
+        self.assertEqual(state.conflicts,
+                         [replay.Conflict(5, 1, 10, 'median', 1, 300, 250)])
+
+    def test_compare(self):
+        log, live = replay.ReplayedBallots(1), replay.ReplayedBallots(1)
+        log.apply(1, 10, [['median', 1, None, 500], ['schulze', 2, None, [1, 0]]])
+        live.apply(None, 10, [['median', 1, None, 500], ['schulze', 2, None, [0, 1]]])
+        live.apply(None, 11, [['median', 1, None, 100]])
+        self.assertEqual(live.events, 0)
+        self.assertEqual(log.compare(live), [
+            replay.Difference(1, 10, 'schulze', 2, [1, 0], [0, 1]),
+            replay.Difference(1, 11, 'median', 1, None, 100),
+        ])
+
+    def test_drop_deleted(self):
+        log, live = replay.ReplayedBallots(1), replay.ReplayedBallots(1)
+        log.apply(1, 10, [['median', 1, None, 500], ['schulze', 2, None, [1, 0]]])
+        log.apply(2, 11, [['median', 3, None, 100], ['schulze', 4, None, [0, 1]]])
+        live.apply(None, 10, [['median', 1, None, 500], ['schulze', 2, None, [1]]])
+        # median voting 3 has been deleted, an option of schulze voting 2 as well
+        removed = log.drop_deleted({1}, {2: 1, 4: 2}, live)
+        self.assertEqual(removed, [
+            replay.Difference(1, 10, 'schulze', 2, [1, 0], [1]),
+            replay.Difference(1, 11, 'median', 3, 100, None),
+        ])
+        self.assertEqual(log.ballots, {10: {('median', 1): 500}, 11: {('schulze', 4): [0, 1]}})
+        self.assertEqual(log.compare(live), [
+            replay.Difference(1, 11, 'schulze', 4, [0, 1], None),
+        ])
+
+
+class ReplayRebuildTest(TestCase):
+    # rebuilding a session from the log skips the ballots the database rejects
+
+    def setUp(self):
+        period = Period.objects.create(name='2019')
+        revision = VotersRevision.objects.create(period=period)
+        self.alice = Voter.objects.create(name='Alice', weight=2, revision=revision)
+        self.bob = Voter.objects.create(name='Bob', weight=3, revision=revision)
+        self.collection = VotingCollection.objects.create(
+            name='Sitzung', time=timezone.now(), revision=revision)
+        group = VotingGroup.objects.create(
+            name='Finanzen', collection=self.collection, group_num=0)
+        self.voting = MedianVoting.objects.create(
+            name='Antrag', value=2000, group=group, voting_num=0)
+
+    def test_rejected_ballot(self):
+        # only logged, the votes are missing
+        for voter, value in ((self.alice, 1500), (self.bob, 500)):
+            changes = BallotChanges()
+            changes.median(self.voting.id, None, value)
+            log_ballot(self.collection, voter, None, changes)
+        self.voting.value = 1000
+        self.voting.save()
+        report, = replay.rebuild([self.collection.id])
+        self.assertTrue(report.rebuilt)
+        self.assertEqual([(diff.voter_id, diff.log) for diff, _ in report.rejected],
+                         [(self.alice.id, 1500)])
+        self.assertEqual(list(MedianVote.objects.values_list('voter', 'value')),
+                         [(self.bob.id, 500)])
+
+
+class ArchiveTest(TransactionTestCase):
+    # the history and statistics must survive archiving a period, the refreshes run
+    # after the commit, so a TransactionTestCase is required
+
+    def setUp(self):
+        self.period = Period.objects.create(name='2019')
+        revision = VotersRevision.objects.create(period=self.period)
+        voter = Voter.objects.create(name='Alice', weight=2, revision=revision)
+        collection = VotingCollection.objects.create(
+            name='Sitzung', time=timezone.now(), revision=revision)
+        group = VotingGroup.objects.create(name='Finanzen', collection=collection, group_num=0)
+        voting = MedianVoting.objects.create(name='Antrag', value=1000, group=group, voting_num=0)
+        MedianVote.objects.create(value=500, voter=voter, voting=voting)
+
+    def _state(self):
+        history.refresh_outdated(period=self.period)
+        history_rows = list(VoteHistoryEntry.objects
+                            .filter(period=self.period)
+                            .values_list('voter_name', 'collection_name', 'voting_type',
+                                         'voting_name', 'vote', 'outcome'))
+        statistics = list(VotingStatistics.objects
+                          .filter(period=self.period)
+                          .values_list('num_votes', 'votes_weight', 'requested', 'approved'))
+        participation = list(VoterPeriodStatistics.objects
+                             .filter(period=self.period)
+                             .values_list('voter_name', 'votings', 'votes'))
+        return history_rows, statistics, participation
+
+    def test_archive_keeps_history(self):
+        before = self._state()
+        self.assertEqual([len(rows) for rows in before], [1, 1, 1])
+        coldstorage.archive_period(self.period)
+        self.assertFalse(VotersRevision.objects.filter(period=self.period).exists())
+        self.assertEqual(self._state(), before)
+        statistics = PeriodStatistics(self.period)
+        self.assertEqual(statistics.num_median, 1)
+        self.assertEqual(statistics.participation, [('Alice', 1, 1, 100.0)])
+        self.assertEqual(len(voter_history('Alice', self.period)), 1)
+        # restoring computes the history again instead of adding it twice
+        coldstorage.restore_period(self.period)
+        self.assertEqual(self._state(), before)
+
+    def test_archive_keeps_ballot_log(self):
+        collection = VotingCollection.objects.get(revision__period=self.period)
+        voter = Voter.objects.get(revision__period=self.period)
+        voting = MedianVoting.objects.get(group__collection=collection)
+        changes = BallotChanges()
+        changes.median(voting.id, None, 500)
+        log_ballot(collection, voter, None, changes)
+        # a deleted voter is kept in the log
+        bob = Voter.objects.create(name='Bob', weight=1, revision=voter.revision)
+        changes = BallotChanges()
+        changes.median(voting.id, None, 100)
+        log_ballot(collection.id, bob.id, None, changes)
+        bob.delete()
+        self.assertEqual(list(BallotEvent.objects
+                              .filter(collection=collection)
+                              .values_list('voter', 'voter_name')),
+                         [(voter.id, 'Alice'), (None, 'Bob')])
+        coldstorage.archive_period(self.period)
+        self.assertFalse(BallotEvent.objects.exists())
+        coldstorage.restore_period(self.period)
+        collection = VotingCollection.objects.get(revision__period=self.period)
+        voter = Voter.objects.get(revision__period=self.period)
+        voting = MedianVoting.objects.get(group__collection=collection)
+        events = list(BallotEvent.objects.order_by('id'))
+        self.assertEqual([(event.collection_id, event.collection_ref, event.voter_id,
+                           event.voter_name, event_changes(event)) for event in events],
+                         [(collection.id, collection.id, voter.id, 'Alice',
+                           [['median', voting.id, None, 500]]),
+                          (collection.id, collection.id, None, 'Bob',
+                           [['median', voting.id, None, 100]])])
+        # the restored log matches the votes
+        report = next(replay.check([collection.id]))
+        self.assertTrue(report.ok())
+
+    def test_restore_keeps_closed_sessions(self):
+        collection = VotingCollection.objects.get(revision__period=self.period)
+        close_collection(collection)
+        results = session_results_context(collection, False)
+        coldstorage.archive_period(self.period)
+        coldstorage.restore_period(self.period)
+        restored = VotingCollection.objects.get(revision__period=self.period)
+        self.assertNotEqual(restored.id, collection.id)
+        self.assertIsNotNone(get_frozen_results(restored))
+        restored_results = session_results_context(restored, False)
+        [(_, entries)], [(_, restored_entries)] = results['groups'], restored_results['groups']
+        self.assertEqual([entry.result for entry in entries],
+                         [entry.result for entry in restored_entries])
+        self.assertEqual([entry.voting.id for entry in restored_entries],
+                         list(MedianVoting.objects
+                              .filter(group__collection=restored)
+                              .values_list('id', flat=True)))
+        alice = Voter.objects.get(revision__period=self.period)
+        self.assertEqual([(voter.id, voter.name) for voter, _, _ in
+                          restored_entries[0].detail_rows],
+                         [(alice.id, 'Alice')])
+
+
+class HistoryRefreshTest(TransactionTestCase):
+    # refreshing only the changed votes must give the same history as a rebuild
+
+    def setUp(self):
+        self.period = Period.objects.create(name='2019')
+        revision = VotersRevision.objects.create(period=self.period)
+        self.alice = Voter.objects.create(name='Alice', weight=2, revision=revision)
+        self.bob = Voter.objects.create(name='Bob', weight=3, revision=revision)
+        collection = VotingCollection.objects.create(
+            name='Sitzung', time=timezone.now(), revision=revision)
+        group = VotingGroup.objects.create(name='Finanzen', collection=collection, group_num=0)
+        self.voting = MedianVoting.objects.create(
+            name='Antrag', value=1000, group=group, voting_num=0)
+        MedianVote.objects.create(value=500, voter=self.alice, voting=self.voting)
+
+    def _state(self):
+        history.refresh_outdated(period=self.period)
+        history_rows = sorted(VoteHistoryEntry.objects
+                              .filter(period=self.period)
+                              .values_list('voter_name', 'vote', 'outcome'))
+        statistics = list(VotingStatistics.objects
+                          .filter(period=self.period)
+                          .values_list('num_votes', 'votes_weight', 'approved'))
+        participation = sorted(VoterPeriodStatistics.objects
+                               .filter(period=self.period)
+                               .values_list('voter_name', 'votings', 'votes'))
+        return history_rows, statistics, participation
+
+    def _assert_rebuilt(self):
+        state = self._state()
+        history.rebuild()
+        self.assertEqual(state, self._state())
+
+    def test_vote_changes(self):
+        self._assert_rebuilt()
+        vote = MedianVote.objects.create(value=1000, voter=self.bob, voting=self.voting)
+        # only the entry of the voter is written and the number of votes is adjusted,
+        # the voting is evaluated when it's read
+        statistics = VotingStatistics.objects.get(median_voting=self.voting)
+        self.assertTrue(statistics.outdated)
+        self.assertEqual(statistics.num_votes, 2)
+        self._assert_rebuilt()
+        self.assertFalse(VotingStatistics.objects.get(median_voting=self.voting).outdated)
+        vote.value = 200
+        vote.save()
+        self._assert_rebuilt()
+        self.assertEqual(self._state()[2], [('Alice', 1, 1), ('Bob', 1, 1)])
+        vote.delete()
+        self._assert_rebuilt()
+        self.assertEqual(self._state()[2], [('Alice', 1, 1), ('Bob', 1, 0)])
+
+    def test_failed_refresh_logged(self):
+        # the vote is saved, a failing refresh must not raise an exception
+        original = history.refresh
+
+        def fail(items):
+            raise ValueError('refresh failed')
+        history.refresh = fail
+        try:
+            with self.assertLogs('votings.history', level='ERROR'):
+                MedianVote.objects.create(value=1000, voter=self.bob, voting=self.voting)
+        finally:
+            history.refresh = original
+        self.assertTrue(MedianVote.objects.filter(voter=self.bob).exists())
+
+
+class PagingTest(TestCase):
+    # keyset pagination through periods, the start of some periods is None
+
+    def setUp(self):
+        start = datetime.date(2019, 4, 1)
+        for i in range(12):
+            Period.objects.create(name='Period %d' % i,
+                                  start=None if i % 4 == 0 else start - datetime.timedelta(i % 3))
+        self.keys = ['start', 'created', 'id']
+        periods = Period.objects.all()
+        with_start = sorted((p for p in periods if p.start is not None),
+                            key=lambda p: (p.start, p.created, p.id), reverse=True)
+        without_start = sorted((p for p in periods if p.start is None),
+                               key=lambda p: (p.created, p.id), reverse=True)
+        self.expected = [p.id for p in with_start + without_start]
+
+    def test_pages(self):
+        ids, pages = [], []
+        page = paging.keyset_page(Period.objects.all(), self.keys, limit=5)
+        while True:
+            pages.append([p.id for p in page.object_list])
+            ids.extend(pages[-1])
+            if not page.has_next:
+                break
+            page = paging.keyset_page(Period.objects.all(), self.keys, page.next_cursor,
+                                      limit=5)
+        self.assertEqual(ids, self.expected)
+        # and back again
+        for expected in reversed(pages[:-1]):
+            page = paging.keyset_page(Period.objects.all(), self.keys,
+                                      page.previous_cursor, paging.PREVIOUS, limit=5)
+            self.assertEqual([p.id for p in page.object_list], expected)
+        self.assertFalse(page.has_previous)
+
+    def _plan(self, queryset):
+        sql, params = queryset[:paging.PAGE_SIZE + 1].query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return ' '.join(str(row[-1]) for row in cursor.fetchall())
+
+    @unittest.skipUnless(connection.vendor == 'sqlite', 'query plan of SQLite')
+    def test_index_used(self):
+        # the pages must be read from the index without sorting the objects
+        period = Period.objects.filter(start__isnull=False).first()
+        cursors = (None, [getattr(period, key) for key in self.keys],
+                   [None, period.created, period.id])
+        for values in cursors:
+            for descending in (True, False):
+                if values is None and not descending:
+                    continue
+                for queryset in paging._segments(Period.objects.all(), self.keys, values,
+                                                 descending):
+                    plan = self._plan(queryset)
+                    self.assertIn('votings_period_archive', plan)
+                    self.assertNotIn('TEMP B-TREE', plan)
+        for queryset in paging._segments(VotingCollection.objects.all(), ['time', 'id'],
+                                         [timezone.now(), 1], True):
+            plan = self._plan(queryset)
+            self.assertIn('votings_collection_archive', plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+
+
+class ClosingTest(TestCase):
+    # nothing of a closed session can be changed until it is reopened
+
+    def setUp(self):
+        period = Period.objects.create(name='2019')
+        self.revision = VotersRevision.objects.create(period=period)
+        self.voter = Voter.objects.create(name='Alice', weight=2, revision=self.revision)
+        self.collection = VotingCollection.objects.create(
+            name='Sitzung', time=timezone.now(), revision=self.revision)
+        group = VotingGroup.objects.create(
+            name='Finanzen', collection=self.collection, group_num=0)
+        self.voting = MedianVoting.objects.create(
+            name='Antrag', value=1000, group=group, voting_num=0)
+        MedianVote.objects.create(value=500, voter=self.voter, voting=self.voting)
+        user = User.objects.create_superuser('admin', 'admin@example.com', 'secret')
+        self.client.force_login(user)
+
+    def test_close_and_reopen(self):
+        record = close_collection(self.collection)
+        self.assertEqual(get_frozen_results(self.collection), record)
+        with self.assertRaises(SessionClosedError):
+            close_collection(self.collection)
+        reopen_collection(self.collection)
+        self.assertIsNone(get_frozen_results(self.collection))
+
+    def test_votes_rejected(self):
+        close_collection(self.collection)
+        response = self.client.post(reverse('voter_ballot_json', args=[self.collection.id]),
+                                    {'voter': self.voter.id})
+        self.assertEqual(response.status_code, 409)
+        response = self.client.post(
+            reverse('enter_single_voter', args=[self.collection.id, self.voter.id]),
+            {'extra_median_%d' % self.voting.id: ''})
+        self.assertRedirects(response, reverse('session_detail', args=[self.collection.id]),
+                             fetch_redirect_response=False)
+        self.assertEqual(list(MedianVote.objects.values_list('value', flat=True)), [500])
+
+    def test_changes_rejected(self):
+        close_collection(self.collection)
+        detail = reverse('session_detail', args=[self.collection.id])
+        requests = [
+            (reverse('session_update', args=[self.collection.id]),
+             {'name': 'Andere Sitzung', 'time': '2019-04-01 18:00'}),
+            (reverse('revision_update', args=[self.revision.id]), {'voters': '* Bob: 1'}),
+            (reverse('median_update', args=[self.voting.id]),
+             {'name': 'Anderer Antrag', 'value': '1,00', 'majority': '50%'}),
+            (reverse('median_delete', args=[self.voting.id]), {}),
+        ]
+        for url, data in requests:
+            response = self.client.post(url, data)
+            self.assertRedirects(response, detail, fetch_redirect_response=False)
+        self.collection.refresh_from_db()
+        self.assertEqual(self.collection.name, 'Sitzung')
+        self.assertEqual(list(Voter.objects.values_list('name', flat=True)), ['Alice'])
+        self.assertEqual(list(MedianVoting.objects.values_list('name', flat=True)), ['Antrag'])
+        self.assertEqual(MedianVote.objects.count(), 1)
+
+
+class ConstraintTest(TestCase):
+    # invalid votes are rejected by the triggers of migration 0025_vote_constraints
+
+    def setUp(self):
+        period = Period.objects.create(name='2019')
+        self.revision = VotersRevision.objects.create(period=period)
+        self.alice = Voter.objects.create(name='Alice', weight=2, revision=self.revision)
+        other_revision = VotersRevision.objects.create(period=period)
+        self.bob = Voter.objects.create(name='Bob', weight=3, revision=other_revision)
+        self.collection = VotingCollection.objects.create(
+            name='Sitzung', time=timezone.now(), revision=self.revision)
+        group = VotingGroup.objects.create(
+            name='Finanzen', collection=self.collection, group_num=0)
+        self.voting = MedianVoting.objects.create(
+            name='Antrag', value=1000, group=group, voting_num=0)
+        self.schulze_voting = SchulzeVoting.objects.create(
+            name='Wahl', group=group, voting_num=1)
+        self.options = [SchulzeOption.objects.create(option=name, voting=self.schulze_voting,
+                                                     option_num=i)
+                        for i, name in enumerate(('Ja', 'Nein'))]
+
+    def assertRejected(self, f):
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                f()
+
+    def test_median_votes(self):
+        vote = MedianVote.objects.create(value=1000, voter=self.alice, voting=self.voting)
+        self.assertRejected(
+            lambda: MedianVote.objects.create(value=1001, voter=self.alice, voting=self.voting))
+        vote.value = 1001
+        self.assertRejected(vote.save)
+        self.assertRejected(
+            lambda: MedianVote.objects.create(value=500, voter=self.bob, voting=self.voting))
+        # the value of the voting can't be lowered below the votes
+        self.voting.value = 500
+        self.assertRejected(self.voting.save)
+        self.voting.value = 2000
+        self.voting.save()
+
+    def test_schulze_votes(self):
+        self.assertRejected(lambda: SchulzeVote.objects.create(
+            sorting_position=0, voter=self.bob, option=self.options[0]))
+        for option in self.options:
+            SchulzeVote.objects.create(sorting_position=0, voter=self.alice, option=option)
+        self.assertEqual(SchulzeVote.objects.count(), 2)
+
+    def test_revision_changes(self):
+        MedianVote.objects.create(value=500, voter=self.alice, voting=self.voting)
+        self.alice.revision = self.bob.revision
+        self.assertRejected(self.alice.save)
+        self.collection.revision = self.bob.revision
+        self.assertRejected(self.collection.save)
+
+    @unittest.skipUnless(connection.vendor == 'postgresql',
+                         'complete rankings are only enforced on PostgreSQL')
+    def test_incomplete_ranking_rejected(self):
+        def incomplete():
+            SchulzeVote.objects.create(sorting_position=0, voter=self.alice,
+                                       option=self.options[0])
+            # the ranking triggers are deferred until the end of the transaction
+            with connection.cursor() as cursor:
+                cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        self.assertRejected(incomplete)
+
+    @unittest.skipIf(connection.vendor == 'postgresql',
+                     'complete rankings are enforced on PostgreSQL')
+    def test_incomplete_ranking_reported(self):
+        SchulzeVote.objects.create(sorting_position=0, voter=self.alice, option=self.options[0])
+        problems = integrity.find_problems([self.collection.id])
+        self.assertEqual([(p.kind, p.voter_id, p.voting_id) for p in problems],
+                         [(integrity.INCOMPLETE_RANKING, self.alice.id, self.schulze_voting.id)])
+
+
+class ResultsJsonTest(TransactionTestCase):
+    # the results JSON is revalidated with its ETag until a vote changes
+
+    def setUp(self):
+        cache.clear()
+        period = Period.objects.create(name='2019')
+        revision = VotersRevision.objects.create(period=period)
+        self.alice = Voter.objects.create(name='Alice', weight=2, revision=revision)
+        self.bob = Voter.objects.create(name='Bob', weight=3, revision=revision)
+        self.collection = VotingCollection.objects.create(
+            name='Sitzung', time=timezone.now(), revision=revision)
+        group = VotingGroup.objects.create(
+            name='Finanzen', collection=self.collection, group_num=0)
+        self.voting = MedianVoting.objects.create(
+            name='Antrag', value=1000, group=group, voting_num=0)
+        MedianVote.objects.create(value=1000, voter=self.alice, voting=self.voting)
+        self.url = reverse('session_results_json', args=[self.collection.id])
+
+    def test_etag(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        tag = response['ETag']
+        voting, = response.json()['groups'][0]['votings']
+        self.assertEqual((voting['id'], voting['weight_sum']), (self.voting.id, 2))
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=tag)
+        self.assertEqual(response.status_code, 304)
+        # the votes are a different document
+        response = self.client.get(self.url, {'votes': 1}, HTTP_IF_NONE_MATCH=tag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], tag)
+        self.assertEqual([vote['voter'] for vote in
+                          response.json()['groups'][0]['votings'][0]['votes']],
+                         ['Alice', 'Bob'])
+
+    def test_vote_changes_etag(self):
+        tag = self.client.get(self.url)['ETag']
+        MedianVote.objects.create(value=500, voter=self.bob, voting=self.voting)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=tag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], tag)
+        tag = response['ETag']
+        self.voting.name = 'Anderer Antrag'
+        self.voting.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=tag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['groups'][0]['votings'][0]['name'], 'Anderer Antrag')
+
+    def test_missing_session(self):
+        response = self.client.get(reverse('session_results_json', args=[self.collection.id + 1]))
+        self.assertEqual(response.status_code, 404)
+
+
+class ModifiedTest(TransactionTestCase):
+    # changes of a session and its votes update the timestamp used for conditional GET
+
+    def setUp(self):
+        period = Period.objects.create(name='2019')
+        self.revision = VotersRevision.objects.create(period=period)
+        self.alice = Voter.objects.create(name='Alice', weight=2, revision=self.revision)
+        self.collection = VotingCollection.objects.create(
+            name='Sitzung', time=timezone.now(), revision=self.revision)
+        group = VotingGroup.objects.create(
+            name='Finanzen', collection=self.collection, group_num=0)
+        self.voting = MedianVoting.objects.create(
+            name='Antrag', value=1000, group=group, voting_num=0)
+        user = User.objects.create_superuser('admin', 'admin@example.com', 'secret')
+        self.client.force_login(user)
+        self.url = reverse('session_detail', args=[self.collection.id])
+
+    def _modified(self):
+        return VotingCollection.objects.values_list('modified', flat=True).get(
+            id=self.collection.id)
+
+    def test_touch(self):
+        changes = [
+            lambda: MedianVote.objects.create(value=500, voter=self.alice, voting=self.voting),
+            lambda: Voter.objects.create(name='Bob', weight=1, revision=self.revision),
+            self.voting.save,
+        ]
+        for change in changes:
+            before = self._modified()
+            change()
+            self.assertGreater(self._modified(), before)
+        # all changes of a transaction are written with a single update after the commit
+        with CaptureQueriesContext(connection) as queries:
+            with transaction.atomic():
+                MedianVote.objects.filter(voter=self.alice).get().delete()
+                Voter.objects.filter(name='Bob').get().delete()
+        self.assertEqual(len([query for query in queries
+                              if query['sql'].startswith('UPDATE "votings_votingcollection"')]),
+                         1)
+
+    def test_conditional_get(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        tag, last_modified = response['ETag'], response['Last-Modified']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=tag)
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+        MedianVote.objects.create(value=500, voter=self.alice, voting=self.voting)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=tag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], tag)
+
+
+class QuorumTest(TestCase):
+    # quorum rules are compiled into majority.CompiledRule objects and can be selected
+    # in the voting forms
+
+    def setUp(self):
+        period = Period.objects.create(name='2019')
+        revision = VotersRevision.objects.create(period=period)
+        collection = VotingCollection.objects.create(
+            name='Sitzung', time=timezone.now(), revision=revision)
+        self.group = VotingGroup.objects.create(
+            name='Finanzen', collection=collection, group_num=0)
+        self.rule = QuorumRule.objects.create(
+            name='Mindestens zwei Drittel aller', numerator=4, denominator=6, strict=False,
+            absolute=True, abstentions=ABSTENTIONS_NO)
+        user = User.objects.create_superuser('admin', 'admin@example.com', 'secret')
+        self.client.force_login(user)
+
+    def test_compile(self):
+        rule = quorum.compile_quorum_rule(self.rule)
+        self.assertEqual(rule.as_tuple(), (2, 3, False, True, True))
+        self.assertEqual(str(rule), '2/3')
+        # at least 6 of 9 votes
+        self.assertEqual(rule.required(9), 5)
+        self.assertEqual(legacy_rule('2/3', False).required(9), 6)
+        self.assertEqual(CompiledRule.from_tuple(rule.as_tuple()).as_tuple(), rule.as_tuple())
+
+    def test_voting_rule(self):
+        voting = MedianVoting.objects.create(
+            name='Antrag', value=1000, group=self.group, voting_num=0, majority=FIFTY_MAJORITY)
+        self.assertIs(quorum.voting_rule(voting), legacy_rule(FIFTY_MAJORITY, False))
+        voting.quorum = self.rule
+        voting.save()
+        self.assertEqual(quorum.voting_rule(voting).as_tuple(), (2, 3, False, True, True))
+
+    def test_forms(self):
+        form = SchulzeVotingCreateForm({'name': 'Wahl', 'majority': FIFTY_MAJORITY,
+                                        'quorum': self.rule.id, 'options': '* Ja\n* Nein'})
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertEqual(form.cleaned_data['quorum'], self.rule)
+        # the rule is optional
+        form = SchulzeVotingCreateForm({'name': 'Wahl', 'majority': FIFTY_MAJORITY,
+                                        'options': '* Ja\n* Nein'})
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertIsNone(form.cleaned_data['quorum'])
+        response = self.client.post(
+            reverse('group_median_create', args=[self.group.id]),
+            {'name': 'Antrag', 'value': 100, 'majority': FIFTY_MAJORITY, 'quorum': self.rule.id,
+             'currency': '€'})
+        self.assertRedirects(response, reverse('group_update', args=[self.group.id]),
+                             fetch_redirect_response=False)
+        voting = MedianVoting.objects.get(name='Antrag')
+        self.assertEqual(voting.quorum, self.rule)
+        response = self.client.post(
+            reverse('median_update', args=[voting.id]),
+            {'name': 'Antrag', 'majority': FIFTY_MAJORITY, 'quorum': ''})
+        self.assertEqual(response.status_code, 302)
+        voting.refresh_from_db()
+        self.assertIsNone(voting.quorum)
+
+
+class RapidEntryTest(TransactionTestCase):
+    # ballots posted for an outdated layout of the session are rejected
+
+    def setUp(self):
+        cache.clear()
+        period = Period.objects.create(name='2019')
+        revision = VotersRevision.objects.create(period=period)
+        self.voter = Voter.objects.create(name='Alice', weight=2, revision=revision)
+        self.collection = VotingCollection.objects.create(
+            name='Sitzung', time=timezone.now(), revision=revision)
+        self.group = VotingGroup.objects.create(
+            name='Finanzen', collection=self.collection, group_num=0)
+        self.voting = MedianVoting.objects.create(
+            name='Antrag', value=1000, group=self.group, voting_num=0)
+        user = User.objects.create_superuser('admin', 'admin@example.com', 'secret')
+        self.client.force_login(user)
+        self.url = reverse('voter_ballot_json', args=[self.collection.id])
+
+    def _version(self):
+        response = self.client.get(reverse('rapid_entry', args=[self.collection.id]))
+        self.assertEqual(response.status_code, 200)
+        return response.context['rapid_data']['version']
+
+    def _post(self, version, value):
+        return self.client.post(self.url, {'voter': self.voter.id, 'version': version,
+                                           'extra_median_%d' % self.voting.id: value})
+
+    def test_version_mismatch(self):
+        version = self._version()
+        response = self._post(version, '5')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(list(MedianVote.objects.values_list('value', flat=True)), [500])
+        # a new voting changes the fields of the form
+        MedianVoting.objects.create(name='Noch ein Antrag', value=1000, group=self.group,
+                                    voting_num=1)
+        for old in (version, ''):
+            response = self._post(old, '7')
+            self.assertEqual(response.status_code, 409)
+            self.assertIn('error', response.json())
+        self.assertEqual(list(MedianVote.objects.values_list('value', flat=True)), [500])
+        self.assertNotEqual(self._version(), version)
+        response = self._post(self._version(), '7')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(list(MedianVote.objects.values_list('value', flat=True)), [700])
+
+
+class CacheTest(TransactionTestCase):
+    # the voters and the overview of a session are cached until they change
+
+    def setUp(self):
+        cache.clear()
+        period = Period.objects.create(name='2019')
+        self.revision = VotersRevision.objects.create(period=period)
+        self.voters = [Voter.objects.create(name=name, weight=weight, revision=self.revision)
+                       for name, weight in (('Alice', 2), ('Bob', 3), ('Carol', 1))]
+        self.collection = VotingCollection.objects.create(
+            name='Sitzung', time=timezone.now(), revision=self.revision)
+        self.group = VotingGroup.objects.create(
+            name='Finanzen', collection=self.collection, group_num=0)
+        self.voting = SchulzeVoting.objects.create(name='Wahl', group=self.group, voting_num=0)
+        for i, name in enumerate(('Ja', 'Nein')):
+            SchulzeOption.objects.create(option=name, voting=self.voting, option_num=i)
+
+    def test_revision_voters(self):
+        voters = voting_cache.get_revision_voters(self.revision.id)
+        self.assertEqual(voters.weight_sum, 6)
+        with self.assertNumQueries(0):
+            self.assertIs(voting_cache.get_revision_voters(self.revision), voters)
+        alice, bob, carol = self.voters
+        self.assertEqual([voter.name for voter in voters.block(limit=2)], ['Alice', 'Bob'])
+        self.assertEqual([voter.name for voter in voters.block(after=bob.id)], ['Carol'])
+        self.assertEqual(voters.block(after=carol.id, limit=2), ())
+        self.assertEqual(voters.block(after=-1), ())
+        # changing a voter invalidates the voters after the commit
+        carol.weight = 4
+        carol.save()
+        voters = voting_cache.get_revision_voters(self.revision.id)
+        self.assertEqual(voters.weight_sum, 9)
+        bob.delete()
+        voters = voting_cache.get_revision_voters(self.revision.id)
+        self.assertEqual((len(voters), voters.weight_sum), (2, 6))
+        self.assertNotIn(bob.id, voters)
+
+    def test_session_overview(self):
+        overview = voting_cache.get_session_overview(self.collection)
+        (group, entries), = overview.groups
+        self.assertEqual(group.name, 'Finanzen')
+        self.assertEqual([(v_type, voting.name) for v_type, voting in entries],
+                         [('schulze', 'Wahl')])
+        self.assertEqual(overview.option_map, {self.voting.id: ('Ja', 'Nein')})
+        with self.assertNumQueries(0):
+            self.assertIs(voting_cache.get_session_overview(self.collection.id), overview)
+        # groups, votings and options invalidate the overview after the commit
+        SchulzeOption.objects.create(option='Enthaltung', voting=self.voting, option_num=2)
+        overview = voting_cache.get_session_overview(self.collection)
+        self.assertEqual(overview.option_map, {self.voting.id: ('Ja', 'Nein', 'Enthaltung')})
+        MedianVoting.objects.create(name='Antrag', value=1000, group=self.group, voting_num=1)
+        self.group.name = 'Haushalt'
+        self.group.save()
+        overview = voting_cache.get_session_overview(self.collection)
+        (group, entries), = overview.groups
+        self.assertEqual(group.name, 'Haushalt')
+        self.assertEqual([(v_type, voting.name) for v_type, voting in entries],
+                         [('schulze', 'Wahl'), ('median', 'Antrag')])
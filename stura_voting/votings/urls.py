@@ -41,6 +41,9 @@ urlpatterns = [
         views.RevisionDetailView.as_view(),
         name='revision_detail'),
     path('archive', views.archive_index, name='archive_index'),
+    path('search/', views.search_view, name='search'),
+    path('history/', views.voter_history_view, name='voter_history'),
+    path('history/json/', views.voter_history_json, name='voter_history_json'),
     path(
         'period/<int:pk>/edit/',
         views.PeriodUpdateView.as_view(),
@@ -54,6 +57,18 @@ urlpatterns = [
         'period/<int:pk>/',
         views.PeriodDetailView.as_view(),
         name='period_detail'),
+    path(
+        'period/<int:pk>/statistics/',
+        views.period_statistics_view,
+        name='period_statistics'),
+    path(
+        'period/<int:pk>/archived/',
+        views.archived_period_view,
+        name='archived_period'),
+    path(
+        'period/<int:pk>/archived/session/<int:session>/',
+        views.archived_session_view,
+        name='archived_session'),
     path('period/delete/success/',
          views.period_delete_success_view,
          name='period_delete_success'),
@@ -67,6 +82,10 @@ urlpatterns = [
         'session/<int:pk>/edit/',
         views.SessionUpdate.as_view(),
         name='session_update'),
+    path(
+        'session/<int:pk>/close/',
+        views.close_session_view,
+        name='session_close'),
     path(
         'session/<int:pk>/',
         views.SessionDetailView.as_view(),
@@ -98,6 +117,11 @@ urlpatterns = [
         'session/<int:coll>/voters/<int:v>/',
         views.enter_single_voter_view,
         name='enter_single_voter'),
+    path('session/<int:pk>/rapid/', views.rapid_entry_view, name='rapid_entry'),
+    path(
+        'session/<int:pk>/rapid/ballot/',
+        views.voter_ballot_json,
+        name='voter_ballot_json'),
     path('group/<int:pk>/edit/', views.edit_group_view, name='group_update'),
     path(
         'group/<int:pk>/delete/',
@@ -135,6 +159,10 @@ urlpatterns = [
         'votes/votes_list/<int:pk>/',
         views.session_votes_list,
         name='votes_list'),
+    path(
+        'votes/votes_list/<int:pk>/rows/',
+        views.session_votes_list_rows,
+        name='votes_list_rows'),
     path(
         'session/<int:pk>/results/detailed/',
         views.session_results_votes_view,
@@ -143,4 +171,8 @@ urlpatterns = [
         'session/<int:pk>/results/',
         views.session_results_view,
         name='session_results'),
+    path(
+        'session/<int:pk>/results/json/',
+        views.session_results_json,
+        name='session_results_json'),
 ]
@@ -30,7 +30,8 @@ from django.shortcuts import get_object_or_404
 # otherwise some really ugly import issues
 from . import models as voting_models
 from . import results
-from . fraction import *
+from .cache import get_session_overview
+from .majority import required_votes
 
 from stura_voting_utils import SchulzeVotingSkeleton, MedianVotingSkeleton
 
@@ -275,15 +276,12 @@ def get_next_session_name_stura():
 
 
 def compute_majority(majority, votes_sum):
-    # majority: either a fraction <= 1 or a model description for a fraction:
-    # FIFTY_MAJORITY or TWO_THIRDS_MAJORITY
     """Computes the majority required for a vote.
 
-    majority must either be a Fraction instance <= (for example 1/2) or a description string.
-    The string must be one of the constants FIFTY_MAJORITY or TWO_THIRDS_MAJORITY as defined
-    in the models.
-    In order to avoid rounding errors with floating point numbers a majority is based on
-    fractions.
+    majority is either a description string (for example the constants FIFTY_MAJORITY
+    or TWO_THIRDS_MAJORITY as defined in the models) or a fraction <= 1. See the majority
+    module for all supported descriptions. The result is computed with integers only
+    and memoized.
     It computes the number of votes required given the sum of all votes.
     For example: 51 voters and majority 1/2 ==> 25, that is > 25 votes are required.
 
@@ -296,16 +294,7 @@ def compute_majority(majority, votes_sum):
     Returns:
         int: The number of votes required for a majority.
     """
-    if not isinstance(majority, Fraction):
-        if majority == voting_models.FIFTY_MAJORITY:
-            majority = Fraction(1, 2)
-        elif majority == voting_models.TWO_THIRDS_MAJORITY:
-            majority = Fraction(2, 3)
-        else:
-            raise ValueError('Invalid majority description %s' % str(majority))
-    required_fraction = majority * Fraction(votes_sum, 1)
-    votes_required, _ = required_fraction.split()
-    return votes_required
+    return required_votes(majority, votes_sum)
 
 
 def add_votings(parsed_collection, collection_model):
@@ -355,12 +344,12 @@ def add_votings(parsed_collection, collection_model):
 def get_groups_template(collection, empty_groups=False):
     """Returns all groups and voting information to be used inside the session views.
 
-     It will do the following: It queries all votings for the given collection with
-     results.median_votings and results.schulze_votings. The results are merged with
-     results.CombinedVotingResult. See details for that methods for more details.
-
-     It returns the groups and option_map from CombinedVotingResult.for_overview_template
-     and the combined warnings.
+     The groups, votings and options are taken from the cached cache.SessionOverview of
+     the collection, so usually no query is required. The result has the same form as
+     the groups and option_map from CombinedVotingResult.for_overview_template, but the
+     groups and votings are cache.CachedGroup and cache.CachedVoting objects and the
+     options of a voting are a tuple. They are shared between requests and must not be
+     changed.
 
      Note that empty groups will not be present, if you want to force empty groups to
      appear use empty_groups=True.
@@ -373,15 +362,7 @@ def get_groups_template(collection, empty_groups=False):
     Returns:
         groups, option_map, list of warnings: See CombinedVotingResult.for_overview_template.
     """
-    median_votings = results.median_votings(collection=collection)
-    schulze_votings = results.schulze_votings(collection=collection)
-    merged = results.CombinedVotingResult(median_votings, schulze_votings)
-    groups, option_map = None, None
-    if empty_groups:
-        groups, option_map = merged.for_overview_template(all_groups=collection)
-    else:
-        groups, option_map = merged.for_overview_template()
-    return groups, option_map, merged.warnings
+    return get_session_overview(collection).for_template(empty_groups=empty_groups)
 
 
 def get_instance(klass, obj, *args, **kwargs):
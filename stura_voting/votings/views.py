@@ -13,6 +13,8 @@
 # limitations under the License.
 
 
+import hashlib
+
 from collections import OrderedDict
 
 from schulze_voting import evaluate_schulze
@@ -21,7 +23,8 @@ from django.shortcuts import render, reverse, redirect
 from django.views.generic.detail import DetailView
 from django.views.generic import ListView, UpdateView, CreateView
 from django.views.generic.edit import DeleteView
-from django.http import Http404
+from django.http import Http404, HttpResponse
+from django.core.paginator import Paginator
 from django.db import transaction
 from django.db.models import Max
 from django.utils.translation import gettext
@@ -29,7 +32,9 @@ from django.urls import reverse_lazy
 from django.utils.decorators import method_decorator
 from django.contrib.auth.decorators import login_required, permission_required
 from django.contrib.auth.mixins import PermissionRequiredMixin
-from django.http.response import HttpResponseBadRequest
+from django.contrib import messages
+from django.http.response import HttpResponseBadRequest, JsonResponse
+from django.views.decorators.http import etag, condition
 
 from .results import *
 
@@ -41,15 +46,22 @@ from .utils import *
 
 from .median import median_for_evaluation, single_median_statistics
 from .schulze import schulze_for_evaluation, single_schulze_instance
+from .cache import *
+from .search import search_voters, search_sessions, participation
+from .history import voter_history, history_entry_dict, refresh_outdated
+from .stats import PeriodStatistics
+from . import paging
+from .coldstorage import load_snapshot, ArchivedSession
+from .evaluation import *
+from .changes import collection_modified
+from .printing import get_print
+from .ballotlog import BallotChanges, log_ballot
 
-from django.utils import timezone
 
 # TODO which views should be atomic
 # also see select_for_update
 
 def index(request):
-    # TODO remove
-    query_votes(end=timezone.now(), query='initiative fachbereich', split=True)
     return render(request, 'votings/index.html')
 
 
@@ -63,9 +75,68 @@ def profile(request):
 
 
 def archive_index(request):
+    # the first pages of the lists
+    periods = get_cached(
+        'votings.archive.periods', ARCHIVE_VERSION_KEY,
+        lambda: paging.keyset_page(Period.objects.all(), PeriodsList.keys,
+                                   limit=10).object_list)
+    collections = get_cached(
+        'votings.archive.collections', ARCHIVE_VERSION_KEY,
+        lambda: paging.keyset_page(VotingCollection.objects.all(), SessionsList.keys,
+                                   limit=10).object_list)
     return render(request, 'votings/archive.html',
-                  {'periods': Period.objects.order_by('-start', '-created')[:10],
-                   'collections': VotingCollection.objects.order_by('-time')[:10]})
+                  {'periods': periods,
+                   'collections': collections})
+
+
+# number of sessions displayed on one page of the search results
+SEARCH_SESSIONS_PER_PAGE = 10
+
+
+def search_view(request):
+    context = {}
+    if request.GET:
+        form = VoterSearchForm(request.GET)
+        if form.is_valid():
+            data = form.cleaned_data
+            voters = search_voters(data['query'], data['split'])
+            sessions = search_sessions(voters, data['period'], data['start'], data['end'])
+            paginator = Paginator(sessions, SEARCH_SESSIONS_PER_PAGE)
+            page = paginator.get_page(request.GET.get('page'))
+            # the query string without the page, used for the pagination links
+            query = request.GET.copy()
+            query.pop('page', None)
+            context['page'] = page
+            context['query_string'] = query.urlencode()
+            context['participations'] = participation(page.object_list, voters)
+    else:
+        form = VoterSearchForm()
+    context['form'] = form
+    return render(request, 'votings/search/search.html', context)
+
+
+def voter_history_view(request):
+    context = {}
+    if request.GET:
+        form = VoterHistoryForm(request.GET)
+        if form.is_valid():
+            context['entries'] = voter_history(form.cleaned_data['name'],
+                                               form.cleaned_data['period'])
+    else:
+        form = VoterHistoryForm()
+    context['form'] = form
+    return render(request, 'votings/history/voter_history.html', context)
+
+
+def voter_history_json(request):
+    form = VoterHistoryForm(request.GET)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+    entries = voter_history(form.cleaned_data['name'], form.cleaned_data['period'])
+    return JsonResponse({
+        'name': form.cleaned_data['name'],
+        'entries': [history_entry_dict(entry) for entry in entries],
+    })
 
 
 @transaction.atomic
@@ -75,6 +146,9 @@ def archive_index(request):
      'votings.change_schulzevoting'))
 def edit_group_view(request, pk):
     group = get_object_or_404(VotingGroup, pk=pk)
+    closed = _reject_closed(request, group.collection_id)
+    if closed is not None:
+        return closed
     context = {'group': group}
     median_votings = results.median_votings(
         group=group, select_for_update=True)
@@ -114,7 +188,42 @@ def edit_group_view(request, pk):
     return render(request, 'votings/group/group_detail.html', context)
 
 
-class VotingDeleteView(DeleteView):
+def _reject_closed(request, collection_id):
+    # the session, its voters, groups, votings and options of a closed session can't
+    # be changed: the frozen results refer to them and deleting a voting or voter
+    # deletes its votes
+    if get_frozen_results(collection_id) is None:
+        return None
+    messages.error(request, 'Die Sitzung ist abgeschlossen und kann nicht mehr geändert werden.')
+    return redirect('session_detail', pk=collection_id)
+
+
+class ClosedSessionMixin(object):
+    """Rejects requests for objects of closed sessions, see _reject_closed.
+
+    The session is looked up from the primary key in the URL with collection_lookup,
+    a lookup from the view's model to the collection. Must be placed after
+    PermissionRequiredMixin.
+
+    """
+    collection_lookup = 'group__collection'
+
+    def get_collection_id(self):
+        return (self.model.objects
+                .filter(pk=self.kwargs['pk'])
+                .values_list(self.collection_lookup, flat=True)
+                .first())
+
+    def dispatch(self, request, *args, **kwargs):
+        collection_id = self.get_collection_id()
+        if collection_id is not None:
+            response = _reject_closed(request, collection_id)
+            if response is not None:
+                return response
+        return super().dispatch(request, *args, **kwargs)
+
+
+class VotingDeleteView(ClosedSessionMixin, DeleteView):
     template_name = 'votings/voting/voting_confirm_delete.html'
 
     def get_success_url(self):
@@ -152,12 +261,12 @@ class SchulzeVotingDeleteView(PermissionRequiredMixin, VotingDeleteView):
         return context
 
 
-class MedianUpdateView(PermissionRequiredMixin, UpdateView):
+class MedianUpdateView(PermissionRequiredMixin, ClosedSessionMixin, UpdateView):
     # permissions
     permission_required = 'votings.change_medianvoting'
 
     model = MedianVoting
-    fields = ('name', 'majority', 'absolute_majority')
+    fields = ('name', 'majority', 'absolute_majority', 'quorum')
 
     context_object_name = 'voting'
     template_name = 'votings/voting/median_update.html'
@@ -168,12 +277,12 @@ class MedianUpdateView(PermissionRequiredMixin, UpdateView):
                 self.object.group.collection.id])
 
 
-class SchulzeUpdateView(PermissionRequiredMixin, UpdateView):
+class SchulzeUpdateView(PermissionRequiredMixin, ClosedSessionMixin, UpdateView):
     # permissions
     permission_required = 'votings.change_schulzevoting'
 
     model = SchulzeVoting
-    fields = ('name', 'majority', 'absolute_majority')
+    fields = ('name', 'majority', 'absolute_majority', 'quorum')
 
     context_object_name = 'voting'
     template_name = 'votings/voting/schulze_update.html'
@@ -217,13 +326,46 @@ class PeriodDetailView(DetailView):
             '-period__start',
             '-period__created',
             '-created')
-        context['revisions'] = revs
+        context['revisions'] = get_cached_list(
+            'votings.period.%d.revisions' % period.id, ARCHIVE_VERSION_KEY, revs)
         collections = VotingCollection.objects.filter(
             revision__period=period).order_by('-time')
-        context['collections'] = collections
+        context['collections'] = get_cached_list(
+            'votings.period.%d.collections' % period.id, ARCHIVE_VERSION_KEY, collections)
+        # the snapshot if the period has been archived (without its data)
+        context['snapshot'] = get_cached(
+            'votings.period.%d.snapshot' % period.id, ARCHIVE_VERSION_KEY,
+            lambda: PeriodSnapshot.objects.filter(period=period).defer('data').first() or False)
         return context
 
 
+def period_statistics_view(request, pk):
+    period = get_object_or_404(Period, pk=pk)
+    refresh_outdated(period=period)
+    return render(request, 'votings/period/period_statistics.html',
+                  {'period': period, 'statistics': PeriodStatistics(period)})
+
+
+def archived_period_view(request, pk):
+    snapshot = get_object_or_404(PeriodSnapshot, period=pk)
+    data = load_snapshot(snapshot)
+    return render(request, 'votings/archived/archived_period.html',
+                  {'snapshot': snapshot,
+                   'period': data['period'],
+                   'collections': data['collections']})
+
+
+def archived_session_view(request, pk, session):
+    snapshot = get_object_or_404(PeriodSnapshot, period=pk)
+    try:
+        archived = ArchivedSession(load_snapshot(snapshot), session)
+    except KeyError:
+        raise Http404('Session does not exist in the archive')
+    return render(request, 'votings/archived/archived_session.html',
+                  {'snapshot': snapshot,
+                   'session': archived})
+
+
 class PeriodUpdateView(PermissionRequiredMixin, UpdateView):
     # permissions
     permission_required = 'votings.change_period'
@@ -250,8 +392,7 @@ class PeriodDetailSuccess(PermissionRequiredMixin, PeriodDetailView):
 def enter_voterlist(request, pk):
     collection = get_object_or_404(VotingCollection, pk=pk)
     with_vote_id = get_voters_with_vote(collection)
-    all_voters = Voter.objects.filter(
-        revision=collection.revision).order_by('name')
+    all_voters = get_revision_voters(collection.revision_id)
     with_vote = []
     without_vote = []
     for voter in all_voters:
@@ -266,42 +407,131 @@ def enter_voterlist(request, pk):
     return render(request, 'votings/session/enter_voterlist.html', context)
 
 
+def _entry_collection(request, pk):
+    # votes are only saved with the collection row locked: close_collection locks it as
+    # well, so no vote can be saved while the session is evaluated for closing
+    queryset = VotingCollection.objects.all()
+    if request.method == 'POST':
+        queryset = queryset.select_for_update()
+    return get_object_or_404(queryset, pk=pk)
+
+
 @transaction.atomic
 @permission_required('votings.enter_collection_results')
 def enter_single_voter_view(request, coll, v):
-    collection = get_object_or_404(VotingCollection, pk=coll)
+    collection = _entry_collection(request, coll)
     voter = get_object_or_404(Voter, pk=v)
     context = {'collection': collection, 'voter': voter}
-    if voter.revision != collection.revision:
+    if voter.revision_id != collection.revision_id:
         # TODO remove probably
         return HttpResponseBadRequest('Fooo')
+    if get_frozen_results(collection) is not None:
+        messages.error(request, 'Die Sitzung ist abgeschlossen, Stimmen können nicht mehr geändert werden.')
+        return redirect('session_detail', pk=coll)
+    form_class = ResultsSingleVoterForm.for_collection(collection)
     if request.method == 'GET':
-        form = ResultsSingleVoterForm(collection=collection, voter=voter)
+        form = form_class(voter=voter, verified=collection.votes_are_verified())
     else:
-        form = ResultsSingleVoterForm(
-            request.POST, collection=collection, voter=voter)
+        form = form_class(request.POST, voter=voter,
+                          verified=collection.votes_are_verified())
         if form.is_valid():
-            for v_type, v_id, val in form.votings():
-                if v_type == 'median':
-                    __handle_enter_median(form.median_result, v_id, val, voter)
-                elif v_type == 'schulze':
-                    __handle_enter_schulze(
-                        form.schulze_result, v_id, val, voter)
-                else:
-                    assert False
+            _save_single_voter_form(form, voter, request.user)
             return redirect('enter_voterslist', pk=coll)
     context['form'] = form
+    context['warnings'] = _single_voter_warnings(form)
+    return render(request, 'votings/session/enter_single.html', context)
+
+
+def _save_single_voter_form(form, voter, user):
+    # form must be a valid ResultsSingleVoterForm, all changes are written to the
+    # ballot log with a single insert
+    changes = BallotChanges()
+    for v_type, v_id, val in form.votings():
+        if v_type == 'median':
+            __handle_enter_median(form.median_result, v_id, val, voter, changes)
+        elif v_type == 'schulze':
+            __handle_enter_schulze(
+                form.schulze_result, v_id, val, voter, changes)
+        else:
+            assert False
+    log_ballot(form.collection_id, voter, user, changes)
+
+
+def _single_voter_warnings(form):
     # our methods might change the contents of schulze and median warnings, thus
     # the merged result does not contain all warnings, we merge them here again
-    context['warnings'] = list(
+    return list(
         map(str, form.median_result.warnings + form.schulze_result.warnings))
-    return render(request, 'votings/session/enter_single.html', context)
 
 
-def __handle_enter_median(result, v_id, val, voter):
+@permission_required('votings.enter_collection_results')
+def rapid_entry_view(request, pk):
+    # the page only contains the fields, the ballots are loaded and saved with
+    # voter_ballot_json
+    collection = get_object_or_404(VotingCollection, pk=pk)
+    if get_frozen_results(collection) is not None:
+        messages.error(request, 'Die Sitzung ist abgeschlossen, Stimmen können nicht mehr geändert werden.')
+        return redirect('session_detail', pk=pk)
+    form_class = ResultsSingleVoterForm.for_collection(collection)
+    with_vote_id = get_voters_with_vote(collection)
+    voters = [{'id': voter.id, 'name': voter.name, 'entered': voter.id in with_vote_id}
+              for voter in get_revision_voters(collection.revision_id)]
+    context = {
+        'collection': collection,
+        'rapid_data': {
+            'version': form_class.version,
+            'layout': form_class.layout(),
+            'voters': voters,
+        },
+    }
+    return render(request, 'votings/session/rapid_entry.html', context)
+
+
+@transaction.atomic
+@permission_required('votings.enter_collection_results')
+def voter_ballot_json(request, pk):
+    # GET returns the current ballot of the voter given in the parameter "voter",
+    # POST validates and saves it (like enter_single_voter_view)
+    collection = _entry_collection(request, pk)
+    params = request.GET if request.method == 'GET' else request.POST
+    try:
+        voter = Voter.objects.get(id=int(params.get('voter', '')),
+                                  revision=collection.revision_id)
+    except (ValueError, Voter.DoesNotExist):
+        return JsonResponse({'error': 'Unbekannte abstimmungsberechtigte Person.'}, status=404)
+    if get_frozen_results(collection) is not None:
+        return JsonResponse(
+            {'error': 'Die Sitzung ist abgeschlossen, Stimmen können nicht mehr geändert werden.'},
+            status=409)
+    form_class = ResultsSingleVoterForm.for_collection(collection)
+    if request.method == 'GET':
+        form = form_class(voter=voter, verified=collection.votes_are_verified())
+        return JsonResponse({
+            'voter': voter.id,
+            'values': form.initial_values(),
+            'warnings': _single_voter_warnings(form),
+        })
+    if params.get('version', '') != form_class.version:
+        # the fields on the page don't match the votings any more
+        return JsonResponse(
+            {'error': 'Die Abstimmungen der Sitzung wurden geändert, bitte lade die Seite neu.'},
+            status=409)
+    form = form_class(params, voter=voter, verified=collection.votes_are_verified())
+    if not form.is_valid():
+        errors = {name: list(field_errors) for name, field_errors in form.errors.items()}
+        return JsonResponse({'voter': voter.id, 'errors': errors}, status=400)
+    _save_single_voter_form(form, voter, request.user)
+    return JsonResponse({
+        'voter': voter.id,
+        'warnings': _single_voter_warnings(form),
+    })
+
+
+def __handle_enter_median(result, v_id, val, voter, changes):
     # result: GenericVotingResult for median votes only
     # v_id id of the voting
     # val: None or tuple (value, currency)
+    # changes: ballotlog.BallotChanges, the change is added to it
     # first lookup voting and ensure it exists
     if v_id not in result.votings:
         msg = gettext(
@@ -317,6 +547,7 @@ def __handle_enter_median(result, v_id, val, voter):
         # delete if exists, otherwise keep as it is
         if v_id in result.votes:
             # just delete the single entry
+            changes.median(v_id, result.votes[v_id].value, None)
             result.votes[v_id].delete()
     else:
         # update or insert
@@ -324,17 +555,20 @@ def __handle_enter_median(result, v_id, val, voter):
             entry = result.votes[v_id]
             # update
             if entry.value != val[0]:
+                changes.median(v_id, entry.value, val[0])
                 entry.value = val[0]
                 entry.save(update_fields=['value'])
         else:
             # insert
+            changes.median(v_id, None, val[0])
             MedianVote.objects.create(value=val[0], voter=voter, voting=voting)
 
 
-def __handle_enter_schulze(result, v_id, val, voter):
+def __handle_enter_schulze(result, v_id, val, voter, changes):
     # result: GenericVotingResult for schulze votes only
     # v_id id of the voting
     # val: None or list of ints (the ranking)
+    # changes: ballotlog.BallotChanges, the change is added to it
     # in this code we do some sanity checks, just to be absolutely sure everything
     # is correct
     # first lookup voting and ensure it exists
@@ -351,6 +585,7 @@ def __handle_enter_schulze(result, v_id, val, voter):
         # delete all entries if exists, otherwise keep as it is
         if v_id in result.votes:
             votes = result.votes[v_id]
+            changes.schulze(v_id, [vote.sorting_position for vote in votes], None)
             for vote in votes:
                 vote.delete()
     else:
@@ -393,6 +628,8 @@ def __handle_enter_schulze(result, v_id, val, voter):
                 if vote.option != option:
                     # if this happens: The existing entries are invalid, we delete all of them
                     # then when create a warning and return
+                    changes.schulze(
+                        v_id, [vote.sorting_position for vote in current_votes], None)
                     for vote in current_votes:
                         vote.delete()
                     msg = gettext(
@@ -407,12 +644,14 @@ def __handle_enter_schulze(result, v_id, val, voter):
             # sanity checks passed, now we can update all existing votes
             # finally, everything ok, insert
             # we also know that len(current_votes) == len(val)
+            changes.schulze(v_id, [vote.sorting_position for vote in current_votes], val)
             for vote, new_pos in zip(current_votes, val):
                 if vote.sorting_position != new_pos:
                     vote.sorting_position = new_pos
                     vote.save(update_fields=['sorting_position'])
         else:
             # we know that len(val) == len(voting_options, so insert)
+            changes.schulze(v_id, None, val)
             for option, ranking_pos in zip(voting_options, val):
                 SchulzeVote.objects.create(sorting_position=ranking_pos,
                                            voter=voter,
@@ -446,14 +685,79 @@ def new_revision(request):
                   {'form': form})
 
 
-class PeriodsList(ListView):
+class KeysetListView(ListView):
+    """Base class for the archive lists, paginated with keyset pagination.
+
+    The page is selected by the GET parameters "after" (or "before") containing the
+    cursor of the last (or first) object on the previous (or next) page. Subclasses
+    define the sort keys, a filter form and how to apply the form.
+
+    Attributes:
+        keys (list of str): The fields to sort by (descending).
+        filter_form (class): The form class to filter the objects.
+        cache_key (str): Prefix of the cache keys for the pages.
+
+    """
+    keys = None
+    filter_form = None
+    cache_key = None
+
+    def filter_queryset(self, queryset, data):
+        return queryset
+
+    def get_queryset(self):
+        res = super().get_queryset()
+        self.form = self.filter_form(self.request.GET)
+        data = {}
+        if self.form.is_valid():
+            data = self.form.cleaned_data
+        res = self.filter_queryset(res, data)
+        cursor, direction = self.request.GET.get('after'), paging.NEXT
+        if cursor is None:
+            cursor, direction = self.request.GET.get('before'), paging.PREVIOUS
+        # the cache key contains the filter and the position, the position is taken
+        # from the decoded cursor: the raw parameter is user input and must not end up
+        # in the key (length, characters), invalid cursors show the first page
+        values = None
+        if cursor is not None:
+            values = paging.decode_cursor(self.model, self.keys, cursor)
+        if values is None:
+            cursor, direction, position = None, paging.NEXT, 'first'
+        else:
+            position = hashlib.sha1(
+                paging.encode_cursor(values).encode('ascii')).hexdigest()
+        filter_key = '.'.join(str(getattr(data.get(name), 'pk', data.get(name)))
+                              for name in sorted(self.form.fields))
+        key = '%s.%s.%s.%s' % (self.cache_key, filter_key, direction, position)
+        self.page = get_cached(
+            key, ARCHIVE_VERSION_KEY,
+            lambda: paging.keyset_page(res, self.keys, cursor, direction))
+        return self.page.object_list
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # the query string without the position, used for the pagination links
+        query = self.request.GET.copy()
+        query.pop('after', None)
+        query.pop('before', None)
+        context['query_string'] = query.urlencode()
+        context['page'] = self.page
+        context['form'] = self.form
+        return context
+
+
+class PeriodsList(KeysetListView):
     template_name = 'votings/period/all_periods.html'
     model = Period
     context_object_name = 'periods'
+    keys = ['start', 'created', 'id']
+    filter_form = PeriodsFilterForm
+    cache_key = 'votings.periods'
 
-    def get_queryset(self):
-        res = super().get_queryset()
-        return res.order_by('-start', '-created')
+    def filter_queryset(self, queryset, data):
+        if data.get('year') is not None:
+            queryset = queryset.filter(start__year=data['year'])
+        return queryset
 
 
 class RevisionDetailView(DetailView):
@@ -463,8 +767,7 @@ class RevisionDetailView(DetailView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        voters = Voter.objects.filter(revision=self.object).order_by('name')
-        context['voters'] = voters
+        context['voters'] = get_revision_voters(self.object)
         return context
 
 
@@ -489,11 +792,12 @@ def revision_delete_success_view(request):
     return render(request, 'votings/revision/revision_success_delete.html')
 
 
-class VotingGroupDeleteView(PermissionRequiredMixin, DeleteView):
+class VotingGroupDeleteView(PermissionRequiredMixin, ClosedSessionMixin, DeleteView):
     # permissions
     permission_required = 'votings.delete_votinggroup'
 
     model = VotingGroup
+    collection_lookup = 'collection'
     template_name = 'votings/group/group_confirm_delete.html'
     success_url = reverse_lazy('group_delete_success')
 
@@ -538,6 +842,15 @@ def period_delete_success_view(request):
 @permission_required('votings.change_votersrevision')
 def update_revision_view(request, pk):
     revision = get_object_or_404(VotersRevision, pk=pk)
+    # the voters of closed sessions can't be changed, the sessions are locked s.t. they
+    # can't be closed while the voters change
+    list(VotingCollection.objects.filter(revision=revision).select_for_update())
+    closed_id = (FrozenResults.objects
+                 .filter(collection__revision=revision)
+                 .values_list('collection', flat=True)
+                 .first())
+    if closed_id is not None:
+        return _reject_closed(request, closed_id)
     voters = Voter.objects.filter(
         revision=revision).order_by('name').select_for_update()
     if request.method == 'GET':
@@ -612,21 +925,28 @@ def __update_voters(old_voters, new_voters, revision):
     return summary
 
 
-class SessionsList(ListView):
+class SessionsList(KeysetListView):
     template_name = 'votings/session/all_sessions.html'
     model = VotingCollection
     context_object_name = 'collections'
+    keys = ['time', 'id']
+    filter_form = SessionsFilterForm
+    cache_key = 'votings.collections'
 
-    def get_queryset(self):
-        res = super().get_queryset()
-        return res.order_by('-time')
+    def filter_queryset(self, queryset, data):
+        if data.get('year') is not None:
+            queryset = queryset.filter(time__year=data['year'])
+        if data.get('period') is not None:
+            queryset = queryset.filter(revision__period=data['period'])
+        return queryset
 
 
-class SessionUpdate(PermissionRequiredMixin, UpdateView):
+class SessionUpdate(PermissionRequiredMixin, ClosedSessionMixin, UpdateView):
     # permissions
     permission_required = 'votings.change_votingcollection'
 
     model = VotingCollection
+    collection_lookup = 'id'
     fields = ('name', 'time')
     template_name = 'votings/session/update_session.html'
 
@@ -634,6 +954,42 @@ class SessionUpdate(PermissionRequiredMixin, UpdateView):
         return reverse('session_update', args=[self.object.id])
 
 
+def _session_modified(request, pk):
+    # the timestamp is queried only once for both condition functions
+    if not hasattr(request, 'session_modified'):
+        request.session_modified = collection_modified(pk)
+    return request.session_modified
+
+
+def session_last_modified(request, pk, **kwargs):
+    """Returns the Last-Modified time of a session page, see changes.collection_modified.
+
+    Pages with pending messages are always rendered, otherwise the messages would not be
+    displayed.
+    """
+    if len(messages.get_messages(request)) > 0:
+        return None
+    return _session_modified(request, pk)
+
+
+def session_etag(request, pk, **kwargs):
+    """Returns the ETag of a session page.
+
+    The tag contains the change timestamp of the session and the user, the pages look
+    different for each user (navigation bar, permissions).
+    """
+    modified = session_last_modified(request, pk)
+    if modified is None:
+        return None
+    user_id = request.user.pk if request.user.is_authenticated else 0
+    return '%s.%d' % (modified.timestamp(), user_id)
+
+
+# revalidation of the session pages, a 304 response requires only one query
+session_condition = condition(etag_func=session_etag, last_modified_func=session_last_modified)
+
+
+@method_decorator(session_condition, name='dispatch')
 class SessionDetailView(DetailView):
     model = VotingCollection
 
@@ -646,6 +1002,7 @@ class SessionDetailView(DetailView):
         context['groups'] = groups
         context['option_map'] = option_map
         context['warnings'] = list(map(str, warnings))
+        context['closed'] = get_frozen_results(self.object)
         return context
 
 
@@ -690,143 +1047,148 @@ class SessionDelete(PermissionRequiredMixin, DeleteView):
     template_name = 'votings/session/session_confirm_delete.html'
 
 
-@transaction.atomic
-def session_votes_list(request, pk):
-    collection = get_object_or_404(VotingCollection, pk=pk)
-    all_voters = Voter.objects.filter(
-        revision=collection.revision).order_by('name')
+# number of voters in each block of the votes list, the first block is rendered
+# directly and the others are fetched as JSON when required
+VOTES_LIST_BLOCK_SIZE = 25
+VOTES_LIST_MAX_BLOCK_SIZE = 200
 
-    # get all votings + results
-    median = median_for_evaluation(collection)
-    # fill missing votes with None
-    median.fill_missing_voters(all_voters)
-    schulze = schulze_for_evaluation(collection)
-    schulze.fill_missing_voters(all_voters)
 
-    merged = CombinedVotingResult(median, schulze)
+def votes_list_context(collection, after=None, limit=None):
+    """Returns the context for the votes list template of a collection.
 
-    group_data = for_votes_list_template(merged)
+    The voters are sorted by name and only a block of them is included (keyset
+    pagination): The voters following the voter with id after, at most limit voters.
 
-    warnings = list(map(str, merged.warnings))
-    context = {'groups': group_data, 'voters': all_voters,
-               'collection': collection, 'warnings': warnings}
-
-    return render(request, 'votings/votes/votes_list.html', context)
+    Args:
+        collection (VotingCollection): The collection to list the votes for.
+        after (int or None): The id of the last voter of the previous block, None to
+            start with the first voter.
+        limit (int or None): The maximal number of voters in the block, None for all.
 
-
-def session_results_generalized_view(request, pk, show_votes):
-    collection = get_object_or_404(VotingCollection, pk=pk)
-    all_voters = (Voter.objects
-                  .filter(revision=collection.revision)
-                  .select_related('revision')
-                  .order_by('name'))
-    # required for results methods
-    voters_map = dict()
-    for voter in all_voters:
-        voters_map[voter.id] = voter
+    Returns:
+        dict: The context for votings/votes/votes_list.html. 'next_voter' is the
+            value for after to fetch the next block or None if there are no more voters.
+    """
+    all_voters = get_revision_voters(collection.revision_id)
+    block = all_voters.block(after, limit)
+    # only filter the votes if not all voters are required anyway
+    voters_filter = None if len(block) == len(all_voters) else block
 
     # get all votings + results
-    median = median_for_evaluation(collection)
+    median = median_for_evaluation(collection, voters_filter)
     # fill missing votes with None
-    median.fill_missing_voters(all_voters)
-    schulze = schulze_for_evaluation(collection)
-    schulze.fill_missing_voters(all_voters)
+    median.fill_missing_voters(block)
+    schulze = schulze_for_evaluation(collection, voters_filter)
+    schulze.fill_missing_voters(block)
 
     merged = CombinedVotingResult(median, schulze)
 
-    # create the results objects for evaluation, we store them in a map, we
-    # might use this in a template
-    median_instances = OrderedDict()
-    for median_v_id, median_v in median.votings.items():
-        instance = single_median_statistics(
-            median_v, median.votes[median_v_id], voters_map)
-        median_instances[median_v_id] = instance
-    # same for schulze
-    schulze_instances = OrderedDict()
-    for schulze_v_id, schulze_v in schulze.votings.items():
-        instance = single_schulze_instance(
-            schulze_v,
-            schulze.votes[schulze_v_id],
-            schulze.voting_description[schulze_v_id],
-            voters_map)
-        schulze_instances[schulze_v_id] = instance
-
-    median_results = dict()
-    for median_id, gen_instance in median_instances.items():
-        median_results[median_id] = gen_instance.instance.median(
-            votes_required=gen_instance.majority)
-
-    schulze_results = dict()
-    # also map to list of how many voters (weights) ranked an option before no
-    schulze_num_no = dict()
-    schulze_percent_no = dict()
-    for schulze_id, gen_instance in schulze_instances.items():
-        schulze_votes = gen_instance.instance
-        n = len(schulze.voting_description[schulze_id])
-        s_res = evaluate_schulze(schulze_votes, n)
-        schulze_results[schulze_id] = s_res
-        num, percent = __votes_before_no(s_res, gen_instance.weight_sum)
-        schulze_num_no[schulze_id] = num
-        schulze_percent_no[schulze_id] = percent
-
     group_data = for_votes_list_template(merged)
+    # one row for each voter with all votes already formatted
+    rows = votes_list_rows(merged, block)
+
+    next_voter = None
+    if block and all_voters.positions[block[-1].id] < len(all_voters) - 1:
+        next_voter = block[-1].id
 
     warnings = list(map(str, merged.warnings))
-    context = {
-        'show_votes': show_votes,
-        'voters': all_voters,
-        'collection': collection,
-        'warnings': warnings,
-        'median_results': median_results,
-        'schulze_results': schulze_results,
-        'groups': group_data,
-        'median_instances': median_instances,
-        'schulze_instances': schulze_instances,
-        'median_votings': median,
-        'schulze_votings': schulze,
-        'schulze_num_no': schulze_num_no,
-        'schulze_percent_no': schulze_percent_no}
+    return {'groups': group_data, 'rows': rows, 'next_voter': next_voter,
+            'collection': collection, 'warnings': warnings}
 
-    return render(request, 'votings/results/session_results.html', context)
 
+@session_condition
+@transaction.atomic
+def session_votes_list(request, pk):
+    collection = get_object_or_404(VotingCollection, pk=pk)
+    context = votes_list_context(collection, limit=VOTES_LIST_BLOCK_SIZE)
+    context['block_size'] = VOTES_LIST_BLOCK_SIZE
+    return render(request, 'votings/votes/votes_list.html', context)
 
-def __votes_before_no(schulze_res, weight_sum):
-    num = []
-    percent = []
-    for i in range(len(schulze_res.d)):
-        entry = schulze_res.d[i][-1]
-        num.append(entry)
-        if weight_sum:
-            percent.append((entry / weight_sum) * 100.0)
-        else:
-            percent.append(0.0)
 
-    return num, percent
+@transaction.atomic
+def session_votes_list_rows(request, pk):
+    # returns a block of rows of the votes list as JSON, see votes_list_context
+    collection = get_object_or_404(VotingCollection, pk=pk)
+    try:
+        after = request.GET.get('after', None)
+        after = int(after) if after else None
+        limit = int(request.GET.get('limit', VOTES_LIST_BLOCK_SIZE))
+    except ValueError:
+        return HttpResponseBadRequest('Invalid block')
+    limit = max(1, min(limit, VOTES_LIST_MAX_BLOCK_SIZE))
+    context = votes_list_context(collection, after=after, limit=limit)
+    rows = [[voter.name] + cells for voter, cells in context['rows']]
+    return JsonResponse({
+        'rows': rows,
+        'next': context['next_voter'],
+        'warnings': context['warnings']})
+
+
+def session_results_generalized_view(request, pk, show_votes):
+    collection = get_object_or_404(VotingCollection, pk=pk)
+    context = session_results_context(collection, show_votes)
+    return render(request, 'votings/results/session_results.html', context)
 
 
+@permission_required('votings.change_votingcollection')
+def close_session_view(request, pk):
+    collection = get_object_or_404(VotingCollection, pk=pk)
+    closed = get_frozen_results(collection)
+    if request.method == 'POST':
+        if closed is None:
+            try:
+                close_collection(collection)
+                messages.success(request, 'Die Sitzung wurde abgeschlossen.')
+            except SessionClosedError:
+                pass
+        elif 'reopen' in request.POST:
+            reopen_collection(collection)
+            messages.success(request, 'Die Sitzung wurde wieder geöffnet.')
+        return redirect('session_detail', pk=pk)
+    return render(request, 'votings/session/close_session.html',
+                  {'collection': collection, 'closed': closed})
+
+
+@session_condition
 @transaction.atomic
 def session_results_view(request, pk):
     return session_results_generalized_view(request, pk, False)
 
 
+@session_condition
 @transaction.atomic
 def session_results_votes_view(request, pk):
     return session_results_generalized_view(request, pk, True)
 
 
+def _results_etag(request, pk):
+    collection = VotingCollection.objects.filter(pk=pk).first()
+    if collection is None:
+        return None
+    request.results_collection = collection
+    request.results_version = results_version(collection)
+    return '%s.%d' % (request.results_version, 'votes' in request.GET)
+
+
+@etag(_results_etag)
+def session_results_json(request, pk):
+    # collection and version already computed in _results_etag
+    collection = getattr(request, 'results_collection', None)
+    if collection is None:
+        raise Http404('Session does not exist')
+    show_votes = 'votes' in request.GET
+    return JsonResponse(results_data(collection, show_votes, request.results_version))
+
+
+@method_decorator(session_condition, name='dispatch')
 class SessionPrintView(DetailView):
+    # the sheet is rendered once and then read from the database, see printing
 
     model = VotingCollection
 
-    context_object_name = 'voting_session'
-    template_name = 'votings/session/session_print.html'
-
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        groups, option_map, _ = get_groups_template(self.object, empty_groups=False)
-        context['groups'] = groups
-        context['option_map'] = option_map
-        return context
+    def get(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        return HttpResponse(get_print(self.object))
 
 
 def _get_max_voting_num(group):
@@ -856,14 +1218,21 @@ def _get_max_group_num(collection):
     return max_group
 
 
-class MedianVotingCreateView(PermissionRequiredMixin, CreateView):
+class MedianVotingCreateView(PermissionRequiredMixin, ClosedSessionMixin, CreateView):
     # permissions
     permission_required = 'votings.add_medianvoting'
 
     model = MedianVoting
-    fields = ['name', 'value', 'majority', 'absolute_majority', 'currency']
+    fields = ['name', 'value', 'majority', 'absolute_majority', 'quorum', 'currency']
     template_name = 'votings/voting/median_create.html'
 
+    def get_collection_id(self):
+        # the primary key is the one of the group
+        return (VotingGroup.objects
+                .filter(pk=self.kwargs['pk'])
+                .values_list('collection', flat=True)
+                .first())
+
     @method_decorator(transaction.atomic)
     def dispatch(self, *args, **kwargs):
         return super().dispatch(*args, **kwargs)
@@ -888,6 +1257,9 @@ class MedianVotingCreateView(PermissionRequiredMixin, CreateView):
 @permission_required(('votings.change_votingcollection', 'votings.add_votinggroup'))
 def new_group(request, pk):
     collection = get_object_or_404(VotingCollection, pk=pk)
+    closed = _reject_closed(request, collection.id)
+    if closed is not None:
+        return closed
     if request.method == 'GET':
         form = NewGroupForm()
     else:
@@ -911,12 +1283,15 @@ def new_group(request, pk):
 @transaction.atomic
 @permission_required('votings.add_schulzevoting')
 def create_schulze_view(request, pk):
+    group = get_object_or_404(VotingGroup, pk=pk)
+    closed = _reject_closed(request, group.collection_id)
+    if closed is not None:
+        return closed
     if request.method == 'GET':
         form = SchulzeVotingCreateForm()
     else:
         form = SchulzeVotingCreateForm(request.POST)
         if form.is_valid():
-            group = get_object_or_404(VotingGroup, pk=pk)
             voting = form.save(commit=False)
             voting.group = group
             max_voting_num = _get_max_voting_num(group)